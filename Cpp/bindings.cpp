@@ -0,0 +1,163 @@
+//
+// C interface of the clustering engine, loaded by Python/cpp_engine.py with ctypes.
+// Defines the globals of the engine (otherwise defined in main.cpp), so it is
+// built without main.cpp, output.cpp and stats.cpp.
+//
+
+#include <algorithm>
+#include <chrono>
+#include <cstring>
+#include <vector>
+#include "distance_calculations.h"
+#include "point.h"
+#include "settings.h"
+#include "DBSCAN.h"
+#include "DBSCRN.h"
+
+double big_number = 9999999;
+std::vector<point> points;
+struct settings settings;
+
+int clusters[100000] = {0};
+double reference_values[10000];
+
+static const int MAX_POINTS = sizeof(clusters) / sizeof(clusters[0]);
+static const int MAX_DIMENSIONS = sizeof(reference_values) / sizeof(reference_values[0]);
+
+enum neighbour_list_kind {
+    knn_list, rnn_list, eps_neighborhood_list
+};
+
+static double seconds_since(std::chrono::steady_clock::time_point &from) {
+    std::chrono::steady_clock::time_point now = std::chrono::steady_clock::now();
+    double seconds = std::chrono::duration<double>(now - from).count();
+    from = now;
+    return seconds;
+}
+
+// Loads points from a C-contiguous (point_number, dimensions) buffer, read in
+// place, and sets the reference point values to per-dimension minima.
+static bool load_points(const double *coords, int point_number, int dimensions, int minkowski_power) {
+    if (point_number > MAX_POINTS || dimensions > MAX_DIMENSIONS) return false;
+    points.clear();
+    points.reserve(point_number);
+    std::memset(clusters, 0, sizeof(clusters));
+    for (int j = 0; j < dimensions; j++) reference_values[j] = big_number;
+
+    for (int i = 0; i < point_number; i++) {
+        point p;
+        p.id = i;
+        p.dimensions.assign(coords + (long) i * dimensions, coords + (long) (i + 1) * dimensions);
+        for (int j = 0; j < dimensions; j++) {
+            if (p.dimensions[j] < reference_values[j]) reference_values[j] = p.dimensions[j];
+        }
+        points.push_back(p);
+    }
+    settings.minkowski_distance_order = minkowski_power;
+    return true;
+}
+
+static std::vector<distance_x> sort_by_reference_point(int dimensions) {
+    point reference_point{};
+    for (int i = 0; i < dimensions; i++) {
+        reference_point.dimensions.push_back(reference_values[i]);
+    }
+    return sort_by_ref_point(reference_point);
+}
+
+// Copies cluster numbers (0 for noise), point types (as point_type enum) and
+// distance calculations of the points to the output buffers.
+static void write_results(int *cluster_ids, int *point_types, int *distance_calculations) {
+    int size = points.size();
+    for (int i = 0; i < size; i++) {
+        point &p = points.at(i);
+        if (p.type == noise && clusters[i] != 0 && clusters[i] != -1) p.type = border;
+        cluster_ids[i] = clusters[i];
+        point_types[i] = p.type;
+        distance_calculations[i] = p.distanceCalculationNumber;
+    }
+}
+
+extern "C" {
+
+// runtimes: sorting by reference point distance, neighbourhood calculation and
+// clustering, in seconds. Returns the number of clusters, or -1 if there are
+// more points or dimensions than the engine supports.
+int cluster_dbscan(const double *coords, int point_number, int dimensions, double eps, int min_pts,
+                   int minkowski_power, bool ti, int *cluster_ids, int *point_types,
+                   int *distance_calculations, double *runtimes) {
+    if (!load_points(coords, point_number, dimensions, minkowski_power)) return -1;
+    settings.eps = eps;
+    settings.minPts = min_pts;
+
+    std::chrono::steady_clock::time_point checkpoint = std::chrono::steady_clock::now();
+    if (ti) {
+        std::vector<distance_x> distances = sort_by_reference_point(dimensions);
+        runtimes[0] = seconds_since(checkpoint);
+        calculate_eps_neighborhood_optimized(eps, distances);
+    } else {
+        runtimes[0] = 0;
+        calculate_eps_neighborhood(eps);
+    }
+    runtimes[1] = seconds_since(checkpoint);
+
+    int cluster_number = DBSCAN(min_pts);
+    runtimes[2] = seconds_since(checkpoint);
+    write_results(cluster_ids, point_types, distance_calculations);
+    return cluster_number;
+}
+
+int cluster_dbscanrn(const double *coords, int point_number, int dimensions, int k, int minkowski_power,
+                     bool ti, int *cluster_ids, int *point_types, int *distance_calculations,
+                     double *runtimes) {
+    if (!load_points(coords, point_number, dimensions, minkowski_power)) return -1;
+    settings.k = k;
+
+    std::chrono::steady_clock::time_point checkpoint = std::chrono::steady_clock::now();
+    if (ti) {
+        std::vector<distance_x> distances = sort_by_reference_point(dimensions);
+        runtimes[0] = seconds_since(checkpoint);
+        calculate_knn_optimized(k, distances);
+    } else {
+        runtimes[0] = 0;
+        calculate_knn(k);
+    }
+    runtimes[1] = seconds_since(checkpoint);
+
+    int cluster_number = DBSCRN(k);
+    runtimes[2] = seconds_since(checkpoint);
+    write_results(cluster_ids, point_types, distance_calculations);
+    return cluster_number;
+}
+
+// Neighbour lists (kind: knn_list, rnn_list or eps_neighborhood_list) of the
+// points of the last clustering: lengths are written to `sizes`, then
+// neighbour_lists writes the concatenated lists to `indices`.
+void neighbour_list_sizes(int kind, int *sizes) {
+    int size = points.size();
+    for (int i = 0; i < size; i++) {
+        const point &p = points.at(i);
+        sizes[i] = kind == knn_list ? p.knn.size() : kind == rnn_list ? p.rnn.size() : p.eps_neighborhood.size();
+    }
+}
+
+void neighbour_lists(int kind, int *indices) {
+    int size = points.size();
+    for (int i = 0; i < size; i++) {
+        const point &p = points.at(i);
+        const std::vector<int> &list = kind == knn_list ? p.knn : kind == rnn_list ? p.rnn : p.eps_neighborhood;
+        indices = std::copy(list.begin(), list.end(), indices);
+    }
+}
+
+// Radii of the neighbourhoods of the points of the last clustering, set by
+// TI optimized DBSCANRN (and by DBSCAN without TI, as eps).
+void eps_radii(double *min_eps, double *max_eps) {
+    int size = points.size();
+    for (int i = 0; i < size; i++) {
+        min_eps[i] = points.at(i).min_eps;
+        max_eps[i] = points.at(i).max_eps;
+    }
+}
+
+}
@@ -0,0 +1,182 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from dbscan import EpsNeighbourhoodSweep, assign_clusters_dbscan
+from dbscanrn import KPlusNNSweep
+from neighbour_index import NeighbourIndex, make_neighbour_index
+from profiling import span
+from utils import PointSet
+
+ALGORITHMS = ("dbscan", "dbscanrn")
+
+
+@dataclass
+class ClusteringResult:
+    # Cluster of every point, numbered from 1, -1 for noise
+    cluster_id: np.ndarray
+    # 1 for core, 0 for border, -1 for noise points
+    point_type: np.ndarray
+    # Distance calculations of this call, 0 if neighbourhoods were reused
+    distance_calculations: int
+    # Whether neighbourhoods were derived from ones computed by an earlier call
+    neighbourhoods_cached: bool
+    runtimes: Dict[str, float] = field(default_factory=dict)
+
+
+class ClusteringSession:
+    """
+    Points kept in memory with neighbour indexes (TI reference point order,
+    trees) and the largest neighbourhoods computed so far: k+NN for the largest
+    k and eps neighbourhoods for the largest eps of every index and Minkowski
+    power. Calls of `fit` with a k or eps not greater than these derive
+    neighbourhoods from them instead of searching.
+
+    Not safe for concurrent use.
+    """
+
+    def __init__(
+        self,
+        points: Union[PointSet, np.ndarray],
+        memory_budget_mb: float = 256,
+        workers: int = 1,
+        k_plus_nn_tolerance: float = 10e-9,
+    ):
+        self.points = points if isinstance(points, PointSet) else PointSet(points)
+        self.memory_budget_mb = memory_budget_mb
+        self.workers = workers
+        self.k_plus_nn_tolerance = k_plus_nn_tolerance
+        self.indexes: Dict[Tuple[str, float], NeighbourIndex] = {}
+        self.k_plus_nn: Dict[Tuple[str, float], Tuple[int, KPlusNNSweep]] = {}
+        self.eps_neighbourhoods: Dict[
+            Tuple[str, float], Tuple[float, EpsNeighbourhoodSweep]
+        ] = {}
+
+    def index(self, name: str, m: float) -> NeighbourIndex:
+        if (name, m) not in self.indexes:
+            self.indexes[name, m] = make_neighbour_index(
+                name,
+                self.points,
+                m,
+                memory_budget_mb=self.memory_budget_mb,
+                workers=self.workers,
+            )
+        return self.indexes[name, m]
+
+    def _k_plus_nn_sweep(
+        self, k: int, m: float, index: str
+    ) -> Tuple[KPlusNNSweep, bool]:
+        """
+        :return: k+NN sweep for a k_max >= `k` and whether it was cached.
+        """
+        cached = self.k_plus_nn.get((index, m))
+        if cached is not None and cached[0] >= k:
+            return cached[1], True
+
+        neighbour_index = self.index(index, m)
+        k_plus_nn = neighbour_index.k_plus_nn_distances(k, self.k_plus_nn_tolerance)
+        k_plus_nn_sweep = KPlusNNSweep(
+            k_plus_nn, len(self.points), self.k_plus_nn_tolerance
+        )
+        self.k_plus_nn[index, m] = (k, k_plus_nn_sweep)
+        return k_plus_nn_sweep, False
+
+    def _eps_sweep(
+        self, eps: float, m: float, index: str
+    ) -> Tuple[EpsNeighbourhoodSweep, bool]:
+        """
+        :return: Eps neighbourhood sweep for an eps_max >= `eps` and whether it
+            was cached.
+        """
+        cached = self.eps_neighbourhoods.get((index, m))
+        if cached is not None and cached[0] >= eps:
+            return cached[1], True
+
+        eps_sweep = EpsNeighbourhoodSweep(
+            self.points, m, self.index(index, m).eps_neighbour_indices(eps)
+        )
+        self.eps_neighbourhoods[index, m] = (eps, eps_sweep)
+        return eps_sweep, False
+
+    def fit(
+        self,
+        algorithm: str = "dbscanrn",
+        k: Optional[int] = None,
+        min_pts: Optional[int] = None,
+        eps: Optional[float] = None,
+        m: float = 2,
+        index: Optional[str] = None,
+    ) -> ClusteringResult:
+        """
+        :param algorithm: "dbscanrn" (needs `k`) or "dbscan" (needs `min_pts`
+            and `eps`).
+        :param index: Neighbour index, see `make_neighbour_index`. Defaults to
+            "ti" for DBSCANRN and "brute" for DBSCAN.
+        :return: Clusters and point types, the same as of `dbscan` or of
+            brute-force `dbscanrn` with the same parameters, whatever the index:
+            k+NN are ordered by distance and index (`set_rknn_ti` keeps tied
+            neighbours in search order, which may assign border points to
+            other clusters).
+        """
+        calc_ctr_before = int(self.points.calc_ctr.sum())
+        points = PointSet(self.points.coords, ids=self.points.ids)
+        if algorithm == "dbscanrn":
+            if k is None:
+                raise ValueError("DBSCANRN needs k.")
+            index = "ti" if index is None else index
+            with span("k_plus_nn") as neighbourhood_span:
+                k_plus_nn_sweep, cached = self._k_plus_nn_sweep(k, m, index)
+                k_plus_nn_sweep.set_rknn(points, k)
+            with span("clustering") as clustering_span:
+                assign_clusters_dbscan(
+                    points=points,
+                    core_mask=points.r_k_plus_nn.lengths() >= k,
+                    neighbours_cp=points.r_k_plus_nn,
+                    neighbours_ncp=points.k_plus_nn,
+                )
+        elif algorithm == "dbscan":
+            if min_pts is None or eps is None:
+                raise ValueError("DBSCAN needs min_pts and eps.")
+            index = "brute" if index is None else index
+            with span("eps_neighbourhoods") as neighbourhood_span:
+                eps_sweep, cached = self._eps_sweep(eps, m, index)
+                points.eps_neighbours = eps_sweep.eps_neighbours(eps)
+            with span("clustering") as clustering_span:
+                assign_clusters_dbscan(
+                    points=points,
+                    core_mask=points.eps_neighbours.lengths() >= min_pts,
+                    neighbours_cp=points.eps_neighbours,
+                    neighbours_ncp=points.eps_neighbours,
+                )
+        else:
+            raise ValueError(f"Unknown algorithm: {algorithm}.")
+
+        return ClusteringResult(
+            cluster_id=points.cluster_id,
+            point_type=points.point_type,
+            distance_calculations=int(self.points.calc_ctr.sum()) - calc_ctr_before,
+            neighbourhoods_cached=cached,
+            runtimes={
+                "neighbourhood_calculation": neighbourhood_span.duration,
+                "clustering": clustering_span.duration,
+            },
+        )
+
+
+def fit(
+    X: Union[PointSet, np.ndarray],
+    algorithm: str = "dbscanrn",
+    k: Optional[int] = None,
+    min_pts: Optional[int] = None,
+    eps: Optional[float] = None,
+    m: float = 2,
+    index: Optional[str] = None,
+    memory_budget_mb: float = 256,
+    workers: int = 1,
+) -> ClusteringResult:
+    """
+    Clusters points of `X` (of shape (n, d)) once, see `ClusteringSession.fit`.
+    Use a `ClusteringSession` to cluster the same points repeatedly.
+    """
+    session = ClusteringSession(X, memory_budget_mb=memory_budget_mb, workers=workers)
+    return session.fit(algorithm, k=k, min_pts=min_pts, eps=eps, m=m, index=index)
@@ -0,0 +1,420 @@
+import csv
+import json
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import click
+from progress import configure, log, preserved_configuration
+from run import resolve_index, run, run_output_dir, validate_engine
+from utils import PointSet, load_points
+
+# Keys of a grid file besides "options" (other `run.py` options, fixed for all
+# jobs): lists of datasets, algorithms and values of run.py -k, -e, -p, --m_power
+# and --ti
+GRID_KEYS = ("datasets", "algorithms", "k", "eps", "min_pts", "m", "ti")
+
+# Memory of a worker process with numpy and the clustering modules imported
+WORKER_MEMORY_MB = 120
+
+# Keys of STAT files left out of the summary, as by scripts/read_stat_files.py
+SUMMARY_REDUNDANT_KEYS = (
+    "TI_reference_point",
+    "TI_reference_points",
+    "minkowski_power",
+)
+
+# Columns of the summary printed at the end
+SUMMARY_LOG_COLUMNS = (
+    "input_file",
+    "algorithm",
+    "TI_optimized",
+    "k",
+    "min_samples",
+    "eps",
+    "#_clusters",
+    "RAND",
+    "total_runtime",
+)
+
+
+@dataclass
+class BatchJob:
+    dataset_path: str
+    # Arguments of `run.py`
+    args: List[str]
+    # Directory of its output files
+    output_dir: Path
+    memory_mb: float
+
+    def is_complete(self) -> bool:
+        # STAT file is written after OUT and DEBUG files
+        return (self.output_dir / "STAT.json").exists()
+
+
+def load_grid(grid_path: Path) -> Dict[str, Any]:
+    """
+    :param grid_path: JSON or (with PyYAML installed) YAML file.
+    """
+    with grid_path.open() as grid_file:
+        if grid_path.suffix in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Reading YAML grids needs PyYAML installed.")
+            grid = yaml.safe_load(grid_file)
+        else:
+            grid = json.load(grid_file)
+    unknown_keys = set(grid) - set(GRID_KEYS) - {"options"}
+    if unknown_keys:
+        raise ValueError(f"Unknown grid keys: {', '.join(sorted(unknown_keys))}.")
+    if "datasets" not in grid:
+        raise ValueError("Grid needs datasets.")
+    return grid
+
+
+def expand_grid(grid: Dict[str, Any], output_dir: Path) -> List[BatchJob]:
+    """
+    :return: Job for every combination of grid values: of k for DBSCANRN and of
+        min_pts and eps for DBSCAN, with every dataset, algorithm, m and ti.
+    """
+    values = {
+        key: value if isinstance(value, list) else [value]
+        for key, value in grid.items()
+        if key in GRID_KEYS
+    }
+    options = grid.get("options", {})
+    jobs = []
+    for dataset_path, algorithm, m_power, ti in product(
+        values["datasets"],
+        values.get("algorithms", ["dbscanrn"]),
+        values.get("m", [2.0]),
+        values.get("ti", [False]),
+    ):
+        if algorithm == "dbscanrn":
+            algorithm_params = [{"k": k} for k in values.get("k", [3])]
+        else:
+            algorithm_params = [
+                {"min_pts": min_pts, "eps": eps}
+                for min_pts, eps in product(
+                    values.get("min_pts", [3]), values.get("eps", [2.0])
+                )
+            ]
+        for params in algorithm_params:
+            jobs.append(
+                make_job(
+                    {
+                        **options,
+                        "dataset_path": str(dataset_path),
+                        "output_dir": output_dir,
+                        "algorithm": algorithm,
+                        "m_power": m_power,
+                        "ti": ti,
+                        **params,
+                        "quiet": True,
+                    }
+                )
+            )
+    return jobs
+
+
+def make_job(options: Dict[str, Any]) -> BatchJob:
+    """
+    :param options: Values of `run.py` options, by parameter name.
+    """
+    args = run_args(options)
+    with run.make_context("run", list(args)) as ctx:
+        params = ctx.params
+    index = resolve_index(
+        params["algorithm"], params["index"], params["ti"], params["out_of_core"]
+    )
+    validate_engine(
+        params["engine"],
+        index,
+        params["out_of_core"],
+        params["n_ref_points"],
+        params["ref_point_strategy"],
+        params["knn_cache_dir"],
+    )
+    output_dir = run_output_dir(
+        params["output_dir"],
+        params["algorithm"],
+        Path(params["dataset_path"]).stem,
+        index,
+        k=params["k"],
+        min_pts=params["min_pts"],
+        eps=params["eps"],
+        m_power=params["m_power"],
+        n_ref_points=params["n_ref_points"],
+        ref_point_strategy=params["ref_point_strategy"],
+        recall_target=params["recall_target"],
+        engine=params["engine"],
+    )
+    return BatchJob(
+        params["dataset_path"], args, output_dir, estimate_job_memory_mb(params)
+    )
+
+
+def run_args(options: Dict[str, Any]) -> List[str]:
+    """
+    :return: Command line arguments of `run.py` setting `options`.
+    """
+    params = {param.name: param for param in run.params}
+    args = []
+    for name, value in options.items():
+        if name not in params:
+            raise ValueError(f"Unknown run.py option: {name}.")
+        param = params[name]
+        if isinstance(value, bool):
+            if value:
+                args.append(param.opts[-1])
+            elif param.secondary_opts:
+                args.append(param.secondary_opts[-1])
+        elif value is not None:
+            args.extend([param.opts[-1], str(value)])
+    return args
+
+
+def dataset_shape(dataset_path: str) -> Tuple[int, int]:
+    """
+    :return: Number of points and dimensions, from the header line.
+    """
+    with open(dataset_path) as dataset_file:
+        n, dims = dataset_file.readline().split()[:2]
+    return int(n), int(dims)
+
+
+def estimate_job_memory_mb(params: Dict[str, Any]) -> float:
+    """
+    :return: Rough peak memory of a job besides `WORKER_MEMORY_MB`: points with
+        their per-point arrays, neighbour lists (k+NN and rk+NN, or eps
+        neighbourhoods assumed a few times min_pts long) and distance tiles
+        bounded by the memory budget.
+    """
+    n, dims = dataset_shape(params["dataset_path"])
+    point_bytes = 8 * dims + 64
+    if params["algorithm"] == "dbscanrn":
+        neighbour_bytes = 8 * 5 * params["k"]
+    else:
+        neighbour_bytes = 8 * 4 * params["min_pts"]
+    return n * (point_bytes + neighbour_bytes) / 2**20 + params["memory_budget_mb"]
+
+
+def group_jobs(jobs: Sequence[BatchJob], workers: int) -> List[List[BatchJob]]:
+    """
+    Groups jobs by dataset, so that each group loads its dataset once. Groups
+    are split when there are fewer datasets than workers, to keep all of them
+    busy.
+    """
+    by_dataset: Dict[str, List[BatchJob]] = {}
+    for job in jobs:
+        by_dataset.setdefault(job.dataset_path, []).append(job)
+    splits = max(1, math.ceil(workers / max(1, len(by_dataset))))
+    groups = []
+    for dataset_jobs in by_dataset.values():
+        group_size = math.ceil(len(dataset_jobs) / min(splits, len(dataset_jobs)))
+        for start in range(0, len(dataset_jobs), group_size):
+            groups.append(dataset_jobs[start : start + group_size])
+    # Largest first, so that small groups fill in the remaining memory
+    groups.sort(key=group_memory_mb, reverse=True)
+    return groups
+
+
+def group_memory_mb(group: Sequence[BatchJob]) -> float:
+    return WORKER_MEMORY_MB + max(job.memory_mb for job in group)
+
+
+def run_group(
+    dataset_path: str, jobs_args: List[List[str]]
+) -> List[Tuple[Optional[str], float]]:
+    """
+    Runs jobs on one dataset, loaded once and copied for every job.
+
+    :return: Error (None if the job succeeded) and runtime of every job.
+    """
+    points = load_points(dataset_path)
+    results = []
+    for args in jobs_args:
+        start_time = time.perf_counter()
+        try:
+            # Jobs are quiet, the batch (with a single worker, in this same
+            # process) keeps logging
+            with preserved_configuration(), run.make_context("run", list(args)) as ctx:
+                run.callback(
+                    **ctx.params,
+                    points=PointSet(
+                        points.coords, ids=points.ids, ground_truth=points.ground_truth
+                    ),
+                )
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append((error, time.perf_counter() - start_time))
+    return results
+
+
+def run_batch(
+    jobs: Sequence[BatchJob], workers: int = 1, memory_limit_mb: float = 4096
+) -> Dict[Path, str]:
+    """
+    Runs jobs not complete yet in a pool of `workers` processes, starting
+    groups of jobs only while the sum of their memory estimates fits in
+    `memory_limit_mb` (a single group runs regardless). With a single worker,
+    runs them in this process.
+
+    :return: Status of every job: "skipped", "done" or its error.
+    """
+    statuses = {job.output_dir: "skipped" for job in jobs if job.is_complete()}
+    pending = [job for job in jobs if not job.is_complete()]
+    log(f"{len(pending)} jobs to run, {len(statuses)} complete ones skipped")
+    groups = group_jobs(pending, workers)
+
+    def record(group: List[BatchJob], results: List[Tuple[Optional[str], float]]):
+        for job, (error, runtime) in zip(group, results):
+            statuses[job.output_dir] = error or "done"
+            log(f"{error or 'done'} [{runtime:.1f}s] {job.output_dir}")
+
+    if workers <= 1:
+        for group in groups:
+            record(group, run_group(group[0].dataset_path, [j.args for j in group]))
+        return statuses
+
+    with ProcessPoolExecutor(workers) as pool:
+        running: Dict[Future, List[BatchJob]] = {}
+        while groups or running:
+            used_memory_mb = sum(group_memory_mb(group) for group in running.values())
+            while groups and len(running) < workers:
+                fitting = [
+                    group
+                    for group in groups
+                    if used_memory_mb + group_memory_mb(group) <= memory_limit_mb
+                ]
+                if not fitting and running:
+                    break
+                group = fitting[0] if fitting else groups[0]
+                groups.remove(group)
+                future = pool.submit(
+                    run_group, group[0].dataset_path, [job.args for job in group]
+                )
+                running[future] = group
+                used_memory_mb += group_memory_mb(group)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                record(running.pop(future), future.result())
+    return statuses
+
+
+def summary_rows(jobs: Sequence[BatchJob]) -> List[Dict[str, Any]]:
+    """
+    :return: Rows of STAT files of complete jobs, flattened as by
+        scripts/read_stat_files.py.
+    """
+    rows = []
+    for job in jobs:
+        if not job.is_complete():
+            continue
+        with (job.output_dir / "STAT.json").open() as stat_file:
+            stat_data = json.load(stat_file)
+        row = {}
+        for sub_dict in stat_data.values():
+            row.update(
+                (key, value)
+                for key, value in sub_dict.items()
+                if key not in SUMMARY_REDUNDANT_KEYS
+            )
+        row["input_file"] = Path(row["input_file"]).name.split(".")[0]
+        rows.append(row)
+    return rows
+
+
+def write_summary(rows: Sequence[Dict[str, Any]], summary_path: Path) -> None:
+    """
+    Writes rows to a TSV file, with the union of their keys as columns in order
+    of appearance.
+    """
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    with summary_path.open("w", newline="") as summary_file:
+        writer = csv.DictWriter(summary_file, columns, delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@click.command()
+@click.option(
+    "-g",
+    "--grid_path",
+    type=Path,
+    required=True,
+    help="JSON or YAML file with lists of 'datasets', 'algorithms', 'k', 'eps', "
+    "'min_pts', 'm' and 'ti' values, and 'options' of run.py set for all jobs.",
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    type=Path,
+    required=True,
+    help="Directory where output files will be saved, as by run.py.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes running jobs.",
+)
+@click.option(
+    "--memory_limit_mb",
+    type=float,
+    default=4096,
+    help="Bound on the sum of memory estimates of concurrently running jobs.",
+)
+@click.option(
+    "--summary_path",
+    type=Path,
+    default=None,
+    help="TSV file with a row of STAT values of every complete job, as written "
+    "by scripts/read_stat_files.py. Defaults to 'summary.tsv' in 'output_dir'.",
+)
+@click.option(
+    "--quiet",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, nothing is printed.",
+)
+def batch(
+    grid_path: Path,
+    output_dir: Path,
+    workers: int,
+    memory_limit_mb: float,
+    summary_path: Optional[Path],
+    quiet: bool,
+):
+    """
+    Runs run.py for a grid of datasets and parameters. Jobs on the same dataset
+    share the loaded points and jobs whose output directory holds a STAT file
+    are skipped, so an interrupted batch can be resumed.
+    """
+    configure(quiet=quiet)
+    jobs = expand_grid(load_grid(grid_path), output_dir)
+    statuses = run_batch(jobs, workers, memory_limit_mb)
+
+    rows = summary_rows(jobs)
+    summary_path = summary_path or output_dir / "summary.tsv"
+    write_summary(rows, summary_path)
+    failed = [
+        status for status in statuses.values() if status not in ("done", "skipped")
+    ]
+    log(f"{len(rows)} complete jobs ({len(failed)} failed), summary: {summary_path}")
+    log("\t".join(SUMMARY_LOG_COLUMNS))
+    for row in rows:
+        log("\t".join(str(row.get(column, "")) for column in SUMMARY_LOG_COLUMNS))
+
+
+if __name__ == "__main__":
+    batch()
@@ -0,0 +1,328 @@
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import click
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from dbscan import dbscan  # noqa: E402
+from dbscanrn import dbscanrn  # noqa: E402
+from profiling import peak_rss_mb  # noqa: E402
+from utils import load_points  # noqa: E402
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+DATASETS_DIR = BENCHMARKS_DIR.parents[1] / "datasets"
+SUITES_FILE = BENCHMARKS_DIR / "suites.json"
+GENERATED_DATASETS_DIR = BENCHMARKS_DIR / "data"
+
+ALGORITHMS = ("dbscan", "dbscan_ti", "dbscanrn", "dbscanrn_ti")
+
+# Metrics checked by `compare` besides runtimes of the stages, all of them
+# lower is better.
+COMPARED_METRICS = ("peak_rss_mb", "distance_calculations")
+
+
+def generate_blobs(
+    n: int, dims: int, clusters: int, seed: int = 0, std: float = 1.0
+) -> Dict[str, np.ndarray]:
+    """
+    :return: Gaussian blobs with centres uniform in a cube growing with the
+        number of clusters, and their labels.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, 10 * std * clusters ** (1 / dims), size=(clusters, dims))
+    labels = rng.integers(0, clusters, size=n)
+    coords = centres[labels] + rng.normal(scale=std, size=(n, dims))
+    return {"coords": coords, "ground_truth": labels + 1}
+
+
+def generate_uniform(n: int, dims: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    :return: Points uniform in a unit cube, all labelled 1.
+    """
+    rng = np.random.default_rng(seed)
+    return {"coords": rng.random((n, dims)), "ground_truth": np.ones(n, dtype=int)}
+
+
+GENERATORS = {"blobs": generate_blobs, "uniform": generate_uniform}
+
+
+def dataset_path(name: str, datasets: Dict[str, Dict[str, Any]]) -> Path:
+    """
+    :return: Path of points of a bundled dataset, or of a synthetic one from
+        `datasets` (generated on first use, in the repository format).
+    """
+    if name not in datasets:
+        return DATASETS_DIR / "points" / f"{name}.tsv"
+
+    points_path = GENERATED_DATASETS_DIR / "points" / f"{name}.tsv"
+    if not points_path.exists():
+        spec = dict(datasets[name])
+        generated = GENERATORS[spec.pop("generator")](**spec)
+        coords = generated["coords"]
+        points_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savetxt(
+            points_path,
+            coords,
+            delimiter="\t",
+            header=f"{len(coords)}\t{coords.shape[1]}",
+            comments="",
+        )
+        ground_truth_path = GENERATED_DATASETS_DIR / "ground_truth" / f"{name}.tsv"
+        ground_truth_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savetxt(ground_truth_path, generated["ground_truth"], fmt="%d")
+    return points_path
+
+
+def case_name(case: Dict[str, Any]) -> str:
+    params = "_".join(
+        f"{key}_{value}"
+        for key, value in case.items()
+        if key not in ("dataset", "algorithm")
+    )
+    return f"{case['algorithm']}/{case['dataset']}/{params}"
+
+
+def run_case(case: Dict[str, Any], points_path: str) -> Dict[str, Any]:
+    """
+    Runs one benchmark case, meant to be run in a fresh process so that its
+    peak RSS is measured alone.
+
+    :return: Runtimes of the stages (as in STAT.json), peak RSS and distance
+        calculations.
+    """
+    start_time = time.perf_counter()
+    points = load_points(points_path, cache=False)
+    runtimes = {"1_read_input_file": time.perf_counter() - start_time}
+
+    algorithm = case["algorithm"]
+    m = case.get("m", 2.0)
+    if algorithm in ("dbscan", "dbscan_ti"):
+        runtimes.update(
+            dbscan(points, case["min_pts"], case["eps"], m, ti=algorithm == "dbscan_ti")
+        )
+    elif algorithm in ("dbscanrn", "dbscanrn_ti"):
+        runtimes.update(dbscanrn(points, case["k"], m, ti=algorithm == "dbscanrn_ti"))
+    else:
+        raise ValueError(f"Unknown algorithm: {algorithm}.")
+    runtimes["total_runtime"] = time.perf_counter() - start_time
+
+    return {
+        "runtimes": runtimes,
+        "total_runtime": runtimes["total_runtime"],
+        "peak_rss_mb": peak_rss_mb(),
+        "distance_calculations": int(points.calc_ctr.sum()),
+        "avg_#_of_distance_calculation": float(points.calc_ctr.mean()),
+        "#_clusters": int(len(np.unique(points.cluster_id[points.cluster_id > 0]))),
+    }
+
+
+def run_case_in_process(case: Dict[str, Any], points_path: str) -> Dict[str, Any]:
+    pool = multiprocessing.get_context("spawn").Pool(1)
+    try:
+        return pool.apply(run_case, (case, points_path))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def merge_repeats(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    :return: First result with the minimal runtimes of all of them.
+    """
+    merged = dict(results[0])
+    merged["runtimes"] = {
+        key: min(result["runtimes"][key] for result in results)
+        for key in results[0]["runtimes"]
+    }
+    merged["total_runtime"] = merged["runtimes"]["total_runtime"]
+    merged["peak_rss_mb"] = max(result["peak_rss_mb"] for result in results)
+    merged["repeats"] = len(results)
+    return merged
+
+
+def find_regressions(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = 0.1,
+    min_runtime: float = 0.05,
+) -> List[Dict[str, Any]]:
+    """
+    :param threshold: Relative increase of a metric reported as a regression.
+    :param min_runtime: Runtimes shorter than this (seconds) in both results
+        are not compared, being dominated by noise.
+    :return: Comparison of runtimes of the stages and `COMPARED_METRICS` of
+        cases present in both results.
+    """
+    rows = []
+    for name, current_result in current["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if baseline_result is None:
+            continue
+        metrics = [
+            (stage, baseline_result["runtimes"][stage], runtime)
+            for stage, runtime in current_result["runtimes"].items()
+            if stage in baseline_result["runtimes"]
+            and max(baseline_result["runtimes"][stage], runtime) >= min_runtime
+        ]
+        metrics.extend(
+            (metric, baseline_result[metric], current_result[metric])
+            for metric in COMPARED_METRICS
+        )
+        for metric, old, new in metrics:
+            change = (new - old) / old if old else 0.0
+            rows.append(
+                {
+                    "case": name,
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": change,
+                    "regression": change > threshold,
+                }
+            )
+    return rows
+
+
+def machine_info() -> Dict[str, Any]:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+@click.group()
+def bench():
+    pass
+
+
+@bench.command()
+@click.option(
+    "-s", "--suite", type=str, default="quick", help="Suite from suites.json."
+)
+@click.option(
+    "-o",
+    "--output_json",
+    type=Path,
+    required=True,
+    help="File where results (a baseline for `compare`) will be saved.",
+)
+@click.option(
+    "--dataset",
+    "datasets_filter",
+    type=str,
+    multiple=True,
+    help="If set, only cases on these datasets are run.",
+)
+@click.option(
+    "--algorithm",
+    "algorithms_filter",
+    type=click.Choice(ALGORITHMS),
+    multiple=True,
+    help="If set, only cases of these algorithms are run.",
+)
+@click.option(
+    "--repeats",
+    type=int,
+    default=1,
+    help="Runs of every case; minimal runtimes are reported.",
+)
+@click.option("--suites_file", type=Path, default=SUITES_FILE)
+def run(
+    suite: str,
+    output_json: Path,
+    datasets_filter: List[str],
+    algorithms_filter: List[str],
+    repeats: int,
+    suites_file: Path,
+):
+    """
+    Runs a benchmark suite, every case in a fresh process.
+    """
+    suites = json.loads(suites_file.read_text())
+    cases = [
+        case
+        for case in suites["suites"][suite]
+        if (not datasets_filter or case["dataset"] in datasets_filter)
+        and (not algorithms_filter or case["algorithm"] in algorithms_filter)
+    ]
+
+    results = {}
+    for case in cases:
+        name = case_name(case)
+        points_path = str(dataset_path(case["dataset"], suites["datasets"]))
+        print(f"Running {name}")
+        results[name] = merge_repeats(
+            [run_case_in_process(case, points_path) for _ in range(repeats)]
+        )
+        results[name]["case"] = case
+        print(
+            f"  total {results[name]['total_runtime']:.3f} s, "
+            f"peak RSS {results[name]['peak_rss_mb']:.1f} MB, "
+            f"{results[name]['distance_calculations']} distance calculations"
+        )
+
+    output_json.parent.mkdir(parents=True, exist_ok=True)
+    with output_json.open("w+") as f:
+        json.dump(
+            {"suite": suite, "machine": machine_info(), "results": results},
+            f,
+            indent=4,
+        )
+
+
+@bench.command()
+@click.argument("baseline_json", type=Path)
+@click.argument("current_json", type=Path)
+@click.option(
+    "-t",
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="Relative increase of runtime, peak RSS or distance calculations "
+    "reported as a regression.",
+)
+@click.option(
+    "--min_runtime",
+    type=float,
+    default=0.05,
+    help="Runtimes (seconds) of stages below which they are not compared.",
+)
+def compare(
+    baseline_json: Path,
+    current_json: Path,
+    threshold: float,
+    min_runtime: float,
+):
+    """
+    Compares results with a baseline, exits with status 1 on regressions.
+    """
+    baseline = json.loads(baseline_json.read_text())
+    current = json.loads(current_json.read_text())
+    if baseline.get("machine") != current.get("machine"):
+        print("Warning: results come from different machines.")
+
+    rows = find_regressions(baseline, current, threshold, min_runtime)
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['case']:<45} {row['metric']:<36} {row['baseline']:>12.3f} "
+            f"{row['current']:>12.3f} {row['change']:>+8.1%} {flag}"
+        )
+    regressions = sum(row["regression"] for row in rows)
+    print(f"{regressions} regression(s) in {len(rows)} comparisons")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    bench()
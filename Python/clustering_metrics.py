@@ -1,149 +1,376 @@
 from collections import defaultdict
-from typing import List, Tuple
+from dataclasses import dataclass
+from typing import Optional, Tuple
 
-from scipy.special import comb
-from tqdm import tqdm
-from utils import Point, distance_fn_generator
+import numpy as np
+from distances import DistanceKernel, minkowski_distances
+from progress import progress
+from utils import PointSet
 
 
-def assert_gt_set(points: List[Point]) -> None:
-    assert all(p.ground_truth is not None for p in points)
+def assert_gt_set(points: PointSet) -> None:
+    assert len(points.ground_truth) == len(points)
 
 
-def assert_c_id_set(points: List[Point]) -> None:
-    assert all(p.cluster_id != 0 for p in points)
+def assert_c_id_set(points: PointSet) -> None:
+    assert np.all(points.cluster_id != 0)
 
 
-def purity(points: List[Point]) -> float:
+@dataclass
+class ContingencyTable:
     """
-    :param points: List of Points with cluster_id and ground_truth set.
-    :return: Purity computed for the Points.
+    Sparse contingency table of ground truth classes (rows) and discovered
+    clusters (columns); noise points form a single cluster.
+    """
+
+    counts: np.ndarray  # non-zero cells
+    rows: np.ndarray  # class index of each cell
+    cols: np.ndarray  # cluster index of each cell
+    class_sizes: np.ndarray
+    cluster_sizes: np.ndarray
+
+    @property
+    def n(self) -> int:
+        return int(self.class_sizes.sum())
+
+
+def contingency_table(points: PointSet) -> ContingencyTable:
+    """
+    :param points: Points with cluster_id and ground_truth set.
     """
     assert_gt_set(points)
     assert_c_id_set(points)
 
-    gt_clusters = defaultdict(set)
-    discovered_clusters = defaultdict(set)
-    for p in tqdm(points, desc="Calculating purity..."):
-        gt_clusters[p.ground_truth].add(p.id)
-        discovered_clusters[p.cluster_id].add(p.id)
-
-    total_card = 0
-    for g_cid_set in gt_clusters.values():
-        total_card += max(
-            len(g_cid_set.intersection(c_cid_set))
-            for c_cid_set in discovered_clusters.values()
-        )
-    return total_card / len(points)
+    _, classes = np.unique(points.ground_truth, return_inverse=True)
+    _, clusters = np.unique(points.cluster_id, return_inverse=True)
+    n_clusters = int(clusters.max()) + 1 if len(clusters) else 0
+    cells, counts = np.unique(
+        classes.astype(np.int64) * n_clusters + clusters, return_counts=True
+    )
+    return ContingencyTable(
+        counts=counts,
+        rows=cells // max(n_clusters, 1),
+        cols=cells % max(n_clusters, 1),
+        class_sizes=np.bincount(classes),
+        cluster_sizes=np.bincount(clusters),
+    )
+
+
+def _pairs(sizes: np.ndarray) -> int:
+    """
+    :return: Number of pairs within groups of `sizes`, computed exactly.
+    """
+    sizes = sizes.astype(np.int64)
+    return int((sizes * (sizes - 1) // 2).sum())
+
+
+def purity(points: PointSet, table: Optional[ContingencyTable] = None) -> float:
+    """
+    :param points: Points with cluster_id and ground_truth set.
+    :param table: Contingency table of `points`, computed if None.
+    :return: Purity computed for the Points.
+    """
+    table = contingency_table(points) if table is None else table
+    max_intersections = np.zeros(len(table.class_sizes), dtype=np.int64)
+    np.maximum.at(max_intersections, table.rows, table.counts)
+    return int(max_intersections.sum()) / len(points)
 
 
-def rand(points: List[Point]) -> Tuple[float, int, int, int]:
+def rand(
+    points: PointSet, table: Optional[ContingencyTable] = None
+) -> Tuple[float, int, int, int]:
     """
-    :param points: List of Points with cluster_id and ground_truth set.
+    :param points: Points with cluster_id and ground_truth set.
+    :param table: Contingency table of `points`, computed if None.
     :return: Tuple with rand value, |tp|, |tn| and pairs count.
     """
-    assert_gt_set(points)
-    assert_c_id_set(points)
+    from scipy.special import comb
 
+    table = contingency_table(points) if table is None else table
     count = comb(len(points), 2)
-    tp = 0
-    tn = 0
-    for i in tqdm(range(len(points)), desc="Calculating RAND..."):
-        for j in range(i + 1, len(points)):
-            p1 = points[i]
-            p2 = points[j]
-
-            if p1.cluster_id == p2.cluster_id and p1.ground_truth == p2.ground_truth:
-                tp += 1
-            if p1.cluster_id != p2.cluster_id and p1.ground_truth != p2.ground_truth:
-                tn += 1
-
+    tp = _pairs(table.counts)
+    tn = (
+        len(points) * (len(points) - 1) // 2
+        - _pairs(table.class_sizes)
+        - _pairs(table.cluster_sizes)
+        + tp
+    )
     return (tp + tn) / count, tp, tn, count
 
 
-def silhouette_coefficient(points: List[Point], m: float) -> float:
+def adjusted_rand(points: PointSet, table: Optional[ContingencyTable] = None) -> float:
+    """
+    :param table: Contingency table of `points`, computed if None.
+    :return: Rand index adjusted for chance (Hubert & Arabie).
+    """
+    table = contingency_table(points) if table is None else table
+    n_pairs = len(points) * (len(points) - 1) // 2
+    class_pairs = _pairs(table.class_sizes)
+    cluster_pairs = _pairs(table.cluster_sizes)
+    expected = class_pairs * cluster_pairs / n_pairs if n_pairs else 0.0
+    maximum = (class_pairs + cluster_pairs) / 2
+    if maximum == expected:
+        return 1.0
+    return (_pairs(table.counts) - expected) / (maximum - expected)
+
+
+def _entropy(sizes: np.ndarray) -> float:
+    p = sizes[sizes > 0] / sizes.sum()
+    return float(-(p * np.log(p)).sum())
+
+
+def _mutual_info(table: ContingencyTable) -> float:
+    n = table.n
+    a = table.class_sizes[table.rows].astype(np.float64)
+    b = table.cluster_sizes[table.cols].astype(np.float64)
+    return float(max((table.counts / n * np.log(n * table.counts / (a * b))).sum(), 0))
+
+
+def _expected_mutual_info(table: ContingencyTable) -> float:
+    """
+    :return: Expected mutual information of clusterings with the class and
+        cluster sizes of `table` under the hypergeometric model.
+    """
+    from scipy.special import gammaln
+
+    n = table.n
+    rows, cols = table.class_sizes, table.cluster_sizes
+    if len(rows) > len(cols):
+        rows, cols = cols, rows
+    emi = 0.0
+    for a in rows.tolist():
+        # Every possible cell value n_ij for the row against all columns
+        starts = np.maximum(1, a + cols - n)
+        stops = np.minimum(a, cols)
+        lengths = np.maximum(stops - starts + 1, 0)
+        b = np.repeat(cols, lengths).astype(np.float64)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        nij = (offsets + np.arange(lengths.sum())).astype(np.float64)
+        log_probabilities = (
+            gammaln(a + 1)
+            + gammaln(b + 1)
+            + gammaln(n - a + 1)
+            + gammaln(n - b + 1)
+            - gammaln(n + 1)
+            - gammaln(nij + 1)
+            - gammaln(a - nij + 1)
+            - gammaln(b - nij + 1)
+            - gammaln(n - a - b + nij + 1)
+        )
+        emi += float(
+            (nij / n * np.log(n * nij / (a * b)) * np.exp(log_probabilities)).sum()
+        )
+    return emi
+
+
+def normalized_mutual_info(
+    points: PointSet, table: Optional[ContingencyTable] = None
+) -> float:
+    """
+    :param table: Contingency table of `points`, computed if None.
+    :return: Mutual information normalized by the arithmetic mean of entropies.
+    """
+    table = contingency_table(points) if table is None else table
+    h_classes, h_clusters = _entropy(table.class_sizes), _entropy(table.cluster_sizes)
+    if h_classes == h_clusters == 0:
+        return 1.0
+    return _mutual_info(table) / ((h_classes + h_clusters) / 2)
+
+
+def adjusted_mutual_info(
+    points: PointSet, table: Optional[ContingencyTable] = None
+) -> float:
+    """
+    :param table: Contingency table of `points`, computed if None.
+    :return: Mutual information adjusted for chance (Vinh et al.), with the
+        arithmetic mean of entropies as normalization.
+    """
+    table = contingency_table(points) if table is None else table
+    h_classes, h_clusters = _entropy(table.class_sizes), _entropy(table.cluster_sizes)
+    if h_classes == h_clusters == 0:
+        return 1.0
+    emi = _expected_mutual_info(table)
+    denominator = (h_classes + h_clusters) / 2 - emi
+    eps = np.finfo(np.float64).eps
+    denominator = min(denominator, -eps) if denominator < 0 else max(denominator, eps)
+    return (_mutual_info(table) - emi) / denominator
+
+
+def f_measure(points: PointSet, table: Optional[ContingencyTable] = None) -> float:
+    """
+    :param table: Contingency table of `points`, computed if None.
+    :return: F-measure: mean over ground truth classes, weighted by their sizes,
+        of the best F1 score of matching the class with a discovered cluster.
+    """
+    table = contingency_table(points) if table is None else table
+    f1 = (
+        2
+        * table.counts
+        / (table.class_sizes[table.rows] + table.cluster_sizes[table.cols])
+    )
+    best_f1 = np.zeros(len(table.class_sizes))
+    np.maximum.at(best_f1, table.rows, f1)
+    return float((table.class_sizes * best_f1).sum() / table.n)
+
+
+def silhouette_labels(points: PointSet) -> np.ndarray:
+    """
+    :return: Consecutive cluster labels of the points, with every noise point
+        treated as a separate cluster.
+    """
     assert_c_id_set(points)
-    dist_fn = distance_fn_generator(m=m)
-
-    cluster_id_to_cluster_point_indices = defaultdict(list)
-    for idx, point in enumerate(points):
-        cluster_id_to_cluster_point_indices[point.cluster_id].append(idx)
-    # Treat noise points as separate clusters
-    if -1 in cluster_id_to_cluster_point_indices.keys():
-        noise_point_indices = cluster_id_to_cluster_point_indices.pop(-1)
-        max_cluster_id = max(cluster_id_to_cluster_point_indices.keys())
-        for idx in noise_point_indices:
-            max_cluster_id += 1
-            points[idx].cluster_id = max_cluster_id
-            cluster_id_to_cluster_point_indices[max_cluster_id].append(idx)
-
-    silhouette_coefficients = [0.0 for _ in range(len(points))]
-    for i, point in tqdm(
-        enumerate(points),
+    cluster_ids = points.cluster_id.copy()
+    noise_mask = cluster_ids == -1
+    cluster_ids[noise_mask] = cluster_ids.max() + 1 + np.arange(noise_mask.sum())
+    return np.unique(cluster_ids, return_inverse=True)[1]
+
+
+def silhouette_samples(
+    points: PointSet,
+    m: float,
+    indices: Optional[np.ndarray] = None,
+    memory_budget_mb: float = 256,
+) -> np.ndarray:
+    """
+    Computes silhouette coefficients of points in blocks of rows of the
+    distance matrix, so that blocks fit in `memory_budget_mb`.
+
+    :param indices: Points to compute the coefficients for (all if None).
+    :return: Silhouette coefficients of `indices`.
+    """
+    labels = silhouette_labels(points)
+    cluster_sizes = np.bincount(labels)
+    if len(cluster_sizes) < 2:
+        raise ValueError("Silhouette coefficient requires at least 2 clusters.")
+    kernel = DistanceKernel(points.coords, m)
+    indices = np.arange(len(points)) if indices is None else np.asarray(indices)
+
+    # Columns of distance blocks grouped by cluster, to sum them with reduceat
+    col_order = np.argsort(labels, kind="stable")
+    cluster_starts = np.concatenate([[0], np.cumsum(cluster_sizes)[:-1]])
+    # distance block and cluster sums
+    bytes_per_row = (len(points) + len(cluster_sizes)) * np.dtype(np.float64).itemsize
+    block_size = max(1, int(memory_budget_mb * 2**20 // bytes_per_row))
+
+    silhouette_coefficients = np.zeros(len(indices))
+    for block_start in progress(
+        range(0, len(indices), block_size),
         desc="Calculating silhouette coefficients...",
-        total=len(points),
     ):
-        same_cluster_point_indices = cluster_id_to_cluster_point_indices[
-            point.cluster_id
-        ]
-        same_cluster_point_distances = [
-            dist_fn(points[i], points[j]) for j in same_cluster_point_indices if j != i
-        ]
-        if len(same_cluster_point_distances) > 0:  # check for singleton clusters
-            a = sum(same_cluster_point_distances) / len(same_cluster_point_distances)
-        else:
-            a = 0
-
-        b_candidates = []
-        for c_id, c_indices in cluster_id_to_cluster_point_indices.items():
-            if c_id == point.cluster_id:
-                continue
-            other_cluster_point_indices = cluster_id_to_cluster_point_indices[c_id]
-            other_cluster_point_distances = [
-                dist_fn(points[i], points[j]) for j in other_cluster_point_indices
-            ]
-            b = sum(other_cluster_point_distances) / len(other_cluster_point_distances)
-            b_candidates.append(b)
-        b = min(b_candidates)
-
-        if max(b, a) != 0:
-            silhouette_coefficients[i] = (b - a) / max(b, a)
-        else:
-            silhouette_coefficients[i] = 0
-
-    return sum(silhouette_coefficients) / len(silhouette_coefficients)
-
-
-def davies_bouldin(points: List[Point], m: float) -> float:
+        rows = indices[block_start : block_start + block_size]
+        row_labels = labels[rows]
+        distance_sums = np.add.reduceat(
+            kernel.block(rows, col_order), cluster_starts, axis=1
+        )
+        own_sums = distance_sums[np.arange(len(rows)), row_labels]
+        own_sizes = cluster_sizes[row_labels]
+        # Singleton clusters have a = 0
+        a = np.where(own_sizes > 1, own_sums / np.maximum(own_sizes - 1, 1), 0.0)
+        mean_distances = distance_sums / cluster_sizes
+        mean_distances[np.arange(len(rows)), row_labels] = np.inf
+        b = mean_distances.min(axis=1)
+
+        max_a_b = np.maximum(a, b)
+        silhouette_coefficients[block_start : block_start + len(rows)] = np.where(
+            max_a_b != 0, (b - a) / np.where(max_a_b != 0, max_a_b, 1), 0.0
+        )
+    return silhouette_coefficients
+
+
+def silhouette_coefficient(
+    points: PointSet, m: float, memory_budget_mb: float = 256
+) -> float:
+    """
+    :return: Mean silhouette coefficient of the points; noise points are treated
+        as separate clusters.
+    """
+    return float(
+        silhouette_samples(points, m, memory_budget_mb=memory_budget_mb).mean()
+    )
+
+
+def sampled_silhouette_coefficient(
+    points: PointSet,
+    m: float,
+    sample_size: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    memory_budget_mb: float = 256,
+) -> Tuple[float, float, float]:
+    """
+    Estimates the mean silhouette coefficient from a sample of points stratified
+    by cluster (noise points form one stratum), allocated proportionally to
+    cluster sizes with at least 2 points per stratum.
+
+    :param sample_size: Approximate total number of sampled points.
+    :param confidence: Confidence level of the interval.
+    :param seed: Seed of the sampling, fixed for reproducible results.
+    :return: Estimate and bounds of its confidence interval.
+    """
+    from scipy.special import ndtri
+
     assert_c_id_set(points)
+    rng = np.random.default_rng(seed)
+    strata, strata_indices = np.unique(points.cluster_id, return_inverse=True)
+    strata_sizes = np.bincount(strata_indices)
+    sample_sizes = np.minimum(
+        strata_sizes,
+        np.maximum(2, np.round(sample_size * strata_sizes / len(points)).astype(int)),
+    )
+    samples = [
+        rng.choice(np.flatnonzero(strata_indices == stratum), size, replace=False)
+        for stratum, size in enumerate(sample_sizes.tolist())
+    ]
+    sample_coefficients = silhouette_samples(
+        points, m, np.concatenate(samples), memory_budget_mb
+    )
 
-    dist_fn = distance_fn_generator(m)
+    weights = strata_sizes / len(points)
+    estimate, variance = 0.0, 0.0
+    bounds = np.cumsum([0] + sample_sizes.tolist())
+    for stratum, (start, stop) in enumerate(zip(bounds, bounds[1:])):
+        stratum_coefficients = sample_coefficients[start:stop]
+        estimate += weights[stratum] * stratum_coefficients.mean()
+        if len(stratum_coefficients) > 1:
+            finite_population_correction = (
+                1 - sample_sizes[stratum] / strata_sizes[stratum]
+            )
+            variance += (
+                weights[stratum] ** 2
+                * finite_population_correction
+                * stratum_coefficients.var(ddof=1)
+                / sample_sizes[stratum]
+            )
+    half_width = ndtri(0.5 + confidence / 2) * np.sqrt(variance)
+    return float(estimate), float(estimate - half_width), float(estimate + half_width)
 
-    cluster_id_to_points = defaultdict(list)
-    for point in points:
-        cluster_id_to_points[point.cluster_id].append(point)
+
+def davies_bouldin(points: PointSet, m: float) -> float:
+    assert_c_id_set(points)
+
+    kernel = DistanceKernel(points.coords, m)
+
+    cluster_id_to_point_indices = defaultdict(list)
+    for idx, c_id in enumerate(points.cluster_id.tolist()):
+        cluster_id_to_point_indices[c_id].append(idx)
 
     cluster_centroids = []
     sigmas = []
 
-    for cluster_id, cluster_points in cluster_id_to_points.items():
-        centroid = Point(
-            id=-1,
-            vals=[
-                sum(p.vals[dim] for p in cluster_points) / len(cluster_points)
-                for dim in range(len(points[0].vals))
-            ],
-            cluster_id=cluster_id,
-        )
+    for cluster_point_indices in cluster_id_to_point_indices.values():
+        centroid = kernel.coords[cluster_point_indices].mean(axis=0)
         cluster_centroids.append(centroid)
-        sigma = sum(dist_fn(centroid, p) for p in cluster_points) / len(cluster_points)
-        sigmas.append(sigma)
+        sigma = kernel.point_to_many(centroid, cluster_point_indices).mean()
+        sigmas.append(float(sigma))
 
+    cluster_centroids = np.array(cluster_centroids)
     db_total = 0
     for i in range(len(cluster_centroids)):
+        centroid_distances = minkowski_distances(
+            cluster_centroids[i], cluster_centroids, m
+        )
         db_candidates = [
-            (sigmas[i] + sigmas[j])
-            / (dist_fn(cluster_centroids[i], cluster_centroids[j]))
+            (sigmas[i] + sigmas[j]) / centroid_distances[j]
             for j in range(len(cluster_centroids))
             if i != j
         ]
@@ -0,0 +1,166 @@
+import ctypes
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from profiling import count, span
+from utils import NeighbourLists, PointSet
+
+# Shared library built from Cpp/ with the `clustering` CMake target or:
+# g++ -O2 -shared -fPIC -o Cpp/libclustering.so Cpp/bindings.cpp Cpp/DBSCAN.cpp \
+#     Cpp/DBSCRN.cpp Cpp/distance_calculations.cpp
+CPP_LIBRARY_ENV = "DBSCRN_CPP_LIBRARY"
+DEFAULT_CPP_LIBRARY = (
+    Path(__file__).resolve().parent.parent / "Cpp" / "libclustering.so"
+)
+
+ENGINES = ("python", "cpp")
+
+# Kinds of neighbour lists of `neighbour_lists` in Cpp/bindings.cpp
+_KNN, _RNN, _EPS_NEIGHBOURHOOD = 0, 1, 2
+
+# The engine keeps points in global variables
+_engine_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def load_library(path: Optional[str] = None) -> ctypes.CDLL:
+    """
+    :param path: Path of the shared library, by default taken from the
+        `DBSCRN_CPP_LIBRARY` environment variable or `DEFAULT_CPP_LIBRARY`.
+    """
+    path = path or os.environ.get(CPP_LIBRARY_ENV) or str(DEFAULT_CPP_LIBRARY)
+    if not Path(path).exists():
+        raise OSError(
+            f"C++ engine library {path} not found, build it with the 'clustering' "
+            f"target of CMakeLists.txt or set {CPP_LIBRARY_ENV}."
+        )
+    library = ctypes.CDLL(path)
+    coords = np.ctypeslib.ndpointer(dtype=np.float64, ndim=2, flags="C_CONTIGUOUS")
+    ints = np.ctypeslib.ndpointer(dtype=np.int32, ndim=1, flags="C_CONTIGUOUS")
+    doubles = np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags="C_CONTIGUOUS")
+    c_int, c_double, c_bool = ctypes.c_int, ctypes.c_double, ctypes.c_bool
+    library.cluster_dbscan.argtypes = [
+        coords,
+        c_int,
+        c_int,
+        c_double,
+        c_int,
+        c_int,
+        c_bool,
+        ints,
+        ints,
+        ints,
+        doubles,
+    ]
+    library.cluster_dbscanrn.argtypes = [
+        coords,
+        c_int,
+        c_int,
+        c_int,
+        c_int,
+        c_bool,
+        ints,
+        ints,
+        ints,
+        doubles,
+    ]
+    library.cluster_dbscan.restype = library.cluster_dbscanrn.restype = c_int
+    library.neighbour_list_sizes.argtypes = [c_int, ints]
+    library.neighbour_lists.argtypes = [c_int, ints]
+    library.eps_radii.argtypes = [doubles, doubles]
+    return library
+
+
+def dbscan_cpp(
+    points: PointSet, min_pts: int, eps: float, m: float, ti: bool = False
+) -> Dict[str, float]:
+    """
+    DBSCAN of the C++ engine, see `run_cpp_engine`.
+    """
+    return run_cpp_engine(points, "cluster_dbscan", m, ti, eps, min_pts)
+
+
+def dbscanrn_cpp(
+    points: PointSet, k: int, m: float, ti: bool = False
+) -> Dict[str, float]:
+    """
+    DBSCANRN of the C++ engine (with kNN, i.e. without ties), see
+    `run_cpp_engine`.
+    """
+    return run_cpp_engine(points, "cluster_dbscanrn", m, ti, k)
+
+
+def run_cpp_engine(
+    points: PointSet, function_name: str, m: float, ti: bool, *params
+) -> Dict[str, float]:
+    """
+    Clusters `points` in process with the C++ engine, which reads coordinates
+    from the NumPy buffer, and sets their `cluster_id`, `point_type`,
+    `calc_ctr`, neighbour lists (`k_plus_nn` and `r_k_plus_nn`, or
+    `eps_neighbours`) and, where the engine computes them, `min_eps` and
+    `max_eps` from the arrays it returns.
+
+    :param ti: If True, the engine's TI optimized neighbourhood search is used,
+        with the per-dimension minima as reference point.
+    :return: Runtimes of the stages, as of `dbscan` and `dbscanrn`.
+    """
+    if m != int(m) or m < 1:
+        raise ValueError("C++ engine supports only integer Minkowski powers.")
+    library = load_library()
+    n = len(points)
+    cluster_ids = np.zeros(n, dtype=np.int32)
+    point_types = np.zeros(n, dtype=np.int32)
+    distance_calculations = np.zeros(n, dtype=np.int32)
+    stage_runtimes = np.zeros(3)
+
+    with _engine_lock:
+        with span("cpp_engine"):
+            clusters = getattr(library, function_name)(
+                points.coords,
+                n,
+                points.dims,
+                *params,
+                int(m),
+                ti,
+                cluster_ids,
+                point_types,
+                distance_calculations,
+                stage_runtimes,
+            )
+        if clusters < 0:
+            raise ValueError("Too many points or dimensions for the C++ engine.")
+        if function_name == "cluster_dbscanrn":
+            points.k_plus_nn = _neighbour_lists(library, _KNN, n)
+            points.r_k_plus_nn = _neighbour_lists(library, _RNN, n)
+        else:
+            points.eps_neighbours = _neighbour_lists(library, _EPS_NEIGHBOURHOOD, n)
+        # Left uninitialized by the engine otherwise (and unset by `dbscan`)
+        if ti and function_name == "cluster_dbscanrn":
+            library.eps_radii(points.min_eps, points.max_eps)
+
+    # Engine's noise is cluster 0 and point types are noise, border and core
+    points.cluster_id = np.where(cluster_ids > 0, cluster_ids, -1).astype(np.int64)
+    points.point_type = (point_types - 1).astype(np.int8)
+    points.calc_ctr += distance_calculations
+    count("distance_calculations", points.calc_ctr.sum())
+
+    sort_time, neighbourhood_time, clustering_time = stage_runtimes.tolist()
+    return {
+        "2_sort_by_ref_point_distances": sort_time,
+        "3_eps_neighborhood/rnn_calculation": neighbourhood_time,
+        "4_clustering": clustering_time,
+    }
+
+
+def _neighbour_lists(library: ctypes.CDLL, kind: int, n: int) -> NeighbourLists:
+    sizes = np.zeros(n, dtype=np.int32)
+    library.neighbour_list_sizes(kind, sizes)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    indices = np.zeros(indptr[-1], dtype=np.int32)
+    library.neighbour_lists(kind, indices)
+    return NeighbourLists(indptr, indices.astype(np.int64))
@@ -1,110 +1,387 @@
-import time
-from typing import Callable, Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-from tqdm import tqdm
-from utils import Point, distance_fn_generator
+import kernels
+import numpy as np
+from distances import DEFAULT_BLOCK_ELEMENTS, DistanceKernel, minkowski_from_diff
+from parallel import map_shards
+from profiling import count, span
+from progress import progress
+from utils import NeighbourLists, PointSet
+
+if TYPE_CHECKING:
+    from neighbour_index import NeighbourIndex
+
+# Relative error of reference point distances by which the TI search window is
+# widened, so that rounding does not drop neighbours at distance close to eps.
+TI_WINDOW_TOLERANCE = 1e-9
 
 
 def dbscan(
-    points: List[Point],
+    points: PointSet,
     min_pts: int,
     eps: float,
     m: float,
+    index: Optional["NeighbourIndex"] = None,
+    workers: int = 1,
+    ti: bool = False,
+    ref_point: Optional[np.ndarray] = None,
 ) -> Dict[str, float]:
+    """
+    :param index: Neighbour index computing eps neighbourhoods. If given, `ti`
+        and `ref_point` are ignored.
+    :param workers: Number of processes computing eps neighbourhoods.
+    :param ti: If True, uses TI to restrict the search of eps neighbourhoods,
+        see `eps_neighbour_indices_ti`. Brute force otherwise.
+    :param ref_point: Reference point (or points) of the TI version. Defaults to
+        the per-dimension minima of the points.
+    """
+    point_distance_time = 0.0
     # Determine core points
-    start_time = time.perf_counter()
-    dist_fn = distance_fn_generator(m)
-    eps_neighbours_indices = [
-        get_eps_neighbour_indices(i, points, eps, dist_fn)
-        for i in tqdm(range(len(points)), desc="Determining eps neighbourhoods...")
-    ]
-    eps_neighbourhood_assignment_time = time.perf_counter() - start_time
+    with span("eps_neighbourhoods") as eps_neighbourhood_span:
+        if index is not None:
+            eps_neighbours_indices = index.eps_neighbour_indices(eps)
+        elif ti:
+            if ref_point is None:
+                ref_point = points.coords.min(axis=0)
+            point_distance_time, eps_neighbours_indices = eps_neighbour_indices_ti(
+                points, ref_point, eps, m, workers
+            )
+        else:
+            eps_neighbours_indices = eps_neighbour_indices_brute_force(
+                points, eps, m, workers
+            )
+    count("distance_calculations", points.calc_ctr.sum())
 
     # Group core points in clusters
-    start_time = time.perf_counter()
+    with span("clustering") as clustering_span:
+        points.eps_neighbours = NeighbourLists.from_lists(eps_neighbours_indices)
+        core_mask = points.eps_neighbours.lengths() >= min_pts
 
-    core_point_indices = [
-        i
-        for i, i_eps_neighbours_indices in enumerate(eps_neighbours_indices)
-        if len(i_eps_neighbours_indices) >= min_pts
-    ]
-    core_points = [p for i, p in enumerate(points) if i in core_point_indices]
-    non_core_points = [p for i, p in enumerate(points) if i not in core_point_indices]
-    for i, i_eps_neighbours_indices in enumerate(eps_neighbours_indices):
-        points[i].eps_neighbours = [points[idx] for idx in i_eps_neighbours_indices]
-
-    assign_clusters_dbscan(
-        core_points=core_points,
-        non_core_points=non_core_points,
-        neighbours_getter_cp=lambda p: p.eps_neighbours,
-        neighbours_getter_ncp=lambda p: p.eps_neighbours,
-    )
-    clustering_time = time.perf_counter() - start_time
+        assign_clusters_dbscan(
+            points=points,
+            core_mask=core_mask,
+            neighbours_cp=points.eps_neighbours,
+            neighbours_ncp=points.eps_neighbours,
+        )
 
     return {
-        "2_sort_by_ref_point_distances": 0,
-        "3_eps_neighborhood/rnn_calculation": eps_neighbourhood_assignment_time,
-        "4_clustering": clustering_time,
+        "2_sort_by_ref_point_distances": point_distance_time,
+        "3_eps_neighborhood/rnn_calculation": eps_neighbourhood_span.duration
+        - point_distance_time,
+        "4_clustering": clustering_span.duration,
     }
 
 
 def get_eps_neighbour_indices(
     root_idx: int,
-    points: List[Point],
     eps: float,
-    dist_fn: Callable[[Point, Point], float],
+    kernel: DistanceKernel,
 ) -> List[int]:
-    return [root_idx] + [
-        idx
-        for idx in range(len(points))
-        if (idx != root_idx and dist_fn(points[root_idx], points[idx]) <= eps)
+    others = np.delete(np.arange(len(kernel)), root_idx)
+    distances = kernel.one_to_many(root_idx, others)
+    return [root_idx] + others[distances <= eps].tolist()
+
+
+def eps_neighbour_indices_brute_force(
+    points: PointSet, eps: float, m: float, workers: int = 1
+) -> List[List[int]]:
+    """
+    :param workers: Number of processes sharing the work, see `map_shards`.
+    :return: For every point, its index followed by ascending indices of the
+        other points within `eps`.
+    """
+    eps_neighbours_indices = []
+    for shard_neighbours_indices, shard_calc_ctr in map_shards(
+        _eps_neighbour_indices_task,
+        {"coords": points.coords},
+        len(points),
+        workers,
+        args=(eps, m),
+        desc="Determining eps neighbourhoods...",
+    ):
+        rows = [
+            neighbours_indices[0] for neighbours_indices in shard_neighbours_indices
+        ]
+        points.calc_ctr[rows] += shard_calc_ctr
+        eps_neighbours_indices.extend(shard_neighbours_indices)
+    return eps_neighbours_indices
+
+
+def _eps_neighbour_indices_task(
+    arrays: Dict[str, np.ndarray],
+    rows: range,
+    desc: Optional[str],
+    eps: float,
+    m: float,
+) -> Tuple[List[List[int]], np.ndarray]:
+    kernel = DistanceKernel(
+        arrays["coords"], m, calc_ctr=np.zeros(len(arrays["coords"]), dtype=np.int64)
+    )
+    neighbours_indices = [
+        get_eps_neighbour_indices(i, eps, kernel) for i in progress(rows, desc)
     ]
+    return neighbours_indices, kernel.calc_ctr[rows.start : rows.stop]
+
+
+def sort_by_ref_distance(
+    kernel: DistanceKernel, ref_point: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: Point indices sorted (stably) by distance to `ref_point` and the
+        sorted distances.
+    """
+    ref_distances = kernel.point_to_many(ref_point, count=True)
+    order = np.argsort(ref_distances, kind="stable")
+    return order, ref_distances[order]
+
+
+def eps_neighbour_indices_ti(
+    points: PointSet,
+    ref_point: np.ndarray,
+    eps: float,
+    m: float,
+    workers: int = 1,
+    ref_distances: Optional[Dict[str, np.ndarray]] = None,
+) -> Tuple[float, List[List[int]]]:
+    """
+    Eps neighbourhoods of TI-DBSCAN: by the triangle inequality
+    `|r(p) - r(q)| <= dist(p, q)`, where r is the distance to the reference
+    point, so only points within `eps` of `r(p)` in the order of points sorted
+    by r are compared with p.
+
+    :param ref_point: Reference point of shape (d,) or reference points of shape
+        (r, d). Points are sorted by distance to the first one; the others
+        prune candidates of the window with the lower bound
+        `max_j |dist(p, ref_j) - dist(q, ref_j)|`.
+    :param workers: Number of processes sharing the work, see `map_shards`.
+    :param ref_distances: Order of points and reference point distances, reused
+        or stored as by `set_rknn_ti`.
+    :return: Time of sorting by reference point distance and, the same as of
+        `eps_neighbour_indices_brute_force`, for every point its index followed
+        by ascending indices of the other points within `eps`.
+    """
+    kernel = points.distance_kernel(m)
+    ref_points = np.atleast_2d(ref_point)
+    with span("sort_by_ref_point_distances") as point_distance_span:
+        if ref_distances:
+            arrays = dict(ref_distances)
+        else:
+            order, sorted_ref_distances = sort_by_ref_distance(kernel, ref_points[0])
+            arrays = {"order": order, "sorted_ref_distances": sorted_ref_distances}
+            if len(ref_points) > 1:
+                arrays["extra_ref_distances"] = np.stack(
+                    [kernel.point_to_many(p, count=True) for p in ref_points[1:]],
+                    axis=1,
+                )
+            if ref_distances is not None:
+                ref_distances.update(arrays)
+        arrays["coords"] = points.coords
+
+    eps_neighbours_indices: List[List[int]] = [[] for _ in range(len(points))]
+    for shard_neighbours_indices, shard_calc_ctr, shard_rows in map_shards(
+        _eps_neighbour_indices_ti_task,
+        arrays,
+        len(points),
+        workers,
+        args=(eps, m),
+        desc="Determining eps neighbourhoods using TI...",
+    ):
+        points.calc_ctr[shard_rows] += shard_calc_ctr
+        for neighbours_indices in shard_neighbours_indices:
+            eps_neighbours_indices[neighbours_indices[0]] = neighbours_indices
+    return point_distance_span.duration, eps_neighbours_indices
+
+
+def _eps_neighbour_indices_ti_task(
+    arrays: Dict[str, np.ndarray],
+    positions: range,
+    desc: Optional[str],
+    eps: float,
+    m: float,
+) -> Tuple[List[List[int]], np.ndarray, np.ndarray]:
+    """
+    Searches eps neighbourhoods of points at `positions` of the reference
+    distance order.
+
+    :return: Eps neighbour indices, distance calculations and indices of the
+        points.
+    """
+    coords = arrays["coords"]
+    kernel = DistanceKernel(coords, m, calc_ctr=np.zeros(len(coords), dtype=np.int64))
+    order = arrays["order"]
+    sorted_ref_distances = arrays["sorted_ref_distances"]
+    extra_ref_distances = arrays.get("extra_ref_distances")
+    # Reference distances are rounded, so the window is widened by their error
+    window_eps = eps + TI_WINDOW_TOLERANCE * max(
+        1.0, float(np.abs(sorted_ref_distances).max(initial=0.0))
+    )
+    starts = np.searchsorted(
+        sorted_ref_distances,
+        sorted_ref_distances[positions.start : positions.stop] - window_eps,
+        side="left",
+    )
+    stops = np.searchsorted(
+        sorted_ref_distances,
+        sorted_ref_distances[positions.start : positions.stop] + window_eps,
+        side="right",
+    )
+
+    neighbours_indices = []
+    for i, start, stop in zip(
+        progress(positions, desc), starts.tolist(), stops.tolist()
+    ):
+        point_idx = int(order[i])
+        candidates = np.concatenate([order[start:i], order[i + 1 : stop]])
+        if extra_ref_distances is not None and len(candidates) > 0:
+            lower_bounds = np.abs(
+                extra_ref_distances[candidates] - extra_ref_distances[point_idx]
+            ).max(axis=1)
+            candidates = candidates[lower_bounds <= window_eps]
+        distances = kernel.one_to_many(point_idx, candidates)
+        neighbours_indices.append(
+            [point_idx] + np.sort(candidates[distances <= eps]).tolist()
+        )
+    rows = order[positions.start : positions.stop]
+    return neighbours_indices, kernel.calc_ctr[rows], rows
+
+
+class EpsNeighbourhoodSweep:
+    """
+    Eps neighbourhoods computed once for `eps_max`, with distances, from which
+    neighbourhoods for every eps <= `eps_max` are derived.
+    """
+
+    def __init__(
+        self,
+        points: PointSet,
+        m: float,
+        eps_max_neighbour_indices: List[List[int]],
+        block_elements: int = DEFAULT_BLOCK_ELEMENTS,
+    ):
+        self.n = len(points)
+        neighbour_lists = NeighbourLists.from_lists(
+            [neighbour_indices[1:] for neighbour_indices in eps_max_neighbour_indices]
+        )
+        self.rows = np.repeat(np.arange(self.n), neighbour_lists.lengths())
+        self.indices = neighbour_lists.indices
+        self.distances = np.empty(len(self.indices))
+        block_size = max(1, block_elements // max(1, points.dims))
+        for start in range(0, len(self.indices), block_size):
+            block = slice(start, start + block_size)
+            self.distances[block] = minkowski_from_diff(
+                points.coords[self.indices[block]] - points.coords[self.rows[block]],
+                m,
+            )
+
+    def eps_neighbours(self, eps: float) -> NeighbourLists:
+        """
+        :return: For every point, its index followed by ascending indices of the
+            other points within `eps`.
+        """
+        selected = self.distances <= eps
+        return NeighbourLists.from_edges(
+            np.concatenate([np.arange(self.n), self.rows[selected]]),
+            np.concatenate([np.arange(self.n), self.indices[selected]]),
+            self.n,
+        )
 
 
 def assign_clusters_dbscan(
-    core_points: List[Point],
-    non_core_points: List[Point],
-    neighbours_getter_cp: Callable,
-    neighbours_getter_ncp,
+    points: PointSet,
+    core_mask: np.ndarray,
+    neighbours_cp: NeighbourLists,
+    neighbours_ncp: NeighbourLists,
 ) -> None:
-    for core_point in core_points:
-        core_point.point_type = 1
+    """
+    :param points: Points to assign `cluster_id` and `point_type` to.
+    :param core_mask: Boolean mask of core points.
+    :param neighbours_cp: Neighbours used to expand clusters from core points.
+    :param neighbours_ncp: Neighbours used to assign non-core points to clusters.
+    """
+    expand_clusters(points, core_mask, neighbours_cp)
+    assign_non_core_points(points, core_mask, neighbours_ncp)
 
+
+def expand_clusters(
+    points: PointSet, core_mask: np.ndarray, neighbours_cp: NeighbourLists
+) -> None:
+    """
+    Expands clusters from core points in index order, following core points
+    reachable through `neighbours_cp` (not necessarily symmetric). With the
+    "numba" backend, runs the compiled `kernels.expand_clusters`.
+    """
+    points.point_type[core_mask] = 1
+    cluster_id = points.cluster_id
+    if kernels.get_backend() == "numba":
+        compiled_cluster_id = kernels.compiled("expand_clusters")(
+            np.asarray(neighbours_cp.indptr),
+            np.asarray(neighbours_cp.indices),
+            core_mask,
+        )
+        cluster_id[core_mask] = compiled_cluster_id[core_mask]
+        return
+
+    visited = ~core_mask
     current_cluster_id = 1
-    for core_point in tqdm(core_points, desc="Assigning core points to clusters..."):
-        if core_point.cluster_id == 0:
-            core_point.cluster_id = current_cluster_id
-            queue = [
-                p
-                for p in neighbours_getter_cp(core_point)
-                if (p.point_type == 1 and p.cluster_id == 0)
-            ]
-            while len(queue) > 0:
-                new_points_to_expand = []
-                for point_to_expand in queue:
-                    point_to_expand.cluster_id = current_cluster_id
-                    new_points_to_expand.extend(
-                        [
-                            p
-                            for p in neighbours_getter_cp(point_to_expand)
-                            if (
-                                p.point_type == 1
-                                and p.cluster_id == 0
-                                and p not in new_points_to_expand
-                            )
-                        ]
-                    )
-                queue = new_points_to_expand
-
-            current_cluster_id += 1
-
-    # Assign cluster indices to non-core points
-    for point in tqdm(non_core_points, desc="Assigning non-core points to clusters..."):
-        for neighbour in neighbours_getter_ncp(point):
-            if neighbour.point_type == 1:
-                point.cluster_id = neighbour.cluster_id
-                point.point_type = 0
-                break
-        if point.cluster_id == 0:
-            point.point_type = -1
-            point.cluster_id = -1
+    for core_idx in progress(
+        np.flatnonzero(core_mask).tolist(), desc="Assigning core points to clusters..."
+    ):
+        if visited[core_idx]:
+            continue
+        visited[core_idx] = True
+        frontier = np.array([core_idx])
+        while len(frontier) > 0:
+            cluster_id[frontier] = current_cluster_id
+            neighbours = gather_neighbours(neighbours_cp, frontier)
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+        current_cluster_id += 1
+
+
+def assign_non_core_points(
+    points: PointSet,
+    core_mask: np.ndarray,
+    neighbours_ncp: NeighbourLists,
+    rows_per_chunk: Optional[int] = None,
+) -> None:
+    """
+    Assigns non-core points to the cluster of their first core neighbour in
+    `neighbours_ncp`, or marks them as noise.
+
+    :param rows_per_chunk: If given, neighbour lists are processed in chunks of
+        this many points, e.g. for lists memory-mapped from disk.
+    """
+    point_type = points.point_type
+    cluster_id = points.cluster_id
+    n = len(core_mask)
+    rows_per_chunk = rows_per_chunk or max(1, n)
+    is_border = np.zeros(n, dtype=bool)
+    for chunk_start in range(0, n, rows_per_chunk):
+        chunk_stop = min(chunk_start + rows_per_chunk, n)
+        indptr = neighbours_ncp.indptr[chunk_start : chunk_stop + 1]
+        lengths = np.diff(indptr)
+        sources = np.repeat(np.arange(chunk_start, chunk_stop), lengths)
+        targets = np.asarray(neighbours_ncp.indices[indptr[0] : indptr[-1]])
+        is_border_edge = ~core_mask[sources] & core_mask[targets]
+        border_edges = np.flatnonzero(is_border_edge)
+        border_points, first_edges = np.unique(sources[border_edges], return_index=True)
+        first_core_neighbours = targets[border_edges[first_edges]]
+        cluster_id[border_points] = cluster_id[first_core_neighbours]
+        is_border[border_points] = True
+    point_type[is_border] = 0
+
+    noise_mask = ~core_mask & ~is_border
+    point_type[noise_mask] = -1
+    cluster_id[noise_mask] = -1
+
+
+def gather_neighbours(
+    neighbour_lists: NeighbourLists, indices: np.ndarray
+) -> np.ndarray:
+    """
+    :return: Concatenated neighbour lists of points `indices`.
+    """
+    starts = neighbour_lists.indptr[indices]
+    lengths = neighbour_lists.indptr[indices + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return neighbour_lists.indices[offsets + np.arange(lengths.sum())]
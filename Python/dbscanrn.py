@@ -1,175 +1,625 @@
-import time
+from functools import partial
 from heapq import nsmallest
-from typing import Dict, List, Optional, Tuple
-
-from dbscan import assign_clusters_dbscan
-from tqdm import tqdm
-from utils import Point, distance_fn_generator
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import kernels
+import numpy as np
+from dbscan import assign_clusters_dbscan, sort_by_ref_distance
+from distances import (
+    DEFAULT_BLOCK_ELEMENTS,
+    DistanceKernel,
+    minkowski_from_diff,
+    scalar_minkowski_fn,
+)
+from parallel import map_shards
+from profiling import count, span
+from progress import Progress, progress
+from utils import NeighbourLists, PointSet
+
+if TYPE_CHECKING:
+    from neighbour_index import NeighbourIndex
+
+# Extra nearest candidates selected per point to resolve k+NN ties without
+# sorting the whole distance row.
+K_PLUS_NN_SELECTION_SLACK = 8
+
+REFERENCE_POINT_STRATEGIES = ("min", "max", "random", "farthest")
 
 
 def dbscanrn(
-    points: List[Point],
+    points: PointSet,
     k: int,
     m: float = 2,
     ti: bool = True,
-    ref_point: Optional[Point] = None,
+    ref_point: Optional[np.ndarray] = None,
+    memory_budget_mb: float = 256,
+    ti_stats: Optional[Dict[str, int]] = None,
+    index: Optional["NeighbourIndex"] = None,
+    workers: int = 1,
 ) -> Dict[str, float]:
     """
     :param points: Input examples.
     :param k: Number of the nearest neighbours. It is assumed that point is in it's k neighbours.
     :param m: Power used in Minkowsky distance function.
     :param ti: If True, uses TI for optimized rk+NN computation.
-    :param ref_point: Reference point used by TI optimized version.
+    :param ref_point: Reference point (or points, see `set_rknn_ti`) used by TI
+        optimized version. Defaults to the per-dimension minima of the points.
+    :param memory_budget_mb: Memory bound for distance tiles of brute-force version.
+    :param ti_stats: If given, filled with TI pruning statistics.
+    :param index: Neighbour index computing k+NN. If given, `ti`, `ref_point`,
+        `memory_budget_mb`, `ti_stats` and `workers` are ignored.
+    :param workers: Number of processes computing k+NN.
     """
 
-    if ti:
+    if index is not None:
+        point_distance_time, rknn_time = index.set_rknn(k)
+    elif ti:
+        if ref_point is None:
+            ref_point = points.coords.min(axis=0)
         point_distance_time, rknn_time = set_rknn_ti(
-            points=points, ref_point=ref_point, m=m, k=k
+            points=points,
+            ref_point=ref_point,
+            m=m,
+            k=k,
+            ti_stats=ti_stats,
+            workers=workers,
         )
     else:
-        point_distance_time, rknn_time = set_rknn(points=points, m=m, k=k)
+        point_distance_time, rknn_time = set_rknn(
+            points=points,
+            m=m,
+            k=k,
+            memory_budget_mb=memory_budget_mb,
+            workers=workers,
+        )
 
-    start_time = time.perf_counter()
-    core_points = [p for p in points if len(p.r_k_plus_nn) >= k]
-    non_core_points = [p for p in points if len(p.r_k_plus_nn) < k]
+    count("distance_calculations", points.calc_ctr.sum())
+    count("k_plus_nn_ties", k_plus_nn_ties(points.k_plus_nn, k))
 
-    assign_clusters_dbscan(
-        core_points=core_points,
-        non_core_points=non_core_points,
-        neighbours_getter_cp=lambda p: p.r_k_plus_nn,
-        neighbours_getter_ncp=lambda p: p.k_plus_nn,
-    )
-    clustering_time = time.perf_counter() - start_time
+    with span("clustering") as clustering_span:
+        assign_clusters_dbscan(
+            points=points,
+            core_mask=points.r_k_plus_nn.lengths() >= k,
+            neighbours_cp=points.r_k_plus_nn,
+            neighbours_ncp=points.k_plus_nn,
+        )
 
     return {
         "2_sort_by_ref_point_distances": point_distance_time,
         "3_eps_neighborhood/rnn_calculation": rknn_time,
-        "4_clustering": clustering_time,
+        "4_clustering": clustering_span.duration,
     }
 
 
+def k_plus_nn_ties(k_plus_nn: NeighbourLists, k: int) -> int:
+    """
+    :return: Number of neighbours beyond the k nearest (the point included)
+        added to k+NN lists as tied within the tolerance.
+    """
+    return int(np.maximum(k_plus_nn.lengths() - k, 0).sum())
+
+
 def compute_point_idx_ref_distance_list(
-    points: List[Point], ref_point: Point, m_power: float
+    kernel: DistanceKernel, ref_point: np.ndarray
 ) -> Tuple[float, List[Tuple[int, float]]]:
-    start_time = time.perf_counter()
-
-    dist_fn = distance_fn_generator(m_power)
-    point_idx_ref_dist = sorted(
-        [
-            (i, dist_fn(p, ref_point))
-            for i, p in tqdm(
-                enumerate(points), desc="Calculating reference distances..."
+    with span("sort_by_ref_point_distances") as point_distance_span:
+        order, sorted_ref_distances = sort_by_ref_distance(kernel, ref_point)
+        point_idx_ref_dist = list(zip(order.tolist(), sorted_ref_distances.tolist()))
+
+    return point_distance_span.duration, point_idx_ref_dist
+
+
+def select_reference_points(
+    kernel: DistanceKernel,
+    count: int = 1,
+    strategy: str = "min",
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    :param count: Number of reference points.
+    :param strategy: One of `REFERENCE_POINT_STRATEGIES`:
+        "min"/"max" - min (max) corner of the bounding box, then the opposite
+        corner, then random corners of the bounding box;
+        "random" - random data points;
+        "farthest" - min corner, then farthest-first traversal of data points.
+    :return: Reference points of shape (count, d), primary one first.
+    """
+    coords = kernel.coords
+    rng = np.random.default_rng(seed)
+    min_corner, max_corner = coords.min(axis=0), coords.max(axis=0)
+
+    if strategy in ("min", "max"):
+        corners = [min_corner, max_corner]
+        if strategy == "max":
+            corners.reverse()
+        while len(corners) < count:
+            corners.append(
+                np.where(rng.random(len(min_corner)) < 0.5, min_corner, max_corner)
             )
-        ],
-        key=lambda pair: pair[1],
+        return np.array(corners[:count])
+    if strategy == "random":
+        indices = rng.choice(len(coords), size=min(count, len(coords)), replace=False)
+        return coords[indices].copy()
+    if strategy == "farthest":
+        pivots = [min_corner]
+        min_pivot_distances = kernel.point_to_many(min_corner)
+        while len(pivots) < count:
+            pivot = coords[int(np.argmax(min_pivot_distances))]
+            pivots.append(pivot)
+            np.minimum(
+                min_pivot_distances,
+                kernel.point_to_many(pivot),
+                out=min_pivot_distances,
+            )
+        return np.array(pivots)
+    raise ValueError(f"Unknown reference point strategy: {strategy}.")
+
+
+def k_plus_nn_length(
+    sorted_distances: np.ndarray, k_corrected: int, k_plus_nn_tolerance: float
+) -> int:
+    """
+    :param sorted_distances: Ascending distances to the neighbour candidates.
+    :param k_corrected: Number of nearest neighbours, excluding the point itself.
+    :return: Number of leading candidates forming k+NN: `k_corrected` nearest
+        ones, extended while the next distance is within tolerance of the last.
+    """
+    length = min(k_corrected, len(sorted_distances))
+    while (
+        0 < length < len(sorted_distances)
+        and abs(sorted_distances[length] - sorted_distances[length - 1])
+        < k_plus_nn_tolerance
+    ):
+        length += 1
+    return length
+
+
+def iter_k_plus_nn_brute_force(
+    kernel: DistanceKernel,
+    k: int,
+    k_plus_nn_tolerance: float = 10e-9,
+    memory_budget_mb: float = 256,
+    rows: Optional[range] = None,
+    desc: Optional[str] = "Calculating rK+NN...",
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Computes k+NN of `rows` (all points if None) in blocks of rows, so that
+    distance tiles fit in `memory_budget_mb`. Candidates are selected with
+    partial sorting; ties are ordered by point index. Progress bar is shown
+    unless `desc` is None.
+
+    :return: Iterator of (point index, k+NN indices, k+NN distances), both
+        excluding the point itself and sorted by distance.
+    """
+    n = len(kernel)
+    rows = range(n) if rows is None else rows
+    k_corrected = k - 1  # account for point being it's own kNN
+    n_selected = min(k_corrected + K_PLUS_NN_SELECTION_SLACK, n - 1)
+    # distance tile, its partitioned copy and candidates mask
+    bytes_per_row = n * (2 * np.dtype(np.float64).itemsize + 1)
+    block_size = max(1, int(memory_budget_mb * 2**20 // bytes_per_row))
+
+    with Progress(len(rows), desc) as progress_bar:
+        for block_start in range(rows.start, rows.stop, block_size):
+            block_rows = np.arange(
+                block_start, min(block_start + block_size, rows.stop)
+            )
+            distances = kernel.block(block_rows, skip_self=True)
+            if n_selected > 0:
+                thresholds = np.partition(distances, n_selected - 1, axis=1)[
+                    :, n_selected - 1
+                ]
+                candidates_mask = distances <= thresholds[:, None]
+
+            for row_idx, point_idx in enumerate(block_rows.tolist()):
+                if n_selected == 0:
+                    yield point_idx, np.empty(0, dtype=np.int64), np.empty(0)
+                    continue
+                row_distances = distances[row_idx]
+                candidate_indices = np.flatnonzero(candidates_mask[row_idx])
+                length = None
+                if len(candidate_indices) < n - 1:
+                    order = np.argsort(row_distances[candidate_indices], kind="stable")
+                    candidate_indices = candidate_indices[order]
+                    candidate_distances = row_distances[candidate_indices]
+                    length = k_plus_nn_length(
+                        candidate_distances, k_corrected, k_plus_nn_tolerance
+                    )
+                if length is None or length == len(candidate_indices):
+                    # Ties may continue past the selected candidates
+                    candidate_indices = np.argsort(row_distances, kind="stable")[
+                        : n - 1
+                    ]
+                    candidate_distances = row_distances[candidate_indices]
+                    length = k_plus_nn_length(
+                        candidate_distances, k_corrected, k_plus_nn_tolerance
+                    )
+                yield (
+                    point_idx,
+                    candidate_indices[:length],
+                    candidate_distances[:length],
+                )
+            progress_bar.update(len(block_rows))
+
+
+def assign_k_plus_nn(
+    points: PointSet, k_plus_nn: Iterable[Tuple[int, np.ndarray, np.ndarray]]
+) -> None:
+    """
+    Sets `k_plus_nn` (point itself first) and `r_k_plus_nn` of `points`.
+
+    :param k_plus_nn: Iterable of (point index, k+NN indices, k+NN distances),
+        k+NN excluding the point itself.
+    """
+    k_plus_nn_lists: List[List[int]] = [[] for _ in range(len(points))]
+    r_k_plus_nn_sources, r_k_plus_nn_targets = [], []
+    for i, k_plus_nn_indices, _ in k_plus_nn:
+        k_plus_nn_indices = k_plus_nn_indices.tolist()
+        r_k_plus_nn_sources.extend(k_plus_nn_indices)
+        r_k_plus_nn_targets.extend([i] * len(k_plus_nn_indices))
+        k_plus_nn_lists[i] = [i] + k_plus_nn_indices
+
+    points.k_plus_nn = NeighbourLists.from_lists(k_plus_nn_lists)
+    points.r_k_plus_nn = NeighbourLists.from_edges(
+        r_k_plus_nn_sources, r_k_plus_nn_targets, len(points)
     )
-    point_distance_time = time.perf_counter() - start_time
 
-    return point_distance_time, point_idx_ref_dist
+
+def k_plus_nn_edge_distances(
+    points: PointSet, m: float, block_elements: int = DEFAULT_BLOCK_ELEMENTS
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Distances are not counted in `calc_ctr`.
+
+    :return: Rows, indices and distances of k+NN of the points, excluding the
+        points themselves, sorted by row, distance and index.
+    """
+    k_plus_nn = points.k_plus_nn
+    lengths = k_plus_nn.lengths()
+    rows = np.repeat(np.arange(len(points)), lengths)
+    # Every k+NN list starts with the point itself
+    neighbours = np.ones(len(rows), dtype=bool)
+    neighbours[k_plus_nn.indptr[:-1][lengths > 0]] = False
+    rows, indices = rows[neighbours], k_plus_nn.indices[neighbours]
+
+    distances = np.empty(len(indices))
+    block_size = max(1, block_elements // max(1, points.dims))
+    for start in range(0, len(indices), block_size):
+        block = slice(start, start + block_size)
+        distances[block] = minkowski_from_diff(
+            points.coords[indices[block]] - points.coords[rows[block]], m
+        )
+    order = np.lexsort((indices, distances, rows))
+    return rows[order], indices[order], distances[order]
+
+
+def edge_lists(
+    rows: np.ndarray, indices: np.ndarray, distances: np.ndarray, n: int
+) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    :return: (point index, neighbour indices, distances) of every point, from
+        edges sorted by row, as taken by `KPlusNNSweep`.
+    """
+    bounds = np.searchsorted(rows, np.arange(1, n))
+    return list(zip(range(n), np.split(indices, bounds), np.split(distances, bounds)))
+
+
+class KPlusNNSweep:
+    """
+    k+NN (excluding points themselves, sorted by distance and index) computed
+    once for `k_max`, from which k+NN for every k <= `k_max` are derived: they
+    are prefixes of the k_max+NN lists, extended by the same tie rule.
+    """
+
+    def __init__(
+        self,
+        # (point index, k+NN indices, k+NN distances) in order of points
+        k_max_plus_nn: Sequence[Tuple[int, np.ndarray, np.ndarray]],
+        n: int,
+        k_plus_nn_tolerance: float = 10e-9,
+    ):
+        self.n = n
+        self.k_plus_nn_tolerance = k_plus_nn_tolerance
+        lengths = np.array([len(indices) for _, indices, _ in k_max_plus_nn])
+        self.lengths = lengths
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self.rows = np.repeat(np.arange(n), lengths)
+        self.positions = np.arange(lengths.sum()) - self.starts[self.rows]
+        self.indices = np.concatenate(
+            [np.empty(0, dtype=np.int64)] + [indices for _, indices, _ in k_max_plus_nn]
+        ).astype(np.int64)
+        distances = np.concatenate(
+            [np.empty(0)] + [distances for _, _, distances in k_max_plus_nn]
+        )
+
+        # Number of consecutive candidates tied with their predecessor, from
+        # every position on (ties never cross rows)
+        is_tied = np.zeros(len(distances), dtype=bool)
+        is_tied[1:] = np.abs(np.diff(distances)) < k_plus_nn_tolerance
+        is_tied[self.starts[lengths > 0]] = False
+        not_tied = np.append(np.flatnonzero(~is_tied), len(distances))
+        positions = np.arange(len(distances))
+        self.ties_ahead = not_tied[np.searchsorted(not_tied, positions)] - positions
+
+    def k_plus_nn_lengths(self, k: int) -> np.ndarray:
+        """
+        :return: Lengths of k+NN of the points, see `k_plus_nn_length`.
+        """
+        lengths = np.minimum(k - 1, self.lengths)
+        extended = (lengths > 0) & (lengths < self.lengths)
+        lengths[extended] += self.ties_ahead[self.starts[extended] + lengths[extended]]
+        return lengths
+
+    def set_rknn(self, points: PointSet, k: int) -> None:
+        """
+        Sets `k_plus_nn` (point itself first) and `r_k_plus_nn` of `points`.
+        """
+        selected = self.positions < self.k_plus_nn_lengths(k)[self.rows]
+        rows, indices = self.rows[selected], self.indices[selected]
+        points.k_plus_nn = NeighbourLists.from_edges(
+            np.concatenate([np.arange(self.n), rows]),
+            np.concatenate([np.arange(self.n), indices]),
+            self.n,
+        )
+        points.r_k_plus_nn = NeighbourLists.from_edges(indices, rows, self.n)
 
 
 def set_rknn(
-    points: List[Point],
+    points: PointSet,
     k: int,
     m: float,
     k_plus_nn_tolerance: float = 10e-9,
+    memory_budget_mb: float = 256,
+    workers: int = 1,
 ) -> Tuple[float, float]:
-    start_time = time.perf_counter()
-
-    dist_fn = distance_fn_generator(m)
-    for i in tqdm(range(len(points)), desc="Calculating rK+NN..."):
-        point_idx_to_dist = [
-            (j, dist_fn(points[i], points[j])) for j in range(len(points)) if j != i
-        ]
-
-        k_plus_nn = nsmallest(
-            k - 1, iterable=point_idx_to_dist, key=lambda pair: pair[1]
-        )  # point is in it's rKNN
-
-        point_idx_to_dist = [
-            idx_dist for idx_dist in point_idx_to_dist if idx_dist not in k_plus_nn
-        ]
-        k_plus_nn_candidate = nsmallest(1, point_idx_to_dist, key=lambda pair: pair[1])[
-            0
-        ]
-        while abs(k_plus_nn_candidate[1] - k_plus_nn[-1][1]) < k_plus_nn_tolerance:
-            k_plus_nn.append(k_plus_nn_candidate)
-            point_idx_to_dist = [
-                idx_dist for idx_dist in point_idx_to_dist if idx_dist not in k_plus_nn
-            ]
-            k_plus_nn_candidate = nsmallest(
-                1, point_idx_to_dist, key=lambda pair: pair[1]
-            )[0]
-        k_plus_nn_indices = [neighbour_idx for (neighbour_idx, _) in k_plus_nn]
-
-        for idx in k_plus_nn_indices:
-            if points[idx].r_k_plus_nn is None:
-                points[idx].r_k_plus_nn = [points[i]]
-            else:
-                points[idx].r_k_plus_nn.append(points[i])
+    """
+    Brute-force rk+NN computation.
+
+    :param memory_budget_mb: Memory bound for blocks of the distance matrix (per
+        worker).
+    :param workers: Number of processes computing k+NN of contiguous ranges of
+        points.
+    """
+    with span("rk_plus_nn") as rknn_span:
+        assign_k_plus_nn(
+            points,
+            k_plus_nn_brute_force(
+                points, k, m, k_plus_nn_tolerance, memory_budget_mb, workers
+            ),
+        )
+    return 0, rknn_span.duration
+
 
-        points[i].k_plus_nn = [points[i]] + [points[idx] for idx in k_plus_nn_indices]
+def k_plus_nn_brute_force(
+    points: PointSet,
+    k: int,
+    m: float,
+    k_plus_nn_tolerance: float = 10e-9,
+    memory_budget_mb: float = 256,
+    workers: int = 1,
+) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Computes k+NN of all points, see `iter_k_plus_nn_brute_force`, accounting
+    distance calculations in `calc_ctr` of the points.
 
-    for point in points:
-        if point.r_k_plus_nn is None:
-            point.r_k_plus_nn = []
-    rknn_time = time.perf_counter() - start_time
-    return 0, rknn_time
+    :return: (point index, k+NN indices, k+NN distances) for every point, in
+        order of points.
+    """
+    k_plus_nn = []
+    for shard_k_plus_nn, shard_calc_ctr in map_shards(
+        _k_plus_nn_brute_force_task,
+        {"coords": points.coords},
+        len(points),
+        workers,
+        args=(k, m, k_plus_nn_tolerance, memory_budget_mb),
+        desc="Calculating rK+NN...",
+    ):
+        points.calc_ctr[[i for i, _, _ in shard_k_plus_nn]] += shard_calc_ctr
+        k_plus_nn.extend(shard_k_plus_nn)
+    return k_plus_nn
+
+
+def _k_plus_nn_brute_force_task(
+    arrays: Dict[str, np.ndarray],
+    rows: range,
+    desc: Optional[str],
+    k: int,
+    m: float,
+    k_plus_nn_tolerance: float,
+    memory_budget_mb: float,
+) -> Tuple[List[Tuple[int, np.ndarray, np.ndarray]], np.ndarray]:
+    kernel = DistanceKernel(
+        arrays["coords"], m, calc_ctr=np.zeros(len(arrays["coords"]), dtype=np.int64)
+    )
+    k_plus_nn = list(
+        iter_k_plus_nn_brute_force(
+            kernel, k, k_plus_nn_tolerance, memory_budget_mb, rows, desc
+        )
+    )
+    return k_plus_nn, kernel.calc_ctr[rows.start : rows.stop]
 
 
 def set_rknn_ti(
-    points: List[Point],
-    ref_point: Point,
+    points: PointSet,
+    ref_point: np.ndarray,
     k: int,
     m: float = 2.0,
     k_plus_nn_tolerance: float = 10e-9,
+    ti_stats: Optional[Dict[str, int]] = None,
+    workers: int = 1,
+    ref_distances: Optional[Dict[str, np.ndarray]] = None,
 ) -> Tuple[float, float]:
-    (
-        point_distance_time,
-        point_idx_ref_dist,
-    ) = compute_point_idx_ref_distance_list(points, ref_point, m)
+    """
+    :param ref_point: Reference point of shape (d,) or reference points of shape
+        (r, d). Points are sorted by distance to the first one; the others
+        prune candidates with the triangle inequality lower bound
+        `max_j |dist(p, ref_j) - dist(q, ref_j)|`.
+    :param ti_stats: If given, filled with statistics of pruning with the extra
+        reference points.
+    :param workers: Number of processes computing k+NN of contiguous ranges of
+        the points sorted by reference point distance.
+    :param ref_distances: If given, the order of points and their reference
+        point distances are taken from it when present, and stored in it
+        otherwise, so that later calls with the same points and reference
+        points skip computing them.
+    """
+    kernel = points.distance_kernel(m)
+    ref_points = np.atleast_2d(ref_point)
+    with span("sort_by_ref_point_distances") as point_distance_span:
+        if ref_distances:
+            arrays = dict(ref_distances)
+        else:
+            order, sorted_ref_distances = sort_by_ref_distance(kernel, ref_points[0])
+            arrays = {"order": order, "sorted_ref_distances": sorted_ref_distances}
+            if len(ref_points) > 1:
+                arrays["extra_ref_distances"] = np.stack(
+                    [kernel.point_to_many(p, count=True) for p in ref_points[1:]],
+                    axis=1,
+                )
+            if ref_distances is not None:
+                ref_distances.update(arrays)
+        arrays["coords"] = points.coords
+
+    with span("rk_plus_nn_ti") as rknn_span:
+        shard_results = map_shards(
+            _k_plus_nn_ti_task,
+            arrays,
+            len(points),
+            workers,
+            args=(k, m, k_plus_nn_tolerance, kernels.get_backend()),
+            desc="Calculating rK+NN using TI...",
+        )
+        pruned_candidates = visited_candidates = 0
+        k_plus_nn_lists: List[List[int]] = [[] for _ in range(len(points))]
+        r_k_plus_nn_sources, r_k_plus_nn_targets = [], []
+        for shard_k_plus_nn, shard_calc_ctr, shard_pruned_candidates in shard_results:
+            pruned_candidates += shard_pruned_candidates
+            # Every candidate visited along the order is pruned or compared
+            visited_candidates += shard_pruned_candidates + int(shard_calc_ctr.sum())
+            for point_k_plus_nn, calc_ctr in zip(
+                shard_k_plus_nn, shard_calc_ctr.tolist()
+            ):
+                current_point_idx, k_plus_nn_indices, min_eps, max_eps = point_k_plus_nn
+                points.calc_ctr[current_point_idx] += calc_ctr
+                points.min_eps[current_point_idx] = min_eps
+                points.max_eps[current_point_idx] = max_eps
+                r_k_plus_nn_sources.extend(k_plus_nn_indices)
+                r_k_plus_nn_targets.extend([current_point_idx] * len(k_plus_nn_indices))
+                k_plus_nn_lists[current_point_idx] = [
+                    current_point_idx,
+                    *k_plus_nn_indices,
+                ]
+
+        points.k_plus_nn = NeighbourLists.from_lists(k_plus_nn_lists)
+        points.r_k_plus_nn = NeighbourLists.from_edges(
+            r_k_plus_nn_sources, r_k_plus_nn_targets, len(points)
+        )
+
+    count("ti_visited_candidates", visited_candidates)
+    count("ti_pruned_candidates", pruned_candidates)
+
+    if ti_stats is not None and len(ref_points) > 1:
+        extra_ref_distance_calcs = len(points) * (len(ref_points) - 1)
+        ti_stats.update(
+            {
+                "#_TI_reference_points": len(ref_points),
+                "#_TI_pruned_candidates": pruned_candidates,
+                "#_TI_extra_reference_distance_calculations": extra_ref_distance_calcs,
+                "#_TI_saved_distance_calculations": pruned_candidates
+                - extra_ref_distance_calcs,
+            }
+        )
+
+    return point_distance_span.duration, rknn_span.duration
+
 
-    start_time = time.perf_counter()
-    for i in tqdm(range(len(points)), desc="Calculating rK+NN using TI..."):
-        current_point_idx, current_point_ref_dist = point_idx_ref_dist[i]
-        current_point = points[current_point_idx]
+def _k_plus_nn_ti_task(
+    arrays: Dict[str, np.ndarray],
+    positions: range,
+    desc: Optional[str],
+    k: int,
+    m: float,
+    k_plus_nn_tolerance: float,
+    backend: str = "python",
+) -> Tuple[List[Tuple[int, List[int], float, float]], np.ndarray, int]:
+    """
+    Searches k+NN of points at `positions` of the reference distance order.
 
-        dist_fn = distance_fn_generator(m)
-        _, current_point_ref_dist = point_idx_ref_dist[i]
+    :param backend: One of `kernels.BACKENDS`; "numba" runs the compiled
+        `kernels.k_plus_nn_ti`.
+    :return: (point index, k+NN indices, min eps, max eps) of every point,
+        distance calculations of every point and number of candidates pruned
+        with the extra reference points.
+    """
+    if backend == "numba":
+        return _k_plus_nn_ti_compiled(arrays, positions, k, m, k_plus_nn_tolerance)
+
+    coords = arrays["coords"]
+    n, dims = coords.shape
+    # Distances are computed one pair at a time, where NumPy call overhead
+    # dominates for low dimensional points
+    distance = scalar_minkowski_fn(m, dims)
+    if distance is None:
+        rows, distance = coords, partial(_pair_distance, m=m)
+    else:
+        rows = coords.tolist()
+    calc_ctr = np.zeros(n, dtype=np.int64)
+    order = arrays["order"].tolist()
+    sorted_ref_distances = arrays["sorted_ref_distances"].tolist()
+    extra_ref_distances = arrays.get("extra_ref_distances")
+    if extra_ref_distances is not None:
+        extra_ref_distances = extra_ref_distances.tolist()
+
+    pruned_candidates = 0
+    k_plus_nn = []
+    for i in progress(positions, desc):
+        current_point_idx, current_point_ref_dist = order[i], sorted_ref_distances[i]
+        current_point = rows[current_point_idx]
+        calcs = 0
 
         prev_idx_diff = 1
         next_idx_diff = 1
         search_prev = (i - prev_idx_diff) >= 0
-        search_next = (i + next_idx_diff) <= (len(points) - 1)
+        search_next = (i + next_idx_diff) <= (n - 1)
 
         candidate_point_real_dist: List[Tuple[int, float]] = []
         eps = 0.0
+        max_eps = np.nan
         stop_search = False
         k_corrected = k - 1  # account for point being it's own kNN
 
         while len(candidate_point_real_dist) < k_corrected or not stop_search:
             if len(candidate_point_real_dist) == k_corrected:
                 eps = max(candidate_point_real_dist, key=lambda pair: pair[1])[1]
-                current_point.max_eps = eps
+                max_eps = eps
 
             if not search_prev and search_next:
                 go_next = True
                 pessimistic_estimation = (
-                    point_idx_ref_dist[i + next_idx_diff][1] - current_point_ref_dist
+                    sorted_ref_distances[i + next_idx_diff] - current_point_ref_dist
                 )
 
             elif search_prev and not search_next:
                 go_next = False
                 pessimistic_estimation = (
-                    current_point_ref_dist - point_idx_ref_dist[i - prev_idx_diff][1]
+                    current_point_ref_dist - sorted_ref_distances[i - prev_idx_diff]
                 )
 
             elif search_prev and search_next:
                 ref_dist_diff_next = (
-                    point_idx_ref_dist[i + next_idx_diff][1] - current_point_ref_dist
+                    sorted_ref_distances[i + next_idx_diff] - current_point_ref_dist
                 )
                 ref_dist_diff_prev = (
-                    current_point_ref_dist - point_idx_ref_dist[i - prev_idx_diff][1]
+                    current_point_ref_dist - sorted_ref_distances[i - prev_idx_diff]
                 )
                 if ref_dist_diff_next < ref_dist_diff_prev:
                     go_next = True
@@ -193,17 +643,37 @@ def set_rknn_ti(
                 stop_search = True
 
             else:
-                current_candidate_idx = point_idx_ref_dist[current_ref_dist_idx][0]
-                current_candidate_point = points[current_candidate_idx]
-                current_point_real_dist = dist_fn(
-                    current_point, current_candidate_point
-                )
+                current_candidate_idx = order[current_ref_dist_idx]
+                if (
+                    extra_ref_distances is not None
+                    and len(candidate_point_real_dist) >= k_corrected
+                    and max(
+                        [
+                            abs(a - b)
+                            for a, b in zip(
+                                extra_ref_distances[current_point_idx],
+                                extra_ref_distances[current_candidate_idx],
+                            )
+                        ]
+                    )
+                    > eps + k_plus_nn_tolerance
+                ):
+                    # Lower bound from the other reference points exceeds eps
+                    pruned_candidates += 1
 
-                if len(candidate_point_real_dist) < k_corrected:
+                elif len(candidate_point_real_dist) < k_corrected:
+                    calcs += 1
                     candidate_point_real_dist.append(
-                        (current_candidate_idx, current_point_real_dist)
+                        (
+                            current_candidate_idx,
+                            distance(current_point, rows[current_candidate_idx]),
+                        )
                     )
                 else:
+                    calcs += 1
+                    current_point_real_dist = distance(
+                        current_point, rows[current_candidate_idx]
+                    )
                     # Account for floating point errors
                     if (
                         current_point_real_dist < eps
@@ -218,7 +688,7 @@ def set_rknn_ti(
                         )[-1]
                 if go_next:
                     next_idx_diff += 1
-                    search_next = (i + next_idx_diff) <= (len(points) - 1)
+                    search_next = (i + next_idx_diff) <= (n - 1)
                 else:
                     prev_idx_diff += 1
                     search_prev = (i - prev_idx_diff) >= 0
@@ -243,20 +713,58 @@ def set_rknn_ti(
         else:
             k_plus_nn_idx_dist = candidate_point_real_dist
 
-        current_point.min_eps = eps
+        k_plus_nn.append(
+            (
+                current_point_idx,
+                [neighbour_idx for (neighbour_idx, _) in k_plus_nn_idx_dist],
+                eps,
+                max_eps,
+            )
+        )
+        calc_ctr[current_point_idx] = calcs
 
-        k_plus_nn = [points[neighbour_idx] for (neighbour_idx, _) in k_plus_nn_idx_dist]
-        for neighbour in k_plus_nn:
-            if neighbour.r_k_plus_nn is None:
-                neighbour.r_k_plus_nn = [current_point]
-            else:
-                neighbour.r_k_plus_nn.append(current_point)
+    return (
+        k_plus_nn,
+        calc_ctr[order[positions.start : positions.stop]],
+        pruned_candidates,
+    )
 
-        current_point.k_plus_nn = [current_point] + k_plus_nn
 
-    for point in points:
-        if point.r_k_plus_nn is None:
-            point.r_k_plus_nn = []
-    rknn_time = time.perf_counter() - start_time
+def _pair_distance(x: np.ndarray, y: np.ndarray, m: float) -> float:
+    return float(minkowski_from_diff(y - x, m))
 
-    return point_distance_time, rknn_time
+
+def _k_plus_nn_ti_compiled(
+    arrays: Dict[str, np.ndarray],
+    positions: range,
+    k: int,
+    m: float,
+    k_plus_nn_tolerance: float,
+) -> Tuple[List[Tuple[int, List[int], float, float]], np.ndarray, int]:
+    n = len(arrays["coords"])
+    extra_ref_distances = arrays.get("extra_ref_distances")
+    if extra_ref_distances is None:
+        extra_ref_distances = np.empty((n, 0))
+    order = arrays["order"]
+    indptr, indices, min_eps, max_eps, calc_ctr, pruned_candidates = kernels.compiled(
+        "k_plus_nn_ti"
+    )(
+        arrays["coords"],
+        order,
+        arrays["sorted_ref_distances"],
+        extra_ref_distances,
+        positions.start,
+        positions.stop,
+        k,
+        float(m),
+        k_plus_nn_tolerance,
+    )
+    k_plus_nn = list(
+        zip(
+            order[positions.start : positions.stop].tolist(),
+            np.split(indices, indptr[1:-1]),
+            min_eps.tolist(),
+            max_eps.tolist(),
+        )
+    )
+    return k_plus_nn, calc_ctr, pruned_candidates
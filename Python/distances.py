@@ -0,0 +1,197 @@
+import math
+from typing import Callable, Optional, Sequence, Union
+
+import numpy as np
+
+# Upper bound on the number of float64 elements of a single intermediate tile
+# materialised by block computations (~512KB, so that tiles stay in cache).
+DEFAULT_BLOCK_ELEMENTS = 2**16
+
+Indices = Union[Sequence[int], np.ndarray, None]
+
+# Up to these numbers of dimensions, distances of single pairs of points are
+# faster in pure Python than through NumPy calls (math.dist for m = 2)
+SCALAR_EUCLIDEAN_MAX_DIMS = 256
+SCALAR_MINKOWSKI_MAX_DIMS = 32
+
+
+def minkowski_from_diff(diff: np.ndarray, m: float) -> np.ndarray:
+    """
+    :param diff: Array of coordinate differences, dimensions in the last axis.
+    :param m: Power used in Minkowsky distance function.
+    :return: Minkowsky distances reduced over the last axis.
+    """
+    if m == 2:
+        return np.sqrt(np.einsum("...i,...i->...", diff, diff))
+    abs_diff = np.abs(diff)
+    if m == 1:
+        return abs_diff.sum(axis=-1)
+    if np.isinf(m):
+        return abs_diff.max(axis=-1)
+    return (abs_diff**m).sum(axis=-1) ** (1 / m)
+
+
+def scalar_minkowski_fn(
+    m: float, dims: int
+) -> Optional[Callable[[Sequence[float], Sequence[float]], float]]:
+    """
+    :param m: Power used in Minkowsky distance function.
+    :param dims: Number of dimensions of the points.
+    :return: Distance function of two points given as lists of coordinates,
+        or None if NumPy is faster for points with `dims` dimensions.
+    """
+    if m == 2:
+        return math.dist if dims <= SCALAR_EUCLIDEAN_MAX_DIMS else None
+    if dims > SCALAR_MINKOWSKI_MAX_DIMS:
+        return None
+    if m == 1:
+        return lambda x, y: sum([abs(a - b) for a, b in zip(x, y)])
+    if math.isinf(m):
+        return lambda x, y: max([abs(a - b) for a, b in zip(x, y)])
+    return lambda x, y: sum([abs(a - b) ** m for a, b in zip(x, y)]) ** (1 / m)
+
+
+def minkowski_distances(x: np.ndarray, others: np.ndarray, m: float) -> np.ndarray:
+    """
+    :param x: Single point of shape (d,).
+    :param others: Points of shape (n, d).
+    :param m: Power used in Minkowsky distance function.
+    :return: Distances of shape (n,) between `x` and each of `others`.
+    """
+    return minkowski_from_diff(others - x, m)
+
+
+def minkowski_distance_matrix(
+    a: np.ndarray,
+    b: np.ndarray,
+    m: float,
+    block_elements: int = DEFAULT_BLOCK_ELEMENTS,
+) -> np.ndarray:
+    """
+    Accumulates distances dimension by dimension over (rows, n_b) tiles, which
+    avoids materialising (rows, n_b, d) difference tensors.
+
+    :param a: Points of shape (n_a, d).
+    :param b: Points of shape (n_b, d).
+    :param m: Power used in Minkowsky distance function.
+    :param block_elements: Memory bound for intermediate tiles.
+    :return: Distance matrix of shape (n_a, n_b).
+    """
+    n_a, n_b = len(a), len(b)
+    out = np.zeros((n_a, n_b), dtype=np.float64)
+    b_columns = np.ascontiguousarray(b.T)
+    rows_per_block = max(1, block_elements // max(1, n_b))
+    for start in range(0, n_a, rows_per_block):
+        stop = min(start + rows_per_block, n_a)
+        acc = out[start:stop]
+        tmp = np.empty_like(acc)
+        for dim in range(a.shape[1]):
+            np.subtract(a[start:stop, dim, None], b_columns[dim][None, :], out=tmp)
+            if m == 2:
+                np.multiply(tmp, tmp, out=tmp)
+            else:
+                np.abs(tmp, out=tmp)
+                if np.isinf(m):
+                    np.maximum(acc, tmp, out=acc)
+                    continue
+                if m != 1:
+                    np.power(tmp, m, out=tmp)
+            acc += tmp
+        if m == 2:
+            np.sqrt(acc, out=acc)
+        elif m != 1 and not np.isinf(m):
+            np.power(acc, 1 / m, out=acc)
+    return out
+
+
+class DistanceKernel:
+    """
+    Batched Minkowsky distances over a contiguous float64 coordinate matrix.
+
+    Every distance computed from a point of the matrix is accounted in
+    `calc_ctr` of that point (if counters are given), the same way
+    `distance_fn_generator` counts calls for its first argument.
+    """
+
+    def __init__(
+        self,
+        coords: np.ndarray,
+        m: float,
+        calc_ctr: Optional[np.ndarray] = None,
+        block_elements: int = DEFAULT_BLOCK_ELEMENTS,
+    ):
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.m = m
+        self.calc_ctr = calc_ctr
+        self.block_elements = block_elements
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def _select(self, indices: Indices) -> np.ndarray:
+        if indices is None:
+            return self.coords
+        return self.coords[np.asarray(indices, dtype=np.intp)]
+
+    def pair(self, i: int, j: int) -> float:
+        if self.calc_ctr is not None:
+            self.calc_ctr[i] += 1
+        return float(minkowski_from_diff(self.coords[j] - self.coords[i], self.m))
+
+    def one_to_many(self, i: int, indices: Indices = None) -> np.ndarray:
+        """
+        :return: Distances between point `i` and points `indices` (all if None).
+        """
+        others = self._select(indices)
+        if self.calc_ctr is not None:
+            self.calc_ctr[i] += len(others)
+        return minkowski_distances(self.coords[i], others, self.m)
+
+    def one_to_points(self, i: int, others: np.ndarray) -> np.ndarray:
+        """
+        :param others: Points from outside of the matrix, e.g. tree node centres.
+        :return: Distances between point `i` and `others`.
+        """
+        if self.calc_ctr is not None:
+            self.calc_ctr[i] += len(others)
+        return minkowski_distances(self.coords[i], others, self.m)
+
+    def point_to_many(
+        self, x: np.ndarray, indices: Indices = None, count: bool = False
+    ) -> np.ndarray:
+        """
+        :param x: Point from outside of the matrix, e.g. reference point or centroid.
+        :param count: If True, accounts the computation in `calc_ctr` of `indices`.
+        """
+        others = self._select(indices)
+        if count and self.calc_ctr is not None:
+            if indices is None:
+                self.calc_ctr += 1
+            else:
+                np.add.at(self.calc_ctr, np.asarray(indices, dtype=np.intp), 1)
+        return minkowski_distances(np.asarray(x, dtype=np.float64), others, self.m)
+
+    def block(
+        self, rows: Indices, cols: Indices = None, skip_self: bool = False
+    ) -> np.ndarray:
+        """
+        :param skip_self: Only with `cols=None`. If True, distances of points to
+            themselves are set to inf and not accounted in `calc_ctr`.
+        :return: Distance matrix between points `rows` and points `cols` (all if None).
+        """
+        row_indices = (
+            np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.intp)
+        )
+        col_coords = self._select(cols)
+        if self.calc_ctr is not None:
+            np.add.at(
+                self.calc_ctr,
+                row_indices,
+                len(col_coords) - (1 if skip_self and cols is None else 0),
+            )
+        distances = minkowski_distance_matrix(
+            self.coords[row_indices], col_coords, self.m, self.block_elements
+        )
+        if skip_self and cols is None:
+            distances[np.arange(len(row_indices)), row_indices] = np.inf
+        return distances
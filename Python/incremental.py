@@ -0,0 +1,267 @@
+from typing import List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from dbscan import assign_clusters_dbscan
+from dbscanrn import k_plus_nn_length
+from distances import minkowski_distances
+from utils import NeighbourLists, PointSet
+
+
+class IncrementalDBSCANRN:
+    """
+    DBSCANRN over a changing set of points. k+NN and rk+NN lists are kept up to
+    date on insertion and deletion of points, searching only along points sorted
+    by distance to a fixed reference point (as `set_rknn_ti` does). Clusters of
+    the current points, the same as of a from-scratch run, are assigned by
+    `point_set`.
+
+    Points are identified by the index of their insertion, which is kept after
+    deletion of other points.
+    """
+
+    def __init__(
+        self,
+        k: int,
+        dims: int,
+        m: float = 2,
+        ref_point: Optional[np.ndarray] = None,
+        k_plus_nn_tolerance: float = 10e-9,
+    ):
+        """
+        :param ref_point: Reference point of the TI search. Defaults to the origin.
+        """
+        self.k = k
+        self.m = m
+        self.k_plus_nn_tolerance = k_plus_nn_tolerance
+        self.ref_point = np.zeros(dims) if ref_point is None else ref_point
+
+        self.n = 0
+        self.coords = np.empty((0, dims))
+        self.ref_distances = np.empty(0)
+        self.calc_ctr = np.empty(0, dtype=np.int64)
+        self.active = np.empty(0, dtype=bool)
+        # Search radius of every point: distance to the last of its k+NN, inf
+        # if there are fewer than k - 1 other points.
+        self.radii = np.empty(0)
+
+        # Active points sorted by reference point distance
+        self.order = np.empty(0, dtype=np.int64)
+        self.sorted_ref_distances = np.empty(0)
+
+        # k+NN (excluding the point itself) sorted by distance and index
+        self.k_plus_nn: List[List[int]] = []
+        self.k_plus_nn_distances: List[List[float]] = []
+        self.r_k_plus_nn: List[Set[int]] = []
+
+    @classmethod
+    def from_points(
+        cls,
+        points: PointSet,
+        k: int,
+        m: float = 2,
+        ref_point: Optional[np.ndarray] = None,
+    ) -> "IncrementalDBSCANRN":
+        """
+        :param ref_point: Defaults to the per-dimension minima of the points.
+        """
+        if ref_point is None:
+            ref_point = points.coords.min(axis=0)
+        incremental = cls(k, points.dims, m, ref_point)
+        incremental._append(points.coords)
+        for i in range(incremental.n):
+            incremental._set_k_plus_nn(i, *incremental._search(i))
+        return incremental
+
+    def _append(self, coords: np.ndarray) -> np.ndarray:
+        coords = np.atleast_2d(np.asarray(coords, dtype=np.float64))
+        indices = np.arange(self.n, self.n + len(coords))
+        ref_distances = minkowski_distances(self.ref_point, coords, self.m)
+
+        self.n += len(coords)
+        self.coords = np.concatenate([self.coords, coords])
+        self.ref_distances = np.concatenate([self.ref_distances, ref_distances])
+        self.calc_ctr = np.concatenate(
+            [self.calc_ctr, np.ones(len(coords), dtype=np.int64)]
+        )
+        self.active = np.concatenate([self.active, np.ones(len(coords), dtype=bool)])
+        self.radii = np.concatenate([self.radii, np.full(len(coords), np.inf)])
+        for _ in range(len(coords)):
+            self.k_plus_nn.append([])
+            self.k_plus_nn_distances.append([])
+            self.r_k_plus_nn.append(set())
+
+        sort_order = np.argsort(ref_distances, kind="stable")
+        positions = np.searchsorted(
+            self.sorted_ref_distances, ref_distances[sort_order], side="right"
+        )
+        self.order = np.insert(self.order, positions, indices[sort_order])
+        self.sorted_ref_distances = np.insert(
+            self.sorted_ref_distances, positions, ref_distances[sort_order]
+        )
+        return indices
+
+    def _distances(self, i: int, indices: np.ndarray) -> np.ndarray:
+        self.calc_ctr[i] += len(indices)
+        return minkowski_distances(self.coords[i], self.coords[indices], self.m)
+
+    def _search(self, i: int) -> Tuple[List[int], List[float]]:
+        """
+        :return: k+NN of point `i` among the active points and their distances,
+            found in windows of the reference distance order growing around the
+            point until the triangle inequality excludes the rest.
+        """
+        k_corrected = self.k - 1
+        if k_corrected == 0:
+            return [], []
+        ref_distance = self.ref_distances[i]
+        n_active = len(self.order)
+        pos = int(np.searchsorted(self.sorted_ref_distances, ref_distance))
+
+        candidates, candidate_distances = [], []
+        lo = hi = pos
+        width = k_corrected
+        while True:
+            new_lo, new_hi = max(0, pos - width), min(n_active, pos + width)
+            window = np.concatenate([self.order[new_lo:lo], self.order[hi:new_hi]])
+            window = window[window != i]
+            candidates.append(window)
+            candidate_distances.append(self._distances(i, window))
+            lo, hi = new_lo, new_hi
+
+            indices = np.concatenate(candidates)
+            distances = np.concatenate(candidate_distances)
+            sort_order = np.lexsort((indices, distances))
+            indices, distances = indices[sort_order], distances[sort_order]
+            length = k_plus_nn_length(distances, k_corrected, self.k_plus_nn_tolerance)
+
+            if lo == 0 and hi == n_active:
+                return indices[:length].tolist(), distances[:length].tolist()
+            if length >= k_corrected:
+                # Points outside of the window are farther than the bound
+                bound = distances[length - 1] + self.k_plus_nn_tolerance
+                if (
+                    lo == 0 or ref_distance - self.sorted_ref_distances[lo - 1] > bound
+                ) and (
+                    hi == n_active
+                    or self.sorted_ref_distances[hi] - ref_distance > bound
+                ):
+                    return indices[:length].tolist(), distances[:length].tolist()
+            width *= 2
+
+    def _set_k_plus_nn(
+        self, i: int, indices: List[int], distances: List[float]
+    ) -> None:
+        old_indices = set(self.k_plus_nn[i])
+        for j in old_indices.difference(indices):
+            self.r_k_plus_nn[j].discard(i)
+        for j in set(indices).difference(old_indices):
+            self.r_k_plus_nn[j].add(i)
+        self.k_plus_nn[i], self.k_plus_nn_distances[i] = indices, distances
+
+        if self.k == 1:
+            self.radii[i] = -np.inf
+        elif len(indices) < self.k - 1:
+            self.radii[i] = np.inf
+        else:
+            self.radii[i] = distances[-1]
+
+    def insert(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Inserts points one by one. k+NN of the existing points change only if
+        they are within their radius, which is checked only for points whose
+        reference distance is within it.
+
+        :return: Indices of the inserted points.
+        """
+        indices = []
+        for point_coords in np.atleast_2d(coords):
+            # Existing points whose k+NN may include the new one
+            ref_distance = minkowski_distances(
+                self.ref_point, point_coords[None], self.m
+            )[0]
+            existing = self.order
+            affected = existing[
+                np.abs(self.ref_distances[existing] - ref_distance)
+                < self.radii[existing] + self.k_plus_nn_tolerance
+            ]
+
+            i = int(self._append(point_coords)[0])
+            indices.append(i)
+            self._set_k_plus_nn(i, *self._search(i))
+
+            distances = self._distances(i, affected)
+            within = distances < self.radii[affected] + self.k_plus_nn_tolerance
+            for j, distance in zip(
+                affected[within].tolist(), distances[within].tolist()
+            ):
+                self._add_candidate(j, i, distance)
+        return np.array(indices, dtype=np.int64)
+
+    def _add_candidate(self, i: int, candidate: int, distance: float) -> None:
+        candidates = self.k_plus_nn[i] + [candidate]
+        candidate_distances = self.k_plus_nn_distances[i] + [distance]
+        sort_order = sorted(
+            range(len(candidates)),
+            key=lambda c: (candidate_distances[c], candidates[c]),
+        )
+        candidates = [candidates[c] for c in sort_order]
+        candidate_distances = [candidate_distances[c] for c in sort_order]
+        length = k_plus_nn_length(
+            np.array(candidate_distances), self.k - 1, self.k_plus_nn_tolerance
+        )
+        if (
+            length == len(candidates)
+            and candidates[-1] == candidate
+            and len(self.k_plus_nn[i]) >= self.k - 1
+        ):
+            # Not searched points may be tied with the new last neighbour
+            self._set_k_plus_nn(i, *self._search(i))
+        else:
+            self._set_k_plus_nn(i, candidates[:length], candidate_distances[:length])
+
+    def delete(self, indices: Sequence[int]) -> None:
+        """
+        Deletes points one by one. k+NN of points having a deleted point among
+        them are searched again.
+        """
+        for i in indices:
+            if not self.active[i]:
+                raise ValueError(f"Point {i} is not present.")
+            self.active[i] = False
+            keep = self.order != i
+            self.order = self.order[keep]
+            self.sorted_ref_distances = self.sorted_ref_distances[keep]
+
+            self._set_k_plus_nn(i, [], [])
+            affected = sorted(self.r_k_plus_nn[i])
+            self.r_k_plus_nn[i] = set()
+            for j in affected:
+                self._set_k_plus_nn(j, *self._search(j))
+
+    def point_set(self) -> PointSet:
+        """
+        :return: Present points, ordered by index (ids), with k+NN, rk+NN,
+            distance calculations and clusters assigned as by `dbscanrn`.
+        """
+        indices = np.flatnonzero(self.active)
+        positions = np.full(self.n, -1, dtype=np.int64)
+        positions[indices] = np.arange(len(indices))
+
+        points = PointSet(self.coords[indices], ids=indices)
+        points.calc_ctr[:] = self.calc_ctr[indices]
+        points.k_plus_nn = NeighbourLists.from_lists(
+            [[i] + self.k_plus_nn[i] for i in indices.tolist()]
+        )
+        points.k_plus_nn.indices = positions[points.k_plus_nn.indices]
+        points.r_k_plus_nn = NeighbourLists.from_lists(
+            [sorted(self.r_k_plus_nn[i]) for i in indices.tolist()]
+        )
+        points.r_k_plus_nn.indices = positions[points.r_k_plus_nn.indices]
+
+        assign_clusters_dbscan(
+            points=points,
+            core_mask=points.r_k_plus_nn.lengths() >= self.k,
+            neighbours_cp=points.r_k_plus_nn,
+            neighbours_ncp=points.k_plus_nn,
+        )
+        return points
@@ -0,0 +1,236 @@
+import math
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+from progress import log
+
+BACKENDS = ("python", "numba")
+
+_backend = "python"
+# Kernels compiled by Numba, by name
+_compiled: Dict[str, Callable] = {}
+
+
+def numba_available() -> bool:
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def set_backend(name: str) -> str:
+    """
+    Selects the implementation of the scalar loops of TI k+NN search and
+    cluster expansion: "python" (interpreted reference implementation) or
+    "numba" (kernels of this module compiled on first use). Falls back to
+    "python" if Numba, an optional dependency, is not installed.
+
+    :return: Backend in use.
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}.")
+    if name == "numba" and not numba_available():
+        log("Numba is not installed, using the Python backend.")
+        name = "python"
+    _backend = name
+    return _backend
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def compiled(name: str) -> Callable:
+    """
+    :return: Kernel `name` of this module compiled in nopython mode. Numba is
+        imported only here, so that it does not slow down other imports.
+    """
+    if name not in _compiled:
+        import numba
+
+        _compiled[name] = numba.njit(cache=True, nogil=True)(globals()[name])
+    return _compiled[name]
+
+
+def k_plus_nn_ti(
+    coords: np.ndarray,
+    order: np.ndarray,
+    sorted_ref_distances: np.ndarray,
+    extra_ref_distances: np.ndarray,
+    start: int,
+    stop: int,
+    k: int,
+    m: float,
+    k_plus_nn_tolerance: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Flat-array version of `dbscanrn._k_plus_nn_ti_task` for positions
+    `start:stop` of the reference distance order: the same walk along the
+    order, pruning and tie extension, so the same k+NN in the same order.
+
+    :param extra_ref_distances: Distances to the extra reference points, of
+        shape (n, 0) if there are none.
+    :return: k+NN of the points in CSR form (indptr, indices), min eps, max
+        eps, distance calculations of the points and number of candidates
+        pruned with the extra reference points.
+    """
+    n = len(order)
+    k_corrected = k - 1  # account for point being it's own kNN
+    has_extra_refs = extra_ref_distances.shape[1] > 0
+    indptr = np.zeros(stop - start + 1, dtype=np.int64)
+    indices = np.empty(max(1, (stop - start) * k), dtype=np.int64)
+    min_eps = np.empty(stop - start)
+    max_eps = np.empty(stop - start)
+    calc_ctr = np.zeros(stop - start, dtype=np.int64)
+    candidate_indices = np.empty(n, dtype=np.int64)
+    candidate_distances = np.empty(n)
+    pruned_candidates = 0
+
+    for i in range(start, stop):
+        row = i - start
+        point_idx = order[i]
+        point_ref_dist = sorted_ref_distances[i]
+        prev_i, next_i = i - 1, i + 1
+        n_candidates = 0
+        eps = 0.0
+        point_max_eps = np.nan
+
+        while True:
+            if n_candidates == k_corrected and n_candidates > 0:
+                eps = candidate_distances[:n_candidates].max()
+                point_max_eps = eps
+
+            search_prev, search_next = prev_i >= 0, next_i <= n - 1
+            if search_next and (
+                not search_prev
+                or sorted_ref_distances[next_i] - point_ref_dist
+                < point_ref_dist - sorted_ref_distances[prev_i]
+            ):
+                go_next = True
+                candidate_i = next_i
+                pessimistic_estimation = sorted_ref_distances[next_i] - point_ref_dist
+            elif search_prev:
+                go_next = False
+                candidate_i = prev_i
+                pessimistic_estimation = point_ref_dist - sorted_ref_distances[prev_i]
+            else:
+                break
+
+            if n_candidates >= k_corrected and pessimistic_estimation > eps:
+                break
+
+            candidate_idx = order[candidate_i]
+            pruned = False
+            if has_extra_refs and n_candidates >= k_corrected:
+                lower_bound = 0.0
+                for ref in range(extra_ref_distances.shape[1]):
+                    lower_bound = max(
+                        lower_bound,
+                        abs(
+                            extra_ref_distances[point_idx, ref]
+                            - extra_ref_distances[candidate_idx, ref]
+                        ),
+                    )
+                pruned = lower_bound > eps + k_plus_nn_tolerance
+            if pruned:
+                pruned_candidates += 1
+            else:
+                # Same operations as `minkowski_from_diff`, up to summation order
+                distance = 0.0
+                for dim in range(coords.shape[1]):
+                    diff = abs(coords[candidate_idx, dim] - coords[point_idx, dim])
+                    if math.isinf(m):
+                        distance = max(distance, diff)
+                    elif m == 2:
+                        distance += diff * diff
+                    elif m == 1:
+                        distance += diff
+                    else:
+                        distance += diff**m
+                if m == 2:
+                    distance = math.sqrt(distance)
+                elif m != 1 and not math.isinf(m):
+                    distance = distance ** (1 / m)
+                calc_ctr[row] += 1
+                if (
+                    n_candidates < k_corrected
+                    or distance < eps
+                    or abs(distance - eps) <= k_plus_nn_tolerance
+                ):
+                    candidate_indices[n_candidates] = candidate_idx
+                    candidate_distances[n_candidates] = distance
+                    n_candidates += 1
+                    if n_candidates > k_corrected:
+                        eps = np.partition(
+                            candidate_distances[:n_candidates], k_corrected - 1
+                        )[k_corrected - 1]
+            if go_next:
+                next_i += 1
+            else:
+                prev_i -= 1
+
+        # Determine final k+NN: k_corrected nearest, extended with ties
+        length = n_candidates
+        sorted_positions = np.arange(n_candidates)
+        if n_candidates > k_corrected:
+            sorted_positions = np.argsort(
+                candidate_distances[:n_candidates], kind="mergesort"
+            )
+            length = k_corrected
+            while length < n_candidates and (
+                abs(
+                    candidate_distances[sorted_positions[length - 1]]
+                    - candidate_distances[sorted_positions[length]]
+                )
+                <= k_plus_nn_tolerance
+            ):
+                length += 1
+
+        if indptr[row] + length > len(indices):
+            grown = np.empty(2 * len(indices) + length, dtype=np.int64)
+            grown[: indptr[row]] = indices[: indptr[row]]
+            indices = grown
+        for position in range(length):
+            indices[indptr[row] + position] = candidate_indices[
+                sorted_positions[position]
+            ]
+        indptr[row + 1] = indptr[row] + length
+        min_eps[row] = eps
+        max_eps[row] = point_max_eps
+
+    return indptr, indices[: indptr[-1]], min_eps, max_eps, calc_ctr, pruned_candidates
+
+
+def expand_clusters(
+    indptr: np.ndarray, indices: np.ndarray, core_mask: np.ndarray
+) -> np.ndarray:
+    """
+    Flat-array version of `dbscan.expand_clusters`: depth-first instead of
+    breadth-first, which reaches the same points from every core point.
+
+    :return: Cluster ids, from 1 for core points and 0 for the others.
+    """
+    n = len(core_mask)
+    cluster_id = np.zeros(n, dtype=np.int64)
+    # Points are pushed once, when assigned to a cluster
+    stack = np.empty(max(1, n), dtype=np.int64)
+    current_cluster_id = 1
+    for core_idx in range(n):
+        if not core_mask[core_idx] or cluster_id[core_idx] != 0:
+            continue
+        cluster_id[core_idx] = current_cluster_id
+        stack[0] = core_idx
+        stack_size = 1
+        while stack_size > 0:
+            stack_size -= 1
+            point_idx = stack[stack_size]
+            for position in range(indptr[point_idx], indptr[point_idx + 1]):
+                neighbour = indices[position]
+                if core_mask[neighbour] and cluster_id[neighbour] == 0:
+                    cluster_id[neighbour] = current_cluster_id
+                    stack[stack_size] = neighbour
+                    stack_size += 1
+        current_cluster_id += 1
+    return cluster_id
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from dbscanrn import KPlusNNSweep, edge_lists, k_plus_nn_edge_distances
+from neighbour_index import NeighbourIndex
+from profiling import span
+from utils import NeighbourLists, PointSet
+
+# Version of the cache file layout, part of the cache key.
+KNN_CACHE_VERSION = 1
+
+# Indexes computing exact k+NN, from which k+NN of a smaller k are derived.
+# TI search with ties and approximate indexes are reused only for the same k.
+PREFIX_REUSE_INDEXES = ("brute", "kdtree", "balltree")
+
+
+def dataset_hash(points: PointSet) -> str:
+    """
+    :return: SHA-256 of the shape and coordinates of the points.
+    """
+    digest = hashlib.sha256(str(points.coords.shape).encode())
+    digest.update(np.ascontiguousarray(points.coords).data)
+    return digest.hexdigest()
+
+
+def _compact_indices(indices: np.ndarray, n: int) -> np.ndarray:
+    return indices.astype(np.int32) if n < 2**31 else indices
+
+
+class KNNGraphCache:
+    """
+    Directory of k+NN graphs (`.npz` files) keyed by dataset content hash,
+    Minkowski power, neighbour index and its parameters (e.g. TI reference
+    points) and k. Least recently used files are evicted when the directory
+    exceeds `max_size_mb`.
+    """
+
+    def __init__(self, cache_dir: Path, max_size_mb: float = 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_size_mb = max_size_mb
+
+    def key_digest(self, key: Dict[str, Any]) -> str:
+        key = {"version": KNN_CACHE_VERSION, **key}
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+
+    def _path(self, digest: str, k: int) -> Path:
+        return self.cache_dir / f"{digest}_k_{k}.npz"
+
+    def find(
+        self, digest: str, k: int, same_k: bool = False
+    ) -> Optional[Tuple[int, Path]]:
+        """
+        :param same_k: If True, only a graph cached for `k` is returned.
+        :return: Smallest cached k' >= `k` and the path of its file, if any.
+        """
+        cached = []
+        for path in self.cache_dir.glob(f"{digest}_k_*.npz"):
+            cached_k = int(path.stem.rsplit("_", 1)[1])
+            if cached_k == k or (cached_k > k and not same_k):
+                cached.append((cached_k, path))
+        return min(cached, default=None)
+
+    def load(
+        self,
+        points: PointSet,
+        digest: str,
+        k: int,
+        k_plus_nn_tolerance: float,
+        same_k: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Sets `k_plus_nn`, `r_k_plus_nn`, `min_eps`, `max_eps` and `calc_ctr`
+        of `points` from the cache. For a cached k' > k (unless `same_k`), k+NN
+        are derived from the cached ones, eps bounds are not set and `calc_ctr`
+        are those of the cached computation.
+
+        :return: Metadata of the cached computation or None if not cached.
+        """
+        found = self.find(digest, k, same_k)
+        if found is None:
+            return None
+        cached_k, path = found
+        try:
+            with np.load(path) as cached:
+                arrays = {name: cached[name] for name in cached.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)
+
+        n = len(points)
+        metadata = json.loads(str(arrays["metadata"]))
+        points.calc_ctr += arrays["calc_ctr"]
+        if cached_k == k:
+            points.k_plus_nn = NeighbourLists(
+                arrays["k_plus_nn_indptr"].astype(np.int64),
+                arrays["k_plus_nn_indices"].astype(np.int64),
+            )
+            points.r_k_plus_nn = NeighbourLists(
+                arrays["r_k_plus_nn_indptr"].astype(np.int64),
+                arrays["r_k_plus_nn_indices"].astype(np.int64),
+            )
+            points.min_eps[:] = arrays["min_eps"]
+            points.max_eps[:] = arrays["max_eps"]
+        else:
+            k_plus_nn = edge_lists(
+                arrays["edge_rows"].astype(np.int64),
+                arrays["edge_indices"].astype(np.int64),
+                arrays["edge_distances"],
+                n,
+            )
+            KPlusNNSweep(k_plus_nn, n, k_plus_nn_tolerance).set_rknn(points, k)
+        metadata["cached_k"] = cached_k
+        return metadata
+
+    def store(
+        self,
+        points: PointSet,
+        m: float,
+        digest: str,
+        k: int,
+        calc_ctr: np.ndarray,
+        metadata: Dict[str, Any],
+    ) -> None:
+        """
+        Saves k+NN of `points` (and the distance calculations `calc_ctr` they
+        took), then evicts least recently used files. Errors are ignored.
+        """
+        n = len(points)
+        rows, indices, distances = k_plus_nn_edge_distances(points, m)
+        arrays = {
+            "metadata": np.array(json.dumps(metadata)),
+            "k_plus_nn_indptr": points.k_plus_nn.indptr,
+            "k_plus_nn_indices": _compact_indices(points.k_plus_nn.indices, n),
+            "r_k_plus_nn_indptr": points.r_k_plus_nn.indptr,
+            "r_k_plus_nn_indices": _compact_indices(points.r_k_plus_nn.indices, n),
+            "edge_rows": _compact_indices(rows, n),
+            "edge_indices": _compact_indices(indices, n),
+            "edge_distances": distances,
+            "min_eps": points.min_eps,
+            "max_eps": points.max_eps,
+            "calc_ctr": calc_ctr,
+        }
+        path = self._path(digest, k)
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self) -> List[Path]:
+        """
+        Removes least recently used files until the cache fits `max_size_mb`.
+
+        :return: Removed files.
+        """
+        files = []
+        for path in self.cache_dir.glob("*_k_*.npz"):
+            stat = path.stat()
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total_size = sum(size for _, size, _ in files)
+        removed = []
+        for _, size, path in files:
+            if total_size <= self.max_size_mb * 2**20:
+                break
+            path.unlink()
+            total_size -= size
+            removed.append(path)
+        return removed
+
+
+class CachedNeighbourIndex(NeighbourIndex):
+    """
+    Neighbour index reusing k+NN cached by `KNNGraphCache` for any k not
+    greater than the cached one (only for the same k, unless `name` is one of
+    `PREFIX_REUSE_INDEXES`), computing and caching them with `index` otherwise.
+    """
+
+    def __init__(self, index: NeighbourIndex, name: str, cache: KNNGraphCache):
+        super().__init__(index.points, index.m)
+        self.index = index
+        self.cache = cache
+        self.same_k = name not in PREFIX_REUSE_INDEXES
+        self.key = {
+            "dataset": dataset_hash(index.points),
+            "m": index.m,
+            "index": name,
+        }
+        for attr in ("ref_points", "leaf_size", "recall_target"):
+            if hasattr(index, attr):
+                self.key[attr] = np.asarray(getattr(index, attr)).tolist()
+        self.cache_hit: Optional[bool] = None
+        self.cached_k: Optional[int] = None
+
+    def eps_neighbour_indices(self, eps: float) -> List[List[int]]:
+        return self.index.eps_neighbour_indices(eps)
+
+    def set_rknn(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[float, float]:
+        digest = self.cache.key_digest(
+            {**self.key, "k_plus_nn_tolerance": k_plus_nn_tolerance}
+        )
+        with span("load_k_plus_nn_cache") as load_span:
+            metadata = self.cache.load(
+                self.points, digest, k, k_plus_nn_tolerance, self.same_k
+            )
+        if metadata is not None:
+            self.cache_hit, self.cached_k = True, metadata["cached_k"]
+            ti_stats = getattr(self.index, "ti_stats", None)
+            if ti_stats is not None:
+                ti_stats.update(metadata["ti_stats"])
+            return 0, load_span.duration
+
+        self.cache_hit, self.cached_k = False, None
+        calc_ctr_before = self.points.calc_ctr.copy()
+        runtimes = self.index.set_rknn(k, k_plus_nn_tolerance)
+        self.cache.store(
+            self.points,
+            self.m,
+            digest,
+            k,
+            self.points.calc_ctr - calc_ctr_before,
+            {"ti_stats": getattr(self.index, "ti_stats", None) or {}},
+        )
+        return runtimes
@@ -0,0 +1,589 @@
+from abc import ABC, abstractmethod
+from heapq import heappop, heappush
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dbscan import eps_neighbour_indices_brute_force, eps_neighbour_indices_ti
+from dbscanrn import (
+    assign_k_plus_nn,
+    edge_lists,
+    k_plus_nn_brute_force,
+    k_plus_nn_edge_distances,
+    k_plus_nn_length,
+    set_rknn,
+    set_rknn_ti,
+)
+from distances import minkowski_from_diff
+from profiling import span
+from progress import progress
+from utils import NeighbourLists, PointSet
+
+NEIGHBOUR_INDEXES = ("brute", "ti", "kdtree", "balltree", "rpforest")
+
+
+class NeighbourIndex(ABC):
+    """
+    Neighbourhood search backend. Distance calculations are accounted in
+    `calc_ctr` of the points.
+    """
+
+    def __init__(self, points: PointSet, m: float):
+        self.points = points
+        self.m = m
+        self.kernel = points.distance_kernel(m)
+
+    def eps_neighbour_indices(self, eps: float) -> List[List[int]]:
+        """
+        By default, a brute force search, for indexes built for k+NN only.
+
+        :return: For every point, its index followed by ascending indices of the
+            other points within `eps`.
+        """
+        return eps_neighbour_indices_brute_force(self.points, eps, self.m)
+
+    @abstractmethod
+    def set_rknn(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[float, float]:
+        """
+        Sets `k_plus_nn` and `r_k_plus_nn` of the points.
+
+        :return: Preprocessing (sorting, index building) time and rk+NN time.
+        """
+
+    def k_plus_nn_distances(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        By default, runs `set_rknn` (so sets `k_plus_nn` and `r_k_plus_nn` of
+        the points) and reads back distances of the k+NN edges.
+
+        :return: (point index, k+NN indices, k+NN distances) for every point,
+            k+NN excluding the point itself and sorted by distance and index.
+        """
+        self.set_rknn(k, k_plus_nn_tolerance)
+        return edge_lists(
+            *k_plus_nn_edge_distances(self.points, self.m), len(self.points)
+        )
+
+
+class BruteForceIndex(NeighbourIndex):
+    def __init__(
+        self,
+        points: PointSet,
+        m: float,
+        memory_budget_mb: float = 256,
+        workers: int = 1,
+    ):
+        super().__init__(points, m)
+        self.memory_budget_mb = memory_budget_mb
+        self.workers = workers
+
+    def eps_neighbour_indices(self, eps: float) -> List[List[int]]:
+        return eps_neighbour_indices_brute_force(self.points, eps, self.m, self.workers)
+
+    def k_plus_nn_distances(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        return k_plus_nn_brute_force(
+            self.points,
+            k,
+            self.m,
+            k_plus_nn_tolerance,
+            self.memory_budget_mb,
+            self.workers,
+        )
+
+    def set_rknn(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[float, float]:
+        return set_rknn(
+            self.points,
+            k,
+            self.m,
+            k_plus_nn_tolerance,
+            self.memory_budget_mb,
+            workers=self.workers,
+        )
+
+
+class TIIndex(NeighbourIndex):
+    """
+    Search along points sorted by distance to reference point(s), see `set_rknn_ti`.
+    """
+
+    def __init__(
+        self,
+        points: PointSet,
+        m: float,
+        ref_points: Optional[np.ndarray] = None,
+        ti_stats: Optional[Dict[str, int]] = None,
+        workers: int = 1,
+    ):
+        super().__init__(points, m)
+        self.ref_points = (
+            points.coords.min(axis=0) if ref_points is None else ref_points
+        )
+        self.ti_stats = ti_stats
+        self.workers = workers
+        # Order of points by reference point distance, reused by later searches
+        self.ref_distances: Dict[str, np.ndarray] = {}
+
+    def eps_neighbour_indices(self, eps: float) -> List[List[int]]:
+        return eps_neighbour_indices_ti(
+            self.points,
+            self.ref_points,
+            eps,
+            self.m,
+            workers=self.workers,
+            ref_distances=self.ref_distances,
+        )[1]
+
+    def set_rknn(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[float, float]:
+        return set_rknn_ti(
+            self.points,
+            self.ref_points,
+            k,
+            self.m,
+            k_plus_nn_tolerance,
+            ti_stats=self.ti_stats,
+            workers=self.workers,
+            ref_distances=self.ref_distances,
+        )
+
+
+class TreeIndex(NeighbourIndex):
+    """
+    Binary space partitioning tree with `leaf_size` points per leaf, split at the
+    median of the widest dimension. Queries visit nodes best-first by a lower
+    bound of the distance to their points, computed by subclasses.
+    """
+
+    def __init__(self, points: PointSet, m: float, leaf_size: int = 32):
+        super().__init__(points, m)
+        self.leaf_size = leaf_size
+        self.build_time: Optional[float] = None
+
+    def build(self) -> float:
+        """
+        :return: Time of building the tree. Tree is built only once.
+        """
+        if self.build_time is not None:
+            return self.build_time
+        with span("build_tree") as build_span:
+            coords = self.kernel.coords
+            self.order = np.arange(len(coords))
+            starts, ends, lefts, rights = [], [], [], []
+            node_bounds = []
+            stack = [(0, len(coords), -1, False)]  # start, end, parent, is_right
+            while stack:
+                start, end, parent, is_right = stack.pop()
+                node = len(starts)
+                if parent >= 0:
+                    (rights if is_right else lefts)[parent] = node
+                indices = self.order[start:end]
+                starts.append(start)
+                ends.append(end)
+                lefts.append(-1)
+                rights.append(-1)
+                node_bounds.append(self._node_bounds(indices))
+
+                if end - start > self.leaf_size:
+                    node_coords = coords[indices]
+                    split_dim = int(np.argmax(np.ptp(node_coords, axis=0)))
+                    half = (end - start) // 2
+                    partition = np.argpartition(node_coords[:, split_dim], half)
+                    self.order[start:end] = indices[partition]
+                    stack.append((start + half, end, node, True))
+                    stack.append((start, start + half, node, False))
+
+            self._starts = np.array(starts)
+            self._ends = np.array(ends)
+            self._lefts = np.array(lefts)
+            self._rights = np.array(rights)
+            self._set_bounds(node_bounds)
+
+        self.build_time = build_span.duration
+        return self.build_time
+
+    @abstractmethod
+    def _node_bounds(self, indices: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        :return: Data used to bound distances to points `indices` of a node.
+        """
+
+    @abstractmethod
+    def _set_bounds(self, node_bounds: List[Tuple[np.ndarray, ...]]) -> None:
+        pass
+
+    @abstractmethod
+    def _lower_bounds(self, i: int, nodes: List[int]) -> np.ndarray:
+        """
+        :return: Lower bounds of distances between point `i` and points of `nodes`.
+        """
+
+    def search(
+        self,
+        i: int,
+        radius: float,
+        k_corrected: int = 0,
+        k_plus_nn_tolerance: float = 0.0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param radius: Search radius.
+        :param k_corrected: If positive, radius shrinks to the distance of the
+            `k_corrected`-th nearest neighbour found so far plus tolerance.
+        :return: Indices and distances of points other than `i` within the
+            (final) radius, sorted by distance and index.
+        """
+        found_indices, found_distances = [], []
+        nearest = np.empty(0)
+        heap = [(0.0, 0)]
+        while heap:
+            lower_bound, node = heappop(heap)
+            if lower_bound > radius:
+                break
+            left = self._lefts[node]
+            if left < 0:
+                indices = self.order[self._starts[node] : self._ends[node]]
+                indices = indices[indices != i]
+                distances = self.kernel.one_to_many(i, indices)
+                within_radius = distances <= radius
+                found_indices.append(indices[within_radius])
+                found_distances.append(distances[within_radius])
+                if k_corrected > 0:
+                    nearest = np.sort(
+                        np.concatenate([nearest, distances[within_radius]])
+                    )[:k_corrected]
+                    if len(nearest) == k_corrected:
+                        radius = min(radius, nearest[-1] + k_plus_nn_tolerance)
+            else:
+                children = [left, self._rights[node]]
+                for child, child_lower_bound in zip(
+                    children, self._lower_bounds(i, children).tolist()
+                ):
+                    if child_lower_bound <= radius:
+                        heappush(heap, (child_lower_bound, child))
+
+        if not found_indices:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        indices = np.concatenate(found_indices)
+        distances = np.concatenate(found_distances)
+        within_radius = distances <= radius
+        indices, distances = indices[within_radius], distances[within_radius]
+        order = np.lexsort((indices, distances))
+        return indices[order], distances[order]
+
+    def k_plus_nn(
+        self, i: int, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Indices and distances of k+NN of point `i`, excluding itself,
+            with the same tie semantics as brute-force `set_rknn`.
+        """
+        k_corrected = k - 1  # account for point being it's own kNN
+        if k_corrected <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        indices, distances = self.search(i, np.inf, k_corrected, k_plus_nn_tolerance)
+        length = k_plus_nn_length(distances, k_corrected, k_plus_nn_tolerance)
+        if len(distances) < k_corrected:
+            return indices, distances
+        # All points within `radius` are known, but ties may continue past it
+        radius = distances[k_corrected - 1] + k_plus_nn_tolerance
+        while (
+            length == len(indices) < len(self.points) - 1
+            and distances[-1] + k_plus_nn_tolerance > radius
+        ):
+            radius = distances[-1] + k_plus_nn_tolerance
+            indices, distances = self.search(i, radius)
+            length = k_plus_nn_length(distances, k_corrected, k_plus_nn_tolerance)
+        return indices[:length], distances[:length]
+
+    def eps_neighbour_indices(self, eps: float) -> List[List[int]]:
+        self.build()
+        return [
+            [i] + np.sort(self.search(i, eps)[0]).tolist()
+            for i in progress(
+                range(len(self.points)), desc="Determining eps neighbourhoods..."
+            )
+        ]
+
+    def k_plus_nn_distances(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        self.build()
+        return [
+            (i, *self.k_plus_nn(i, k, k_plus_nn_tolerance))
+            for i in progress(range(len(self.points)), desc="Calculating rK+NN...")
+        ]
+
+    def set_rknn(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[float, float]:
+        build_time = self.build()
+        with span("rk_plus_nn_tree") as rknn_span:
+            assign_k_plus_nn(
+                self.points, self.k_plus_nn_distances(k, k_plus_nn_tolerance)
+            )
+        return build_time, rknn_span.duration
+
+
+class KDTreeIndex(TreeIndex):
+    """
+    KD-tree bounding nodes by boxes. Bounds hold for every Minkowsky power and
+    need no distance calculations, but prune poorly in high dimensions.
+    """
+
+    def _node_bounds(self, indices: np.ndarray) -> Tuple[np.ndarray, ...]:
+        node_coords = self.kernel.coords[indices]
+        return node_coords.min(axis=0), node_coords.max(axis=0)
+
+    def _set_bounds(self, node_bounds: List[Tuple[np.ndarray, ...]]) -> None:
+        self._lowers = np.array([lower for lower, _ in node_bounds])
+        self._uppers = np.array([upper for _, upper in node_bounds])
+
+    def _lower_bounds(self, i: int, nodes: List[int]) -> np.ndarray:
+        x = self.kernel.coords[i]
+        gaps = np.maximum(self._lowers[nodes] - x, 0) + np.maximum(
+            x - self._uppers[nodes], 0
+        )
+        return minkowski_from_diff(gaps, self.m)
+
+
+class BallTreeIndex(TreeIndex):
+    """
+    Ball tree bounding nodes by a centroid and covering radius, pruning with
+    the triangle inequality. Distances to centroids are accounted as distance
+    calculations of the points.
+    """
+
+    def _node_bounds(self, indices: np.ndarray) -> Tuple[np.ndarray, ...]:
+        centroid = self.kernel.coords[indices].mean(axis=0)
+        radius = self.kernel.point_to_many(centroid, indices, count=True).max()
+        return centroid, radius
+
+    def _set_bounds(self, node_bounds: List[Tuple[np.ndarray, ...]]) -> None:
+        self._centroids = np.array([centroid for centroid, _ in node_bounds])
+        self._radii = np.array([radius for _, radius in node_bounds])
+
+    def _lower_bounds(self, i: int, nodes: List[int]) -> np.ndarray:
+        centroid_distances = self.kernel.one_to_points(i, self._centroids[nodes])
+        return np.maximum(centroid_distances - self._radii[nodes], 0)
+
+
+class RandomProjectionForestIndex(NeighbourIndex):
+    """
+    Approximate k+NN. Candidates of a point are the points sharing a leaf with
+    it in any of random projection trees (split at the median of projections on
+    a random direction), re-ranked by exact distances. Trees are added until
+    the fraction of exact k+NN of a sample of points found among candidates
+    reaches `recall_target`.
+    """
+
+    def __init__(
+        self,
+        points: PointSet,
+        m: float,
+        recall_target: float = 0.9,
+        leaf_size: int = 32,
+        n_trees: int = 4,
+        max_trees: int = 64,
+        sample_size: int = 100,
+        seed: int = 0,
+        memory_budget_mb: float = 256,
+    ):
+        super().__init__(points, m)
+        self.recall_target = recall_target
+        self.leaf_size = leaf_size
+        self.n_trees = n_trees
+        self.max_trees = max_trees
+        self.sample_size = sample_size
+        self.memory_budget_mb = memory_budget_mb
+        self.rng = np.random.default_rng(seed)
+        # Leaf of every point, points sorted by leaf, leaf starts and sizes
+        self.trees: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        self.tree_leaf_size = 0
+        self.built_k: Optional[int] = None
+        self.estimated_recall: Optional[float] = None
+
+    def add_tree(self, leaf_size: int) -> None:
+        coords = self.kernel.coords
+        leaf_of = np.zeros(len(coords), dtype=np.int64)
+        n_leaves = 0
+        nodes = [np.arange(len(coords))]
+        while nodes:
+            indices = nodes.pop()
+            if len(indices) <= leaf_size:
+                leaf_of[indices] = n_leaves
+                n_leaves += 1
+                continue
+            projections = coords[indices] @ self.rng.normal(size=coords.shape[1])
+            half = len(indices) // 2
+            partition = np.argpartition(projections, half)
+            nodes.append(indices[partition[half:]])
+            nodes.append(indices[partition[:half]])
+        sizes = np.bincount(leaf_of, minlength=n_leaves)
+        starts = np.cumsum(sizes) - sizes
+        self.trees.append((leaf_of, np.argsort(leaf_of, kind="stable"), starts, sizes))
+
+    def candidates(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Positions in `rows` and indices of distinct candidates of
+            points `rows` (excluding the points themselves), sorted by both.
+        """
+        n = len(self.points)
+        positions, indices = [], []
+        for leaf_of, order, starts, sizes in self.trees:
+            leaves = leaf_of[rows]
+            lengths = sizes[leaves]
+            offsets = np.arange(lengths.sum()) - np.repeat(
+                np.cumsum(lengths) - lengths, lengths
+            )
+            positions.append(np.repeat(np.arange(len(rows)), lengths))
+            indices.append(order[np.repeat(starts[leaves], lengths) + offsets])
+        keys = np.unique(np.concatenate(positions) * n + np.concatenate(indices))
+        positions, indices = np.divmod(keys, n)
+        other = indices != rows[positions]
+        return positions[other], indices[other]
+
+    def _exact_sample_edges(
+        self, sample: np.ndarray, k: int, k_plus_nn_tolerance: float
+    ) -> np.ndarray:
+        """
+        :return: Keys (position in `sample` * n + index) of exact k+NN of
+            points `sample`.
+        """
+        n = len(self.points)
+        keys = []
+        for position, distances in enumerate(self.kernel.block(sample, skip_self=True)):
+            order = np.lexsort((np.arange(n), distances))
+            length = k_plus_nn_length(distances[order], k - 1, k_plus_nn_tolerance)
+            keys.append(position * n + order[:length])
+        return np.concatenate(keys)
+
+    def build(self, k: int, k_plus_nn_tolerance: float = 10e-9) -> float:
+        """
+        Adds trees, doubling their number, until the candidate recall of a
+        sample of points reaches `recall_target` or there are `max_trees`.
+
+        :return: Estimated recall.
+        """
+        n = len(self.points)
+        leaf_size = max(self.leaf_size, 2 * k)
+        if leaf_size != self.tree_leaf_size:
+            self.trees, self.tree_leaf_size = [], leaf_size
+        sample = np.sort(
+            self.rng.choice(n, size=min(self.sample_size, n), replace=False)
+        )
+        exact_keys = self._exact_sample_edges(sample, k, k_plus_nn_tolerance)
+        n_trees = max(self.n_trees, len(self.trees))
+        while True:
+            while len(self.trees) < n_trees:
+                self.add_tree(leaf_size)
+            positions, indices = self.candidates(sample)
+            recall = (
+                float(np.isin(exact_keys, positions * n + indices).mean())
+                if len(exact_keys)
+                else 1.0
+            )
+            if recall >= self.recall_target or n_trees >= self.max_trees:
+                break
+            n_trees = min(2 * n_trees, self.max_trees)
+        self.built_k, self.estimated_recall = k, recall
+        return recall
+
+    def k_plus_nn_distances(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        if self.built_k != k:
+            self.build(k, k_plus_nn_tolerance)
+        n = len(self.points)
+        coords = self.kernel.coords
+        # candidate indices, positions, distances and sort keys
+        bytes_per_row = len(self.trees) * self.tree_leaf_size * 4 * 8
+        block_size = max(1, int(self.memory_budget_mb * 2**20 // bytes_per_row))
+        k_plus_nn = []
+        for block_start in progress(
+            range(0, n, block_size), desc="Calculating approximate rK+NN..."
+        ):
+            rows = np.arange(block_start, min(block_start + block_size, n))
+            positions, indices = self.candidates(rows)
+            distances = minkowski_from_diff(
+                coords[indices] - coords[rows[positions]], self.m
+            )
+            self.points.calc_ctr[rows] += np.bincount(positions, minlength=len(rows))
+            order = np.lexsort((indices, distances, positions))
+            positions, indices, distances = (
+                positions[order],
+                indices[order],
+                distances[order],
+            )
+            bounds = np.searchsorted(positions, np.arange(1, len(rows)))
+            for i, row_indices, row_distances in zip(
+                rows.tolist(), np.split(indices, bounds), np.split(distances, bounds)
+            ):
+                length = k_plus_nn_length(row_distances, k - 1, k_plus_nn_tolerance)
+                k_plus_nn.append((i, row_indices[:length], row_distances[:length]))
+        return k_plus_nn
+
+    def set_rknn(
+        self, k: int, k_plus_nn_tolerance: float = 10e-9
+    ) -> Tuple[float, float]:
+        with span("build_random_projection_forest") as build_span:
+            self.build(k, k_plus_nn_tolerance)
+        with span("rk_plus_nn_approximate") as rknn_span:
+            assign_k_plus_nn(
+                self.points, self.k_plus_nn_distances(k, k_plus_nn_tolerance)
+            )
+        return build_span.duration, rknn_span.duration
+
+
+def k_plus_nn_recall(approximate: NeighbourLists, exact: NeighbourLists) -> float:
+    """
+    :return: Fraction of exact k+NN (other than the points themselves) present
+        in the approximate k+NN of the same points.
+    """
+    n = len(exact.indptr) - 1
+    keys = []
+    for neighbour_lists in (approximate, exact):
+        rows = np.repeat(np.arange(n), neighbour_lists.lengths())
+        other = neighbour_lists.indices != rows
+        keys.append(rows[other] * n + neighbour_lists.indices[other])
+    return float(np.isin(keys[1], keys[0]).mean()) if len(keys[1]) else 1.0
+
+
+def make_neighbour_index(
+    name: str,
+    points: PointSet,
+    m: float,
+    memory_budget_mb: float = 256,
+    ref_points: Optional[np.ndarray] = None,
+    ti_stats: Optional[Dict[str, int]] = None,
+    leaf_size: int = 32,
+    workers: int = 1,
+    recall_target: float = 0.9,
+) -> NeighbourIndex:
+    """
+    :param name: One of `NEIGHBOUR_INDEXES`.
+    :param workers: Number of processes used by brute force and TI indexes.
+    :param recall_target: Estimated k+NN recall of the approximate "rpforest".
+    """
+    if name == "brute":
+        return BruteForceIndex(points, m, memory_budget_mb, workers)
+    if name == "ti":
+        return TIIndex(points, m, ref_points, ti_stats, workers)
+    if name == "kdtree":
+        return KDTreeIndex(points, m, leaf_size)
+    if name == "balltree":
+        return BallTreeIndex(points, m, leaf_size)
+    if name == "rpforest":
+        return RandomProjectionForestIndex(
+            points,
+            m,
+            recall_target,
+            leaf_size,
+            memory_budget_mb=memory_budget_mb,
+        )
+    raise ValueError(f"Unknown neighbour index: {name}.")
@@ -0,0 +1,315 @@
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from dbscan import assign_non_core_points, expand_clusters
+from dbscanrn import iter_k_plus_nn_brute_force, k_plus_nn_ties
+from profiling import count, span
+from progress import progress
+from utils import NeighbourLists, PointSet
+
+# Bytes of a spilled edge, i.e. of an int64 neighbour index.
+EDGE_BYTES = np.dtype(np.int64).itemsize
+
+# Points whose k+NN are passed to the run writer at once.
+SPILL_ROWS = 4096
+
+
+class EdgeRunWriter:
+    """
+    Neighbour lists written to disk as runs of edges sorted by source point,
+    appended in order of sources. The file is the `indices` array of the lists
+    in CSR layout; `indptr` (one entry per point) is kept in memory.
+    """
+
+    def __init__(self, path: Path, n: int, memory_budget_mb: float = 256):
+        self.path = path
+        self.lengths = np.zeros(n, dtype=np.int64)
+        self.max_buffered = max(1, int(memory_budget_mb * 2**20 // EDGE_BYTES))
+        self.buffered: List[np.ndarray] = []
+        self.n_buffered = 0
+        self.path.write_bytes(b"")
+
+    def add(self, sources: np.ndarray, lengths: np.ndarray, indices: np.ndarray):
+        """
+        :param sources: Ascending points, following the ones added before.
+        :param lengths: Numbers of neighbours of `sources`.
+        :param indices: Concatenated neighbours of `sources`.
+        """
+        self.lengths[sources] = lengths
+        self.buffered.append(np.asarray(indices, dtype=np.int64))
+        self.n_buffered += len(indices)
+        if self.n_buffered >= self.max_buffered:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.path.open("ab") as f:
+            for run in self.buffered:
+                run.tofile(f)
+        self.buffered, self.n_buffered = [], 0
+
+    def close(self) -> NeighbourLists:
+        """
+        :return: Neighbour lists with indices memory-mapped from the file.
+        """
+        self.flush()
+        indptr = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=indptr[1:])
+        return NeighbourLists(indptr, _map_indices(self.path, int(indptr[-1])))
+
+
+def _map_indices(path: Path, size: int, mode: str = "r") -> np.ndarray:
+    if size == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.memmap(path, dtype=np.int64, mode=mode, shape=(size,))
+
+
+def iter_chunks(
+    neighbour_lists: NeighbourLists, rows_per_chunk: int, skip_first: bool = False
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    :param skip_first: If True, the first neighbour of every point (the point
+        itself in k+NN lists) is skipped.
+    :return: Iterator of (sources, targets) of the edges of consecutive chunks of
+        `rows_per_chunk` points, read from (possibly memory-mapped) lists.
+    """
+    n = len(neighbour_lists)
+    for chunk_start in range(0, n, rows_per_chunk):
+        chunk_stop = min(chunk_start + rows_per_chunk, n)
+        indptr = neighbour_lists.indptr[chunk_start : chunk_stop + 1]
+        lengths = np.diff(indptr)
+        sources = np.repeat(np.arange(chunk_start, chunk_stop), lengths)
+        targets = np.asarray(neighbour_lists.indices[indptr[0] : indptr[-1]])
+        if skip_first:
+            is_first = np.zeros(len(targets), dtype=bool)
+            is_first[(indptr[:-1] - indptr[0])[lengths > 0]] = True
+            sources, targets = sources[~is_first], targets[~is_first]
+        yield sources, targets
+
+
+def reverse_neighbour_lists(
+    neighbour_lists: NeighbourLists,
+    path: Path,
+    rows_per_chunk: int,
+    skip_first: bool = False,
+) -> NeighbourLists:
+    """
+    Builds on disk lists of sources of edges grouped by target, sources in
+    ascending order (as `NeighbourLists.from_edges` of edges sorted by source).
+    Edges are read in chunks and scattered to their positions.
+
+    :param skip_first: See `iter_chunks`.
+    """
+    n = len(neighbour_lists)
+    lengths = np.zeros(n, dtype=np.int64)
+    for _, targets in iter_chunks(neighbour_lists, rows_per_chunk, skip_first):
+        lengths += np.bincount(targets, minlength=n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+
+    path.write_bytes(b"")
+    if indptr[-1] > 0:
+        with path.open("r+b") as f:
+            f.truncate(int(indptr[-1]) * EDGE_BYTES)
+    indices = _map_indices(path, int(indptr[-1]), mode="r+")
+    filled = indptr[:-1].copy()
+    for sources, targets in iter_chunks(neighbour_lists, rows_per_chunk, skip_first):
+        order = np.argsort(targets, kind="stable")
+        sources, targets = sources[order], targets[order]
+        # Rank of every edge among the edges of its target in this chunk
+        group_starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]])
+        group_lengths = np.diff(np.r_[group_starts, len(targets)])
+        ranks = np.arange(len(targets)) - np.repeat(group_starts, group_lengths)
+        indices[filled[targets] + ranks] = sources
+        filled[targets[group_starts]] += group_lengths
+    if isinstance(indices, np.memmap):
+        indices.flush()
+    return NeighbourLists(indptr, _map_indices(path, int(indptr[-1])))
+
+
+def connected_core_components(
+    core_mask: np.ndarray, neighbour_lists: NeighbourLists, rows_per_chunk: int
+) -> np.ndarray:
+    """
+    Union-find over edges between core points streamed from (possibly
+    memory-mapped) neighbour lists: roots of both ends of every edge are hooked
+    to the smaller one, then paths are compressed, until no edge joins two
+    trees. Only the parent array is kept in memory.
+
+    :return: Parent array, the smallest core point of the component for core
+        points.
+    """
+    parent = np.arange(len(core_mask))
+    changed = True
+    while changed:
+        changed = False
+        for sources, targets in iter_chunks(neighbour_lists, rows_per_chunk):
+            core_edges = core_mask[sources] & core_mask[targets]
+            source_roots = parent[sources[core_edges]]
+            target_roots = parent[targets[core_edges]]
+            joining = source_roots != target_roots
+            if not joining.any():
+                continue
+            changed = True
+            np.minimum.at(
+                parent,
+                np.maximum(source_roots, target_roots)[joining],
+                np.minimum(source_roots, target_roots)[joining],
+            )
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+    return parent
+
+
+def _rows_per_chunk(bytes_per_row: int, memory_budget_mb: float) -> int:
+    return max(1, int(memory_budget_mb * 2**20 // max(1, bytes_per_row)))
+
+
+def spill_eps_neighbours(
+    points: PointSet,
+    eps: float,
+    m: float,
+    spill_dir: Path,
+    memory_budget_mb: float = 256,
+) -> NeighbourLists:
+    """
+    Computes eps neighbourhoods (point first, then ascending other points) in
+    tiles of rows fitting `memory_budget_mb` and spills them to `spill_dir`.
+    """
+    n = len(points)
+    kernel = points.distance_kernel(m)
+    # distance tile and mask
+    rows_per_chunk = _rows_per_chunk(n * 9, memory_budget_mb)
+    writer = EdgeRunWriter(spill_dir / "eps_neighbours.bin", n, memory_budget_mb)
+    for chunk_start in progress(
+        range(0, n, rows_per_chunk), desc="Determining eps neighbourhoods..."
+    ):
+        rows = np.arange(chunk_start, min(chunk_start + rows_per_chunk, n))
+        rows_mask = kernel.block(rows, skip_self=True) <= eps
+        lengths = rows_mask.sum(axis=1) + 1
+        starts = np.cumsum(lengths) - lengths
+        indices = np.empty(lengths.sum(), dtype=np.int64)
+        is_other = np.ones(len(indices), dtype=bool)
+        is_other[starts] = False
+        indices[starts] = rows
+        indices[is_other] = np.nonzero(rows_mask)[1]
+        writer.add(rows, lengths, indices)
+    return writer.close()
+
+
+def spill_k_plus_nn(
+    points: PointSet,
+    k: int,
+    m: float,
+    spill_dir: Path,
+    k_plus_nn_tolerance: float = 10e-9,
+    memory_budget_mb: float = 256,
+) -> Tuple[NeighbourLists, NeighbourLists]:
+    """
+    Computes k+NN (point first) in tiles fitting `memory_budget_mb`, spills them
+    to `spill_dir` and builds rk+NN from them on disk.
+
+    :return: k+NN and rk+NN lists, memory-mapped.
+    """
+    n = len(points)
+    writer = EdgeRunWriter(spill_dir / "k_plus_nn.bin", n, memory_budget_mb)
+    rows, lengths, indices = [], [], []
+    for i, k_plus_nn_indices, _ in iter_k_plus_nn_brute_force(
+        points.distance_kernel(m), k, k_plus_nn_tolerance, memory_budget_mb
+    ):
+        rows.append(i)
+        lengths.append(len(k_plus_nn_indices) + 1)
+        indices.extend([[i], k_plus_nn_indices])
+        if len(rows) == SPILL_ROWS or i == n - 1:
+            writer.add(np.array(rows), np.array(lengths), np.concatenate(indices))
+            rows, lengths, indices = [], [], []
+    k_plus_nn = writer.close()
+
+    rows_per_chunk = _rows_per_chunk(4 * k * EDGE_BYTES, memory_budget_mb)
+    r_k_plus_nn = reverse_neighbour_lists(
+        k_plus_nn, spill_dir / "r_k_plus_nn.bin", rows_per_chunk, skip_first=True
+    )
+    return k_plus_nn, r_k_plus_nn
+
+
+def dbscan_out_of_core(
+    points: PointSet,
+    min_pts: int,
+    eps: float,
+    m: float,
+    spill_dir: Path,
+    memory_budget_mb: float = 256,
+) -> Dict[str, float]:
+    """
+    DBSCAN with eps neighbourhoods spilled to `spill_dir` and clusters of core
+    points found with `connected_core_components` (eps neighbourhoods are
+    symmetric, so they are the clusters expanded by `dbscan`).
+    """
+    with span("eps_neighbourhoods_out_of_core") as eps_neighbourhood_span:
+        points.eps_neighbours = spill_eps_neighbours(
+            points, eps, m, spill_dir, memory_budget_mb
+        )
+    count("distance_calculations", points.calc_ctr.sum())
+
+    with span("clustering") as clustering_span:
+        core_mask = points.eps_neighbours.lengths() >= min_pts
+        rows_per_chunk = _rows_per_chunk(
+            4
+            * max(1, len(points.eps_neighbours.indices) // max(1, len(points)))
+            * EDGE_BYTES,
+            memory_budget_mb,
+        )
+        parent = connected_core_components(
+            core_mask, points.eps_neighbours, rows_per_chunk
+        )
+        # Clusters numbered in order of their first core point
+        roots = np.unique(parent[core_mask])
+        points.point_type[core_mask] = 1
+        points.cluster_id[core_mask] = np.searchsorted(roots, parent[core_mask]) + 1
+        assign_non_core_points(
+            points, core_mask, points.eps_neighbours, rows_per_chunk=rows_per_chunk
+        )
+
+    return {
+        "2_sort_by_ref_point_distances": 0,
+        "3_eps_neighborhood/rnn_calculation": eps_neighbourhood_span.duration,
+        "4_clustering": clustering_span.duration,
+    }
+
+
+def dbscanrn_out_of_core(
+    points: PointSet,
+    k: int,
+    m: float,
+    spill_dir: Path,
+    memory_budget_mb: float = 256,
+) -> Dict[str, float]:
+    """
+    Brute-force DBSCANRN with k+NN and rk+NN spilled to `spill_dir`. Clusters
+    are expanded along memory-mapped rk+NN, which are not symmetric.
+    """
+    with span("rk_plus_nn_out_of_core") as rknn_span:
+        points.k_plus_nn, points.r_k_plus_nn = spill_k_plus_nn(
+            points, k, m, spill_dir, memory_budget_mb=memory_budget_mb
+        )
+    count("distance_calculations", points.calc_ctr.sum())
+    count("k_plus_nn_ties", k_plus_nn_ties(points.k_plus_nn, k))
+
+    with span("clustering") as clustering_span:
+        core_mask = points.r_k_plus_nn.lengths() >= k
+        expand_clusters(points, core_mask, points.r_k_plus_nn)
+        assign_non_core_points(
+            points,
+            core_mask,
+            points.k_plus_nn,
+            rows_per_chunk=_rows_per_chunk(4 * k * EDGE_BYTES, memory_budget_mb),
+        )
+
+    return {
+        "2_sort_by_ref_point_distances": 0,
+        "3_eps_neighborhood/rnn_calculation": rknn_span.duration,
+        "4_clustering": clustering_span.duration,
+    }
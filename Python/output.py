@@ -0,0 +1,150 @@
+from pathlib import Path
+from typing import Iterator, List
+
+import numpy as np
+from utils import _UNSET_POINT_TYPE, NeighbourLists, PointSet
+
+# Number of points formatted and written at once.
+WRITE_CHUNK_SIZE = 2**16
+
+DEBUG_FORMATS = ("tsv", "npz", "none")
+
+
+def round_values(values: np.ndarray, ndigits: int = 3) -> List[float]:
+    """
+    Vectorized builtin `round`. Scaled values are rounded to integers with
+    numpy; values close to a half, for which the scaling error could change
+    the result, and values too large to scale exactly use builtin `round`.
+    """
+    scale = 10.0**ndigits
+    scaled = values * scale
+    rounded = (np.rint(scaled) / scale).tolist()
+    with np.errstate(invalid="ignore"):
+        fallback_mask = ~(np.abs(scaled) < 2.0**52) | (
+            np.abs(scaled - np.floor(scaled) - 0.5) <= 1e-9 + np.abs(scaled) * 1e-15
+        )
+    for i in np.flatnonzero(fallback_mask).tolist():
+        rounded[i] = round(float(values[i]), ndigits)
+    return rounded
+
+
+def format_values(values: np.ndarray) -> List[str]:
+    """
+    :return: `str` of every value, with floats rounded to 3 digits.
+    """
+    if values.dtype.kind == "f":
+        return list(map(str, round_values(values)))
+    return list(map(str, values.tolist()))
+
+
+def format_id_lists(ids: np.ndarray, neighbour_lists: NeighbourLists) -> List[str]:
+    """
+    :return: For every point, `str` of the list of ids of its neighbours, sorted.
+    """
+    lengths = neighbour_lists.lengths()
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    neighbour_ids = ids[neighbour_lists.indices]
+    neighbour_ids = neighbour_ids[np.lexsort((neighbour_ids, rows))]
+    id_strings = list(map(repr, neighbour_ids.tolist()))
+    indptr = neighbour_lists.indptr.tolist()
+    return [
+        f"[{', '.join(id_strings[start:stop])}]"
+        for start, stop in zip(indptr, indptr[1:])
+    ]
+
+
+def _chunks(n: int) -> Iterator[range]:
+    for start in range(0, n, WRITE_CHUNK_SIZE):
+        yield range(start, min(start + WRITE_CHUNK_SIZE, n))
+
+
+def _sub_lists(neighbour_lists: NeighbourLists, rows: range) -> NeighbourLists:
+    start, stop = neighbour_lists.indptr[rows.start], neighbour_lists.indptr[rows.stop]
+    return NeighbourLists(
+        neighbour_lists.indptr[rows.start : rows.stop + 1] - start,
+        neighbour_lists.indices[start:stop],
+    )
+
+
+def write_out_file(points: PointSet, out_file: Path) -> None:
+    """
+    Writes OUT.csv with coordinates, distance calculations count, point type
+    and cluster id of every point.
+    """
+    with out_file.open("w+") as f:
+        dims = ",".join([f"x_{i}" for i in range(points.dims)])
+        header = f"point_id,{dims},#_calcs,point_type,c_id\n"
+        f.write(header)
+        for rows in _chunks(len(points)):
+            chunk = slice(rows.start, rows.stop)
+            point_types = [
+                "None" if point_type == _UNSET_POINT_TYPE else str(point_type)
+                for point_type in points.point_type[chunk].tolist()
+            ]
+            columns = [format_values(points.ids[chunk])]
+            columns.extend(
+                format_values(points.coords[chunk, dim]) for dim in range(points.dims)
+            )
+            columns.extend(
+                [
+                    format_values(points.calc_ctr[chunk]),
+                    point_types,
+                    format_values(points.cluster_id[chunk]),
+                ]
+            )
+            f.write("".join([f"{','.join(row)}\n" for row in zip(*columns)]))
+
+
+def write_debug_file(points: PointSet, debug_file: Path) -> None:
+    """
+    Writes DEBUG.tsv with eps neighbourhoods or k+NN/rk+NN of every point.
+    """
+    with debug_file.open("w+") as f:
+        f.write(points[0].get_serialize_debug_header())
+        for rows in _chunks(len(points)):
+            chunk = slice(rows.start, rows.stop)
+            lines = [[point_id] for point_id in format_values(points.ids[chunk])]
+            for eps in (points.max_eps[chunk], points.min_eps[chunk]):
+                for line, eps_str, is_set in zip(
+                    lines, format_values(eps), (~np.isnan(eps)).tolist()
+                ):
+                    if is_set:
+                        line.append(eps_str)
+            columns = []
+            if points.r_k_plus_nn is not None:
+                r_k_plus_nn = _sub_lists(points.r_k_plus_nn, rows)
+                columns.extend(
+                    [
+                        format_values(r_k_plus_nn.lengths()),
+                        format_id_lists(points.ids, _sub_lists(points.k_plus_nn, rows)),
+                        format_id_lists(points.ids, r_k_plus_nn),
+                    ]
+                )
+            if points.eps_neighbours is not None:
+                eps_neighbours = _sub_lists(points.eps_neighbours, rows)
+                columns.extend(
+                    [
+                        format_values(eps_neighbours.lengths()),
+                        format_id_lists(points.ids, eps_neighbours),
+                    ]
+                )
+            for column in columns:
+                for line, value in zip(lines, column):
+                    line.append(value)
+            f.write("".join(["\t".join(line) + "\n" for line in lines]))
+
+
+def write_debug_npz(points: PointSet, debug_file: Path) -> None:
+    """
+    Writes DEBUG.npz, a compact binary counterpart of DEBUG.tsv: point ids,
+    eps bounds (NaN if not set) and neighbour lists in CSR layout
+    (`<name>_indptr`, `<name>_indices`, indices of points in the file order).
+    Neighbours keep the order of the algorithm, e.g. k+NN start with the point.
+    """
+    arrays = {"ids": points.ids, "max_eps": points.max_eps, "min_eps": points.min_eps}
+    for name in ("k_plus_nn", "r_k_plus_nn", "eps_neighbours"):
+        neighbour_lists = getattr(points, name)
+        if neighbour_lists is not None:
+            arrays[f"{name}_indptr"] = neighbour_lists.indptr
+            arrays[f"{name}_indices"] = neighbour_lists.indices
+    np.savez(debug_file, **arrays)
@@ -0,0 +1,98 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from progress import Progress
+
+# Shards per worker, so that workers finishing early pick up remaining work.
+SHARDS_PER_WORKER = 4
+
+# Signature of tasks run on shards: (shared arrays, shard, progress bar
+# description or None, *args) -> shard result.
+ShardTask = Callable[..., Any]
+
+_worker_blocks: List[SharedMemory] = []
+_worker_arrays: Dict[str, np.ndarray] = {}
+
+
+def shard_ranges(n: int, n_shards: int) -> List[range]:
+    """
+    :return: Up to `n_shards` contiguous, non-empty ranges covering `range(n)`.
+    """
+    bounds = np.linspace(0, n, max(1, min(n_shards, n)) + 1).astype(int).tolist()
+    return [range(start, stop) for start, stop in zip(bounds, bounds[1:])]
+
+
+class SharedArrays:
+    """
+    Copies of numpy arrays in shared memory, attached to by pool workers
+    without pickling the arrays for every task.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.blocks: List[SharedMemory] = []
+        self.specs: Dict[str, Tuple[str, Tuple[int, ...], str]] = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def _attach_shared_arrays(specs: Dict[str, Tuple[str, Tuple[int, ...], str]]) -> None:
+    for name, (block_name, shape, dtype) in specs.items():
+        block = SharedMemory(name=block_name)
+        _worker_blocks.append(block)
+        _worker_arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _run_shard(task_args: Tuple[ShardTask, range, Sequence[Any]]) -> Any:
+    task, shard, args = task_args
+    return task(_worker_arrays, shard, None, *args)
+
+
+def map_shards(
+    task: ShardTask,
+    arrays: Dict[str, np.ndarray],
+    n: int,
+    workers: int = 1,
+    args: Sequence[Any] = (),
+    desc: Optional[str] = None,
+) -> List[Any]:
+    """
+    Runs `task` on contiguous shards of `range(n)` in a pool of `workers`
+    processes, with `arrays` shared between them. With a single worker, runs
+    `task` in this process on the whole range.
+
+    :return: Results of `task`, in the order of shards.
+    """
+    if workers <= 1 or n <= 1:
+        return [task(arrays, range(n), desc, *args)]
+
+    shards = shard_ranges(n, workers * SHARDS_PER_WORKER)
+    shared_arrays = SharedArrays(arrays)
+    try:
+        with multiprocessing.Pool(
+            workers,
+            initializer=_attach_shared_arrays,
+            initargs=(shared_arrays.specs,),
+        ) as pool:
+            results = []
+            with Progress(n, desc) as progress_bar:
+                for shard, result in zip(
+                    shards,
+                    pool.imap(_run_shard, [(task, shard, args) for shard in shards]),
+                ):
+                    results.append(result)
+                    progress_bar.update(len(shard))
+    finally:
+        shared_arrays.close()
+    return results
@@ -1,20 +1,31 @@
 from colorsys import hsv_to_rgb
 from math import floor, sqrt
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import click
+import matplotlib.pyplot as plt
+import numpy as np
 import seaborn as sns
 
 sns.set_style("darkgrid")
 
+PROJECTIONS = ("pca", "random")
+
+# Above this number of points, clusters are drawn as a density raster
+RASTER_THRESHOLD = 10000
+RASTER_BINS = 400
+
 
 def plot_out_2d(
-    out_file: Union[Path, str], output_file: Union[Path, str], first_line: int = 1
+    out_file: Union[Path, str],
+    output_file: Union[Path, str],
+    first_line: int = 1,
+    projection: str = "pca",
+    raster_threshold: int = RASTER_THRESHOLD,
 ):
     point_ids = []
-    x = []
-    y = []
+    coords = []
     cluster_ids = []
 
     with Path(out_file).open("r") as f:
@@ -24,34 +35,140 @@ def plot_out_2d(
                 line = line.strip()
                 spt = line.split(",")
                 point_ids.append(spt[0])
-                x.append(float(spt[1]))
-                y.append(float(spt[2]))
-                cluster_ids.append(max(0, int(spt[-1])))  # plot noise points as 0s
+                # Coordinates are followed by #_calcs, point_type and c_id
+                coords.append([float(value) for value in spt[1:-3]])
+                cluster_ids.append(int(spt[-1]))
+
+    plot_clusters_2d(
+        np.array(coords),
+        np.array(cluster_ids),
+        output_file,
+        point_ids=point_ids,
+        projection=projection,
+        raster_threshold=raster_threshold,
+    )
+
+
+def plot_clusters_2d(
+    coords: np.ndarray,
+    cluster_ids: np.ndarray,
+    output_file: Union[Path, str],
+    point_ids: Optional[Sequence] = None,
+    projection: str = "pca",
+    raster_threshold: int = RASTER_THRESHOLD,
+    bins: int = RASTER_BINS,
+) -> None:
+    """
+    Plots clusters from in-memory coordinates and cluster ids (noise points,
+    with ids below 1, are plotted black as cluster 0).
+
+    :param coords: (n, d) coordinates, projected to 2-D with `project_2d` if
+        d > 2.
+    :param point_ids: Labels of the points, drawn for fewer than 50 points.
+    :param raster_threshold: Above this number of points, each cell of a
+        `bins` x `bins` grid is coloured as its most frequent cluster, with
+        brightness growing with the log of its number of points, instead of
+        drawing a marker per point.
+    """
+    xy = project_2d(coords, projection)
+    cluster_ids = np.maximum(np.asarray(cluster_ids), 0)  # plot noise points as 0s
 
     output_path = Path(output_file)
     output_path.parent.mkdir(exist_ok=True, parents=True)
 
-    plot = sns.scatterplot(
-        x=x,
-        y=y,
-        hue=cluster_ids,
-        s=50,
-        palette=_generate_sample_palette(cluster_ids),
+    fig, ax = plt.subplots()
+    if len(xy) > raster_threshold:
+        _plot_density_raster(ax, xy, cluster_ids, bins)
+    else:
+        plot = sns.scatterplot(
+            x=xy[:, 0],
+            y=xy[:, 1],
+            hue=cluster_ids,
+            s=50,
+            palette=_generate_sample_palette(cluster_ids.tolist()),
+            ax=ax,
+        )
+
+        if point_ids is not None and len(point_ids) < 50:
+            for (x_i, y_i), point_id in zip(xy.tolist(), point_ids):
+                plot.text(
+                    x_i,
+                    y_i + 0.1,
+                    point_id,
+                    horizontalalignment="center",
+                    size="medium",
+                    color="black",
+                    weight="semibold",
+                )
+    if coords.shape[1] > 2:
+        ax.set_xlabel(f"{projection} 1")
+        ax.set_ylabel(f"{projection} 2")
+
+    fig.savefig(str(output_file))
+    plt.close(fig)
+
+
+def project_2d(coords: np.ndarray, projection: str = "pca") -> np.ndarray:
+    """
+    :param projection: "pca" for the two principal components, "random" for a
+        Gaussian random projection (fixed seed, so plots are reproducible).
+        Only used if coordinates have more than 2 dimensions.
+    :return: (n, 2) coordinates.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.shape[1] == 1:
+        return np.column_stack([coords[:, 0], np.zeros(len(coords))])
+    if coords.shape[1] == 2:
+        return coords
+    if projection == "pca":
+        centred = coords - coords.mean(axis=0)
+        # Eigenvectors of the (d, d) covariance, in ascending eigenvalue order
+        _, vectors = np.linalg.eigh(centred.T @ centred)
+        return centred @ vectors[:, [-1, -2]]
+    if projection == "random":
+        directions = np.random.default_rng(0).normal(size=(coords.shape[1], 2))
+        return coords @ (directions / np.sqrt(coords.shape[1]))
+    raise ValueError(f"Unknown projection {projection}, expected one of {PROJECTIONS}.")
+
+
+def _plot_density_raster(
+    ax, xy: np.ndarray, cluster_ids: np.ndarray, bins: int
+) -> None:
+    lows, highs = xy.min(axis=0), xy.max(axis=0)
+    spans = np.where(highs > lows, highs - lows, 1.0)
+    cells = np.minimum(((xy - lows) / spans * bins).astype(np.int64), bins - 1)
+    cell = cells[:, 1] * bins + cells[:, 0]
+
+    # Points per (cell, cluster), sorted by cell then count: the last entry of
+    # every cell is its most frequent cluster
+    labels, label_index = np.unique(cluster_ids, return_inverse=True)
+    pairs, pair_counts = np.unique(
+        cell * len(labels) + label_index.ravel(), return_counts=True
     )
-
-    if len(point_ids) < 50:
-        for x_i, y_i, point_id in zip(x, y, point_ids):
-            plot.text(
-                x_i,
-                y_i + 0.1,
-                point_id,
-                horizontalalignment="center",
-                size="medium",
-                color="black",
-                weight="semibold",
-            )
-
-    plot.get_figure().savefig(str(output_file))
+    pair_cells = pairs // len(labels)
+    order = np.lexsort((pair_counts, pair_cells))
+    last = np.r_[pair_cells[order][1:] != pair_cells[order][:-1], True]
+    top_cells = pair_cells[order][last]
+    top_labels = labels[pairs[order][last] % len(labels)]
+    cell_counts = np.bincount(cell, minlength=bins * bins)
+
+    palette = _generate_sample_palette(labels.tolist())
+    colours = np.array([palette[label] for label in top_labels.tolist()])
+    shade = np.log1p(cell_counts[top_cells]) / np.log1p(cell_counts.max())
+    # Sparse cells stay visible, fading towards the white background
+    shade = (0.25 + 0.75 * shade)[:, None]
+    image = np.ones((bins * bins, 3))
+    image[top_cells] = 1 - shade + shade * colours
+
+    ax.imshow(
+        image.reshape(bins, bins, 3),
+        origin="lower",
+        extent=(lows[0], lows[0] + spans[0], lows[1], lows[1] + spans[1]),
+        aspect="auto",
+        interpolation="nearest",
+    )
+    ax.grid(False)
+    ax.set_title(f"{len(xy)} points, {np.sum(labels > 0)} clusters")
 
 
 def _generate_sample_palette(
@@ -89,10 +206,29 @@ def _generate_sample_palette(
     default=1,
     help="Index of first line of data in OUT.csv file. Defaults to 1.",
 )
-def plot(out_file: Path, plot_path: Optional[Path], first_line: int) -> None:
+@click.option(
+    "--projection",
+    type=click.Choice(PROJECTIONS),
+    default="pca",
+    help="Projection of points with more than 2 dimensions. Defaults to pca.",
+)
+@click.option(
+    "--raster_threshold",
+    type=int,
+    default=RASTER_THRESHOLD,
+    help="Number of points above which clusters are drawn as a density raster "
+    f"instead of a scatter plot. Defaults to {RASTER_THRESHOLD}.",
+)
+def plot(
+    out_file: Path,
+    plot_path: Optional[Path],
+    first_line: int,
+    projection: str,
+    raster_threshold: int,
+) -> None:
     if plot_path is None:
         plot_path = out_file.parent / "plot.png"
-    plot_out_2d(out_file, plot_path, first_line)
+    plot_out_2d(out_file, plot_path, first_line, projection, raster_threshold)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class Profiler:
+    """
+    Records finished spans (nested timed sections), counters and the memory
+    high-water mark of the process.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.stack: List[str] = []
+        self.peak_rss_mb = peak_rss_mb()
+
+    def to_stat(self) -> Dict[str, Any]:
+        """
+        :return: Counters, peak RSS and total duration of every span path
+            (names of enclosing spans joined with "/"), for STAT.json.
+        """
+        span_durations: Dict[str, float] = defaultdict(float)
+        for span_record in self.spans:
+            span_durations[span_record["path"]] += span_record["duration"]
+        return {
+            "counters": dict(self.counters),
+            "peak_rss_mb": self.peak_rss_mb,
+            "spans": dict(span_durations),
+        }
+
+    def write_jsonl(self, path: Path) -> None:
+        """
+        Writes a JSON-lines trace: a line per span in order of their end, then
+        a line with the counters.
+        """
+        with path.open("w+") as f:
+            for span_record in self.spans:
+                f.write(json.dumps(span_record) + "\n")
+            f.write(
+                json.dumps({"counters": self.counters, "peak_rss_mb": self.peak_rss_mb})
+                + "\n"
+            )
+
+    def write_chrome_trace(self, path: Path) -> None:
+        """
+        Writes spans as complete events of the Chrome trace event format,
+        viewable as a flame chart in chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": span_record["name"],
+                "ph": "X",
+                "ts": span_record["start"] * 1e6,
+                "dur": span_record["duration"] * 1e6,
+                "pid": pid,
+                "tid": 0,
+                "args": {"peak_rss_mb": span_record["peak_rss_mb"]},
+            }
+            for span_record in self.spans
+        ]
+        events.extend(
+            {"name": name, "ph": "C", "ts": 0, "pid": pid, "args": {name: value}}
+            for name, value in self.counters.items()
+        )
+        with path.open("w+") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# Active profiler, None when profiling is disabled.
+_profiler: Optional[Profiler] = None
+
+
+def enable_profiling() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling() -> Optional[Profiler]:
+    """
+    :return: Profiler that was active, if any.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def peak_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class Span:
+    """
+    Timed section, used as a context manager. Its `duration` is measured
+    whether profiling is enabled or not; only an enabled profiler records it,
+    along with the names of enclosing spans and the peak RSS at its end.
+    """
+
+    __slots__ = ("name", "start", "duration")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+        self.duration = 0.0
+
+    def __enter__(self) -> "Span":
+        if _profiler is not None:
+            _profiler.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.duration = time.perf_counter() - self.start
+        profiler = _profiler
+        if profiler is not None and profiler.stack:
+            profiler.peak_rss_mb = peak_rss_mb()
+            profiler.spans.append(
+                {
+                    "name": self.name,
+                    "path": "/".join(profiler.stack),
+                    "start": self.start - profiler.start_time,
+                    "duration": self.duration,
+                    "peak_rss_mb": profiler.peak_rss_mb,
+                }
+            )
+            profiler.stack.pop()
+
+
+def span(name: str) -> Span:
+    return Span(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Adds `value` to counter `name` of the active profiler. In hot loops, count
+    locally and call this once.
+    """
+    if _profiler is not None:
+        _profiler.counters[name] += int(value)
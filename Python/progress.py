@@ -0,0 +1,123 @@
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, TextIO, TypeVar
+
+T = TypeVar("T")
+
+# Seconds between progress reports.
+REPORT_INTERVAL = 0.5
+
+# Progress reporting: None follows whether stderr is a terminal.
+_enabled: Optional[bool] = None
+_quiet = False
+
+
+def configure(quiet: bool = False, enabled: Optional[bool] = None) -> None:
+    """
+    :param quiet: If True, neither progress nor `log` messages are printed.
+    :param enabled: Whether progress is reported; by default only to a
+        terminal, so that logs of batch jobs are not filled with it.
+    """
+    global _enabled, _quiet
+    _quiet, _enabled = quiet, enabled
+
+
+@contextmanager
+def preserved_configuration() -> Iterator[None]:
+    """
+    Restores the configuration of `configure` on exit, e.g. around a command
+    called in process that configures its own output.
+    """
+    saved = _quiet, _enabled
+    try:
+        yield
+    finally:
+        configure(*saved)
+
+
+def progress_enabled(stream: Optional[TextIO] = None) -> bool:
+    if _quiet:
+        return False
+    if _enabled is not None:
+        return _enabled
+    return (stream or sys.stderr).isatty()
+
+
+def log(message: str) -> None:
+    if not _quiet:
+        print(message)
+
+
+class Progress:
+    """
+    Progress of a loop, reported to stderr at most every `REPORT_INTERVAL`
+    seconds. The clock is read only every `_next_check` items, estimated from
+    the rate so far, so that `update` costs an addition and a comparison.
+    Disabled for `desc` None (e.g. in pool workers) and as by `configure`.
+    """
+
+    def __init__(
+        self,
+        total: Optional[int] = None,
+        desc: Optional[str] = None,
+        stream: Optional[TextIO] = None,
+    ):
+        self.total = total
+        self.desc = desc
+        self.stream = stream or sys.stderr
+        self.n = 0
+        self.disabled = desc is None or not progress_enabled(self.stream)
+        self.start_time = self.last_report_time = time.perf_counter()
+        # Disabled progress never reads the clock
+        self._next_check = float("inf") if self.disabled else 1
+
+    def __enter__(self) -> "Progress":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def update(self, n: int = 1) -> None:
+        self.n += n
+        if self.n >= self._next_check:
+            self._check()
+
+    def _check(self) -> None:
+        now = time.perf_counter()
+        if now - self.last_report_time >= REPORT_INTERVAL:
+            self._report(now)
+        rate = self.n / max(now - self.start_time, 1e-9)
+        self._next_check = self.n + max(1, int(rate * REPORT_INTERVAL / 4))
+
+    def _report(self, now: float, end: str = "\r") -> None:
+        self.last_report_time = now
+        elapsed = now - self.start_time
+        done = f"{self.n}" if self.total is None else f"{self.n}/{self.total}"
+        rate = self.n / elapsed if elapsed > 0 else 0.0
+        self.stream.write(f"{self.desc} {done} [{elapsed:.1f}s, {rate:.0f}it/s]{end}")
+        self.stream.flush()
+
+    def close(self) -> None:
+        if not self.disabled:
+            self._report(time.perf_counter(), end="\n")
+            self.disabled = True
+            self._next_check = float("inf")
+
+
+def progress(
+    iterable: Iterable[T], desc: Optional[str] = None, total: Optional[int] = None
+) -> Iterator[T]:
+    """
+    Iterates over `iterable` reporting progress as `Progress`. Without `total`,
+    it is taken from `len(iterable)` if defined.
+    """
+    if total is None and hasattr(iterable, "__len__"):
+        total = len(iterable)
+    with Progress(total, desc) as progress_bar:
+        if progress_bar.disabled:
+            yield from iterable
+            return
+        for item in iterable:
+            yield item
+            progress_bar.update()
@@ -1,15 +1,35 @@
 import json
 import sys
+import tempfile
 import time
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Optional
 
 import click
-from clustering_metrics import davies_bouldin, purity, rand, silhouette_coefficient
+import numpy as np
+from clustering_metrics import (
+    adjusted_mutual_info,
+    adjusted_rand,
+    contingency_table,
+    davies_bouldin,
+    f_measure,
+    normalized_mutual_info,
+    purity,
+    rand,
+    sampled_silhouette_coefficient,
+    silhouette_coefficient,
+)
+from cpp_engine import ENGINES, dbscan_cpp, dbscanrn_cpp
 from dbscan import dbscan
-from dbscanrn import dbscanrn
-from plot import plot_out_2d
-from utils import Point, load_points
+from dbscanrn import REFERENCE_POINT_STRATEGIES, dbscanrn, select_reference_points
+from kernels import BACKENDS, set_backend
+from knn_cache import CachedNeighbourIndex, KNNGraphCache
+from neighbour_index import NEIGHBOUR_INDEXES, k_plus_nn_recall, make_neighbour_index
+from out_of_core import dbscan_out_of_core, dbscanrn_out_of_core
+from output import DEBUG_FORMATS, write_debug_file, write_debug_npz, write_out_file
+from profiling import disable_profiling, enable_profiling, get_profiler, span
+from progress import configure, log
+from utils import PointSet, load_points
 
 sys.path.extend(str(Path(__file__).parent))
 
@@ -41,7 +61,43 @@ sys.path.extend(str(Path(__file__).parent))
     type=bool,
     default=False,
     is_flag=True,
-    help="If set, will use triangle inequality to optimize runtime of the DBSCANRN algorithm.",
+    help="If set, will use triangle inequality to optimize runtime of the DBSCAN or DBSCANRN algorithm.",
+)
+@click.option(
+    "--index",
+    type=click.Choice(NEIGHBOUR_INDEXES),
+    default=None,
+    help="Neighbour index used for eps neighbourhoods and k+NN: brute force, "
+    "TI (reference point distance sort), KD-tree, ball tree or "
+    "approximate random projection forest (DBSCANRN only). Defaults to 'ti' with "
+    "--ti, which can't be combined with other indexes, and to 'brute' otherwise.",
+)
+@click.option(
+    "--recall_target",
+    type=float,
+    default=0.9,
+    help="Recall of exact k+NN, estimated on a sample of points, that the "
+    "'rpforest' index adds trees until reaching.",
+)
+@click.option(
+    "--measure_recall",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, DBSCANRN is also run with exact brute-force k+NN, and recall "
+    "of k+NN and RAND and purity differences from it are reported.",
+)
+@click.option(
+    "--n_ref_points",
+    type=int,
+    default=1,
+    help="Number of TI reference points. Candidates are pruned with all of them.",
+)
+@click.option(
+    "--ref_point_strategy",
+    type=click.Choice(REFERENCE_POINT_STRATEGIES),
+    default="min",
+    help="How TI reference points are selected. The first one is used for sorting.",
 )
 @click.option("-k", type=int, default=3, help="'k' parameter in DBSCANRN algorithm.")
 @click.option(
@@ -54,6 +110,78 @@ sys.path.extend(str(Path(__file__).parent))
     default=2.0,
     help="Power used in Minkowsky distance function.",
 )
+@click.option(
+    "--memory_budget_mb",
+    type=float,
+    default=256,
+    help="Memory bound (in MB) for distance matrix tiles of brute-force DBSCANRN "
+    "and silhouette coefficient.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes computing eps neighbourhoods or k+NN with the brute "
+    "force and TI indexes.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(ENGINES),
+    default="python",
+    help="Clustering engine: this package or the C++ engine of Cpp/ called in "
+    "process (brute force or --ti only, built as Cpp/libclustering.so).",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default="python",
+    help="Implementation of TI k+NN search and cluster expansion loops: "
+    "interpreted Python or compiled with Numba (if installed, Python otherwise).",
+)
+@click.option(
+    "--out_of_core",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, brute-force neighbourhoods are computed in tiles bounded by "
+    "--memory_budget_mb and spilled to disk, and clusters are found from the "
+    "memory-mapped lists. Use with --cache to memory-map coordinates too.",
+)
+@click.option(
+    "--spill_dir",
+    type=Path,
+    default=None,
+    help="Directory for temporary files of --out_of_core. Defaults to the system "
+    "temporary directory.",
+)
+@click.option(
+    "--cache/--no_cache",
+    default=True,
+    help="Whether to cache parsed dataset as .npy files next to it and load it "
+    "from them when the dataset files are unchanged.",
+)
+@click.option(
+    "--knn_cache_dir",
+    type=Path,
+    default=None,
+    help="If set, DBSCANRN k+NN graphs are cached in this directory, keyed by "
+    "dataset content, Minkowski power, index and k, and reused for any k not "
+    "greater than a cached one (the same k with 'ti' and 'rpforest' indexes).",
+)
+@click.option(
+    "--knn_cache_size_mb",
+    type=float,
+    default=1024,
+    help="Size bound (in MB) of --knn_cache_dir, least recently used graphs are "
+    "evicted above it.",
+)
+@click.option(
+    "--debug_format",
+    type=click.Choice(DEBUG_FORMATS),
+    default="tsv",
+    help="Format of the file with neighbourhoods of points: DEBUG.tsv, compact "
+    "binary DEBUG.npz (CSR neighbour lists) or none.",
+)
 @click.option(
     "--plot",
     type=bool,
@@ -68,108 +196,456 @@ sys.path.extend(str(Path(__file__).parent))
     is_flag=True,
     help="If set, will skip calculating silhouette coefficient.",
 )
+@click.option(
+    "--silhouette_sample_size",
+    type=int,
+    default=None,
+    help="If set, silhouette coefficient is estimated from a sample of about this "
+    "many points, stratified by cluster, and reported with a 95% confidence "
+    "interval.",
+)
+@click.option(
+    "--profile",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, timings of nested stages, counters (distance calculations, TI "
+    "candidates, k+NN ties) and peak RSS are added to STAT.json and traced to "
+    "trace.jsonl and trace.json (Chrome trace format) in 'output_dir'.",
+)
+@click.option(
+    "--quiet",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, nothing is printed. Progress is otherwise reported only when "
+    "stderr is a terminal.",
+)
 def run(
     dataset_path: str,
     output_dir: Path,
     algorithm: str,
     ti: bool,
+    index: Optional[str],
+    recall_target: float,
+    measure_recall: bool,
+    n_ref_points: int,
+    ref_point_strategy: str,
     plot: bool,
     k: int,
     min_pts: int,
     eps: float,
     m_power: float,
-    skip_silhouette: bool
+    memory_budget_mb: float,
+    workers: int,
+    engine: str,
+    backend: str,
+    out_of_core: bool,
+    spill_dir: Optional[Path],
+    cache: bool,
+    knn_cache_dir: Optional[Path],
+    knn_cache_size_mb: float,
+    debug_format: str,
+    skip_silhouette: bool,
+    silhouette_sample_size: Optional[int],
+    profile: bool,
+    quiet: bool,
+    points: Optional[PointSet] = None,
 ):
-    start_time = time.perf_counter()
-    points: List[Point] = load_points(dataset_path)
-    runtimes = {"1_read_input_file": time.perf_counter() - start_time}
+    # `points` (not an option) are clustered instead of loading the dataset, so
+    # that batch jobs share them
+    configure(quiet=quiet)
+    index = resolve_index(algorithm, index, ti, out_of_core)
+    ti = index == "ti"
+    validate_engine(
+        engine, index, out_of_core, n_ref_points, ref_point_strategy, knn_cache_dir
+    )
+    backend = set_backend(backend)
+    if profile:
+        enable_profiling()
+    spill_dir_context = None
+    try:
+        start_time = time.perf_counter()
+        with span("read_input_file") as read_span:
+            if points is None:
+                points = load_points(dataset_path, cache=cache)
+        runtimes = {"1_read_input_file": read_span.duration}
 
-    dataset_name = Path(dataset_path).stem
+        dataset_name = Path(dataset_path).stem
 
-    main_info = {
-        "#_dimensions": len(points[0].vals),
-        "#_points": len(points),
-        "input_file": str(dataset_path),
-    }
+        main_info = {
+            "#_dimensions": points.dims,
+            "#_points": len(points),
+            "input_file": str(dataset_path),
+        }
 
-    if algorithm == "dbscan":
-        print(f"Running DBSCAN on {dataset_name}, eps={eps}, minPts={min_pts}")
-
-        alg_runtimes = dbscan(points, min_pts=min_pts, eps=eps, m=m_power)
-        output_dir = (
-            output_dir
-            / "dbscan"
-            / dataset_name
-            / f"min_samples_{min_pts}_eps_{eps}_m_{m_power}"
+        output_dir = run_output_dir(
+            output_dir,
+            algorithm,
+            dataset_name,
+            index,
+            k=k,
+            min_pts=min_pts,
+            eps=eps,
+            m_power=m_power,
+            n_ref_points=n_ref_points,
+            ref_point_strategy=ref_point_strategy,
+            recall_target=recall_target,
+            engine=engine,
         )
-        main_info["algorithm"] = "DBSCAN"
-        parameters = {
-            "min_samples": min_pts,
-            "eps": eps,
-            "minkowski_power": m_power,
-        }
-    elif algorithm == "dbscanrn":
-        if ti:
-            print(f"Running DBSCANRN_TI on {dataset_name}, k={k}")
-            ref_point = Point(
-                id=-1,
-                vals=[
-                    min(p.vals[i] for p in points) for i in range(len(points[0].vals))
-                ],
-            )
-            alg_runtimes = dbscanrn(points, k=k, m=m_power, ref_point=ref_point)
+
+        if out_of_core:
+            if spill_dir is not None:
+                spill_dir.mkdir(parents=True, exist_ok=True)
+            spill_dir_context = tempfile.TemporaryDirectory(dir=spill_dir)
+            spill_dir = Path(spill_dir_context.name)
+
+        ti_stats: Dict[str, int] = {}
+        approximate_stats: Dict[str, float] = {}
+        if algorithm == "dbscan":
+            if out_of_core:
+                log(
+                    f"Running out-of-core DBSCAN on {dataset_name}, eps={eps}, "
+                    f"minPts={min_pts}"
+                )
+                alg_runtimes = dbscan_out_of_core(
+                    points, min_pts, eps, m_power, spill_dir, memory_budget_mb
+                )
+            elif engine == "cpp":
+                log(
+                    f"Running DBSCAN{'_TI' if ti else ''} on {dataset_name} with the C++ "
+                    f"engine, eps={eps}, minPts={min_pts}"
+                )
+                ref_points = points.coords.min(axis=0, keepdims=True)
+                alg_runtimes = dbscan_cpp(points, min_pts, eps, m_power, ti)
+            elif ti:
+                log(f"Running DBSCAN_TI on {dataset_name}, eps={eps}, minPts={min_pts}")
+                ref_points = select_reference_points(
+                    points.distance_kernel(m_power), n_ref_points, ref_point_strategy
+                )
+                alg_runtimes = dbscan(
+                    points,
+                    min_pts=min_pts,
+                    eps=eps,
+                    m=m_power,
+                    workers=workers,
+                    ti=True,
+                    ref_point=ref_points,
+                )
+            else:
+                log(f"Running DBSCAN on {dataset_name}, eps={eps}, minPts={min_pts}")
+                neighbour_index = make_neighbour_index(
+                    index,
+                    points,
+                    m_power,
+                    memory_budget_mb=memory_budget_mb,
+                    workers=workers,
+                )
+                alg_runtimes = dbscan(
+                    points, min_pts=min_pts, eps=eps, m=m_power, index=neighbour_index
+                )
+            main_info["algorithm"] = "DBSCAN"
+            parameters = {
+                "TI_optimized": ti,
+                "min_samples": min_pts,
+                "eps": eps,
+                "minkowski_power": m_power,
+                "neighbour_index": index,
+            }
+            if ti:
+                parameters["TI_reference_point"] = ref_points[0].tolist()
+                if len(ref_points) > 1:
+                    parameters["TI_reference_points"] = ref_points.tolist()
+                    parameters["TI_reference_point_strategy"] = ref_point_strategy
+        elif algorithm == "dbscanrn":
+            ref_points = None
+            if out_of_core:
+                log(f"Running out-of-core DBSCANRN on {dataset_name}, k={k}")
+                alg_runtimes = dbscanrn_out_of_core(
+                    points, k, m_power, spill_dir, memory_budget_mb
+                )
+            elif engine == "cpp":
+                log(
+                    f"Running DBSCANRN{'_TI' if ti else ''} on {dataset_name} with the C++ "
+                    f"engine, k={k}"
+                )
+                ref_points = points.coords.min(axis=0, keepdims=True)
+                alg_runtimes = dbscanrn_cpp(points, k, m_power, ti)
+            else:
+                if ti:
+                    log(f"Running DBSCANRN_TI on {dataset_name}, k={k}")
+                    ref_points = select_reference_points(
+                        points.distance_kernel(m_power),
+                        n_ref_points,
+                        ref_point_strategy,
+                    )
+                else:
+                    log(f"Running DBSCANRN on {dataset_name}, k={k}, index={index}")
+                neighbour_index = make_neighbour_index(
+                    index,
+                    points,
+                    m_power,
+                    memory_budget_mb=memory_budget_mb,
+                    ref_points=ref_points,
+                    ti_stats=ti_stats,
+                    workers=workers,
+                    recall_target=recall_target,
+                )
+                approximate_index = neighbour_index if index == "rpforest" else None
+                if knn_cache_dir is not None:
+                    neighbour_index = CachedNeighbourIndex(
+                        neighbour_index,
+                        index,
+                        KNNGraphCache(knn_cache_dir, knn_cache_size_mb),
+                    )
+                alg_runtimes = dbscanrn(points, k=k, m=m_power, index=neighbour_index)
+                if knn_cache_dir is not None:
+                    main_info["k_plus_nn_cache_hit"] = neighbour_index.cache_hit
+                    if neighbour_index.cache_hit:
+                        main_info["k_plus_nn_cached_k"] = neighbour_index.cached_k
+                if approximate_index is not None and approximate_index.trees:
+                    approximate_stats["#_RP_trees"] = len(approximate_index.trees)
+                    approximate_stats["estimated_k_plus_nn_recall"] = (
+                        approximate_index.estimated_recall
+                    )
+            if measure_recall:
+                approximate_stats.update(
+                    compare_with_exact(points, k, m_power, memory_budget_mb, workers)
+                )
+            main_info["algorithm"] = "DBSCANRN"
+            parameters = {
+                "TI_optimized": ti,
+                "k": k,
+                "minkowski_power": m_power,
+                "neighbour_index": index,
+            }
+            if index == "rpforest":
+                parameters["recall_target"] = recall_target
+            if ti:
+                parameters["TI_reference_point"] = ref_points[0].tolist()
+                if len(ref_points) > 1:
+                    parameters["TI_reference_points"] = ref_points.tolist()
+                    parameters["TI_reference_point_strategy"] = ref_point_strategy
         else:
-            print(f"Running DBSCANRN on {dataset_name}, k={k}")
-            alg_runtimes = dbscanrn(points, k=k, m=m_power, ti=False)
+            raise ValueError(f"Unknown algorithm: {algorithm}.")
+        runtimes.update(alg_runtimes)
+        if out_of_core:
+            parameters["out_of_core"] = True
+        if backend != "python":
+            parameters["backend"] = backend
+        if engine != "python":
+            parameters["engine"] = engine
+
+        save_results(
+            points,
+            output_dir,
+            main_info,
+            parameters,
+            runtimes,
+            start_time,
+            m_power,
+            memory_budget_mb=memory_budget_mb,
+            extra_stats={**ti_stats, **approximate_stats},
+            debug_format=debug_format,
+            skip_silhouette=skip_silhouette,
+            silhouette_sample_size=silhouette_sample_size,
+            plot=plot,
+        )
+    finally:
+        if spill_dir_context is not None:
+            spill_dir_context.cleanup()
+        disable_profiling()
+
+
+def resolve_index(
+    algorithm: str, index: Optional[str], ti: bool, out_of_core: bool = False
+) -> str:
+    """
+    :return: Name of the neighbour index, by default "ti" with `ti` and "brute"
+        otherwise.
+    """
+    if index is None:
+        index = "ti" if ti else "brute"
+    elif ti and index != "ti":
+        raise click.UsageError(f"--ti can't be combined with --index {index}.")
+    if algorithm == "dbscan" and index == "rpforest":
+        raise click.UsageError(
+            "--index rpforest computes only k+NN, it can't be used with DBSCAN."
+        )
+    if out_of_core and index != "brute":
+        raise click.UsageError("--out_of_core supports only the brute force index.")
+    return index
+
+
+def validate_engine(
+    engine: str,
+    index: str,
+    out_of_core: bool,
+    n_ref_points: int,
+    ref_point_strategy: str,
+    knn_cache_dir: Optional[Path],
+) -> None:
+    """
+    Checks that options of a run are supported by the `engine`.
+    """
+    if engine != "cpp":
+        return
+    if index not in ("brute", "ti"):
+        raise click.UsageError("--engine cpp supports only brute and ti indexes.")
+    if (n_ref_points, ref_point_strategy) != (1, "min"):
+        raise click.UsageError(
+            "--engine cpp supports only the single 'min' TI reference point."
+        )
+    for option, value in (
+        ("--out_of_core", out_of_core),
+        ("--knn_cache_dir", knn_cache_dir),
+    ):
+        if value:
+            raise click.UsageError(f"--engine cpp can't be combined with {option}.")
+
+
+def run_output_dir(
+    output_dir: Path,
+    algorithm: str,
+    dataset_name: str,
+    index: str,
+    k: int,
+    min_pts: int,
+    eps: float,
+    m_power: float,
+    n_ref_points: int = 1,
+    ref_point_strategy: str = "min",
+    recall_target: float = 0.9,
+    engine: str = "python",
+) -> Path:
+    """
+    :param index: Neighbour index, "ti" for TI optimized versions.
+    :return: Directory of output files of `run` with these parameters.
+    """
+    ti = index == "ti"
+    index_suffix = "" if index in ("brute", "ti") else f"_index_{index}"
+    if algorithm == "dbscan":
+        alg_dir = "dbscan" if not ti else "dbscan_ti"
+        run_name = f"min_samples_{min_pts}_eps_{eps}_m_{m_power}{index_suffix}"
+    elif algorithm == "dbscanrn":
         alg_dir = "dbscanrn" if not ti else "dbscanrn_ti"
-        output_dir = output_dir / alg_dir / dataset_name / f"k_{k}_m_{m_power}"
-        main_info["algorithm"] = "DBSCANRN"
-        parameters = {"TI_optimized": ti, "k": k, "minkowski_power": m_power}
-        if ti:
-            parameters["TI_reference_point"] = ref_point.vals
+        run_name = f"k_{k}_m_{m_power}{index_suffix}"
     else:
         raise ValueError(f"Unknown algorithm: {algorithm}.")
-    runtimes.update(alg_runtimes)
+    if ti and (n_ref_points, ref_point_strategy) != (1, "min"):
+        run_name += f"_refs_{n_ref_points}_{ref_point_strategy}"
+    if algorithm == "dbscanrn" and index == "rpforest":
+        run_name += f"_recall_{recall_target}"
+    if engine != "python":
+        run_name += f"_engine_{engine}"
+    return output_dir / alg_dir / dataset_name / run_name
+
+
+def compare_with_exact(
+    points: PointSet,
+    k: int,
+    m_power: float,
+    memory_budget_mb: float = 256,
+    workers: int = 1,
+) -> Dict[str, float]:
+    """
+    Runs brute-force DBSCANRN on a copy of `points`.
+
+    :return: Recall of its k+NN in those of `points`, and differences of RAND
+        and purity of `points` from its ones.
+    """
+    exact = PointSet(points.coords, ids=points.ids, ground_truth=points.ground_truth)
+    with span("exact_dbscanrn"):
+        dbscanrn(
+            exact,
+            k=k,
+            m=m_power,
+            ti=False,
+            memory_budget_mb=memory_budget_mb,
+            workers=workers,
+        )
+    return {
+        "k_plus_nn_recall": k_plus_nn_recall(points.k_plus_nn, exact.k_plus_nn),
+        "RAND_delta": rand(points)[0] - rand(exact)[0],
+        "Purity_delta": purity(points) - purity(exact),
+    }
+
 
+def save_results(
+    points: PointSet,
+    output_dir: Path,
+    main_info: Dict[str, Any],
+    parameters: Dict[str, Any],
+    runtimes: Dict[str, float],
+    start_time: float,
+    m_power: float,
+    memory_budget_mb: float = 256,
+    extra_stats: Optional[Dict[str, int]] = None,
+    debug_format: str = "tsv",
+    skip_silhouette: bool = False,
+    silhouette_sample_size: Optional[int] = None,
+    plot: bool = False,
+) -> None:
+    """
+    Writes OUT, DEBUG and STAT files of clustered `points` to `output_dir`.
+
+    :param runtimes: Runtimes of the previous stages, updated with stats
+        calculation and total runtime (measured from `start_time`).
+    :param extra_stats: Algorithm specific entries of `clustering_stats`.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
 
     out_file = output_dir / "OUT.csv"
-    with out_file.open("w+") as f:
-        dims = ",".join([f"x_{i}" for i in range(len(points[0].vals))])
-        header = f"point_id,{dims},#_calcs,point_type,c_id\n"
-        f.write(header)
-        f.writelines([e.serialize_out() for e in points])
-
-    debug_file = output_dir / "DEBUG.tsv"
-    with debug_file.open("w+") as f:
-        f.write(points[0].get_serialize_debug_header())
-        f.writelines([p.serialize_debug() for p in points])
-
-    metrics_computation_start_time = time.perf_counter()
-    clustering_stats = {
-        "#_clusters": len(set(p.cluster_id for p in points if p.cluster_id > 0)),
-        "#_core_points": len([p for p in points if p.point_type == 1]),
-        "#_border_points": len([p for p in points if p.point_type == 0]),
-        "#_noise_points": len([p for p in points if p.point_type == -1]),
-        "avg_#_of_distance_calculation": sum(p.calc_ctr for p in points) / len(points),
-    }
-    rand_value, tp, tn, n_pairs = rand(points)
-    clustering_metrics = {
-        "Purity": purity(points),
-        "davies_bouldin": davies_bouldin(points, m_power),
-        "RAND": rand_value,
-        "TN": tn,
-        "TP": tp,
-        "#_of_pairs": n_pairs,
-    }
-    if not skip_silhouette:
-        clustering_metrics["silhouette_coefficient"] = silhouette_coefficient(points, m_power)
+    write_out_file(points, out_file)
+    if debug_format == "tsv":
+        write_debug_file(points, output_dir / "DEBUG.tsv")
+    elif debug_format == "npz":
+        write_debug_npz(points, output_dir / "DEBUG.npz")
 
-    runtimes["5_stats_calculation"] = (
-        time.perf_counter() - metrics_computation_start_time
-    )
+    with span("stats_calculation") as stats_span:
+        clustering_stats = {
+            "#_clusters": len(np.unique(points.cluster_id[points.cluster_id > 0])),
+            "#_core_points": int(np.sum(points.point_type == 1)),
+            "#_border_points": int(np.sum(points.point_type == 0)),
+            "#_noise_points": int(np.sum(points.point_type == -1)),
+            "avg_#_of_distance_calculation": int(points.calc_ctr.sum()) / len(points),
+        }
+        clustering_stats.update(extra_stats or {})
+        table = contingency_table(points)
+        rand_value, tp, tn, n_pairs = rand(points, table)
+        clustering_metrics = {
+            "Purity": purity(points, table),
+            "davies_bouldin": davies_bouldin(points, m_power),
+            "RAND": rand_value,
+            "TN": tn,
+            "TP": tp,
+            "#_of_pairs": n_pairs,
+            "ARI": adjusted_rand(points, table),
+            "NMI": normalized_mutual_info(points, table),
+            "AMI": adjusted_mutual_info(points, table),
+            "F_measure": f_measure(points, table),
+        }
+        if not skip_silhouette and silhouette_sample_size is not None:
+            (
+                clustering_metrics["silhouette_coefficient"],
+                clustering_metrics["silhouette_ci_low"],
+                clustering_metrics["silhouette_ci_high"],
+            ) = sampled_silhouette_coefficient(
+                points,
+                m_power,
+                sample_size=silhouette_sample_size,
+                memory_budget_mb=memory_budget_mb,
+            )
+            clustering_metrics["silhouette_sample_size"] = silhouette_sample_size
+        elif not skip_silhouette:
+            clustering_metrics["silhouette_coefficient"] = silhouette_coefficient(
+                points, m_power, memory_budget_mb=memory_budget_mb
+            )
+
+    runtimes["5_stats_calculation"] = stats_span.duration
     runtimes["total_runtime"] = time.perf_counter() - start_time
 
+    profiler = get_profiler()
     stat_file = output_dir / "STAT.json"
     with stat_file.open("w+") as f:
         stat_dict = {
@@ -179,12 +655,22 @@ def run(
             "clustering_stats": clustering_stats,
             "clustering_time[s]": runtimes,
         }
+        if profiler is not None:
+            stat_dict["profile"] = profiler.to_stat()
         json.dump(stat_dict, f, indent=2, sort_keys=True)
+    if profiler is not None:
+        profiler.write_jsonl(output_dir / "trace.jsonl")
+        profiler.write_chrome_trace(output_dir / "trace.json")
 
     if plot:
-        plot_out_2d(
-            out_file,
+        # Imports matplotlib and seaborn, slow to load
+        from plot import plot_clusters_2d
+
+        plot_clusters_2d(
+            points.coords,
+            points.cluster_id,
             output_file=output_dir / "plot.png",
+            point_ids=points.ids,
         )
 
 
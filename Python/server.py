@@ -0,0 +1,256 @@
+import json
+import os
+import socketserver
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import click
+import numpy as np
+from api import ALGORITHMS, ClusteringSession
+from progress import configure, log
+from utils import PointSet, load_points
+
+
+class SessionRegistry:
+    """
+    Named clustering sessions of loaded datasets. Requests on one dataset are
+    served one at a time, requests on different datasets concurrently.
+    """
+
+    def __init__(self, memory_budget_mb: float = 256, workers: int = 1):
+        self.memory_budget_mb = memory_budget_mb
+        self.workers = workers
+        self.sessions: Dict[str, Tuple[ClusteringSession, threading.Lock]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, points: PointSet) -> ClusteringSession:
+        session = ClusteringSession(
+            points, memory_budget_mb=self.memory_budget_mb, workers=self.workers
+        )
+        with self.lock:
+            self.sessions[name] = (session, threading.Lock())
+        return session
+
+    def remove(self, name: str) -> None:
+        with self.lock:
+            if self.sessions.pop(name, None) is None:
+                raise KeyError(f"Unknown dataset {name}.")
+
+    def get(self, name: str) -> Tuple[ClusteringSession, threading.Lock]:
+        with self.lock:
+            if name not in self.sessions:
+                raise KeyError(f"Unknown dataset {name}.")
+            return self.sessions[name]
+
+    def info(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            sessions = dict(self.sessions)
+        return {name: session_info(session) for name, (session, _) in sessions.items()}
+
+
+def session_info(session: ClusteringSession) -> Dict[str, Any]:
+    return {
+        "#_points": len(session.points),
+        "#_dimensions": session.points.dims,
+        "cached_k": {
+            f"{index}_m_{m}": k for (index, m), (k, _) in session.k_plus_nn.items()
+        },
+        "cached_eps": {
+            f"{index}_m_{m}": eps
+            for (index, m), (eps, _) in session.eps_neighbourhoods.items()
+        },
+    }
+
+
+class ClusteringRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of `SessionRegistry`:
+
+    - `GET /datasets`: loaded datasets with their cached k and eps,
+    - `POST /datasets` with `name` and `path` (of a dataset file) or `points`
+      (list of coordinates): loads a dataset,
+    - `DELETE /datasets/<name>`: unloads a dataset,
+    - `POST /fit` with `dataset`, `algorithm` and `k` or `min_pts` and `eps`,
+      optionally `m` and `index`: clusters a dataset, see
+      `ClusteringSession.fit`.
+    """
+
+    server: "ClusteringHTTPServer"
+
+    def do_GET(self) -> None:
+        if self.path == "/datasets":
+            self._respond(HTTPStatus.OK, {"datasets": self.server.registry.info()})
+        else:
+            self._respond(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}."})
+
+    def do_POST(self) -> None:
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path == "/datasets":
+                self._respond(HTTPStatus.OK, self._load_dataset(request))
+            elif self.path == "/fit":
+                self._respond(HTTPStatus.OK, self._fit(request))
+            else:
+                self._respond(
+                    HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}."}
+                )
+        except KeyError as e:
+            self._respond(HTTPStatus.NOT_FOUND, {"error": e.args[0]})
+        except (ValueError, TypeError, OSError) as e:
+            self._respond(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+
+    def do_DELETE(self) -> None:
+        prefix = "/datasets/"
+        try:
+            if not self.path.startswith(prefix):
+                raise KeyError(f"Unknown path {self.path}.")
+            self.server.registry.remove(self.path[len(prefix) :])
+            self._respond(HTTPStatus.OK, {})
+        except KeyError as e:
+            self._respond(HTTPStatus.NOT_FOUND, {"error": e.args[0]})
+
+    def _load_dataset(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if "path" in request:
+            points = load_points(request["path"], cache=request.get("cache", True))
+            name = request.get("name") or Path(request["path"]).stem
+        elif "points" in request and "name" in request:
+            points = PointSet(np.array(request["points"], dtype=np.float64))
+            name = request["name"]
+        else:
+            raise ValueError("Request needs path or name and points.")
+        session = self.server.registry.add(name, points)
+        return {"name": name, **session_info(session)}
+
+    def _fit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if "dataset" not in request:
+            raise ValueError("Request needs dataset.")
+        session, lock = self.server.registry.get(request["dataset"])
+        algorithm = request.get("algorithm", "dbscanrn")
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm: {algorithm}.")
+        with lock:
+            result = session.fit(
+                algorithm,
+                k=request.get("k"),
+                min_pts=request.get("min_pts"),
+                eps=request.get("eps"),
+                m=request.get("m", 2),
+                index=request.get("index"),
+            )
+        return {
+            "ids": session.points.ids.tolist(),
+            "cluster_id": result.cluster_id.tolist(),
+            "point_type": result.point_type.tolist(),
+            "distance_calculations": result.distance_calculations,
+            "neighbourhoods_cached": result.neighbourhoods_cached,
+            "runtimes": result.runtimes,
+        }
+
+    def _respond(self, status: HTTPStatus, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Clients of a UNIX socket have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log(f"{self.address_string()} - {format % args}")
+
+
+class ClusteringHTTPServer(ThreadingHTTPServer):
+    def __init__(self, server_address: Tuple[str, int], registry: SessionRegistry):
+        super().__init__(server_address, ClusteringRequestHandler)
+        self.registry = registry
+
+
+class ClusteringUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, registry: SessionRegistry):
+        super().__init__(socket_path, ClusteringRequestHandler)
+        self.registry = registry
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--dataset_path",
+    "dataset_paths",
+    type=str,
+    multiple=True,
+    help="Dataset loaded at start, named by its file name without extension.",
+)
+@click.option("--host", type=str, default="127.0.0.1")
+@click.option("--port", type=int, default=8765)
+@click.option(
+    "--unix_socket",
+    type=Path,
+    default=None,
+    help="If set, listens on this UNIX socket instead of --host and --port.",
+)
+@click.option(
+    "--memory_budget_mb",
+    type=float,
+    default=256,
+    help="Memory bound (in MB) for blocks of the distance matrix.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes computing neighbourhoods.",
+)
+@click.option(
+    "--quiet",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, requests are not logged.",
+)
+def serve(
+    dataset_paths: Tuple[str, ...],
+    host: str,
+    port: int,
+    unix_socket: Optional[Path],
+    memory_budget_mb: float,
+    workers: int,
+    quiet: bool,
+):
+    """
+    Serves clustering of datasets kept in memory with their neighbourhoods, so
+    that repeated requests with another k or eps skip loading and searching.
+    """
+    configure(quiet=quiet)
+    registry = SessionRegistry(memory_budget_mb, workers)
+    for dataset_path in dataset_paths:
+        registry.add(Path(dataset_path).stem, load_points(dataset_path))
+
+    if unix_socket is not None:
+        if unix_socket.exists():
+            os.unlink(unix_socket)
+        server = ClusteringUnixServer(str(unix_socket), registry)
+        log(f"Serving on {unix_socket}")
+    else:
+        server = ClusteringHTTPServer((host, port), registry)
+        log(f"Serving on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket is not None and unix_socket.exists():
+            os.unlink(unix_socket)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,335 @@
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+from dbscan import EpsNeighbourhoodSweep, assign_clusters_dbscan
+from dbscanrn import KPlusNNSweep
+from neighbour_index import NeighbourIndex, TreeIndex, make_neighbour_index
+from output import DEBUG_FORMATS
+from profiling import count, span
+from progress import configure, log
+from run import resolve_index, save_results
+from utils import PointSet, load_points
+
+SWEEP_INDEXES = ("brute", "kdtree", "balltree")
+
+
+def _derived_point_set(points: PointSet) -> PointSet:
+    derived = PointSet(points.coords, ids=points.ids, ground_truth=points.ground_truth)
+    derived.calc_ctr[:] = points.calc_ctr
+    return derived
+
+
+def sweep_dbscanrn(
+    points: PointSet,
+    k_values: Sequence[int],
+    index: NeighbourIndex,
+    k_plus_nn_tolerance: float = 10e-9,
+) -> Iterator[Tuple[int, PointSet, Dict[str, float]]]:
+    """
+    Runs DBSCANRN for every k in `k_values`, computing k+NN only once for the
+    largest k. Distance calculations are those of the shared computation.
+
+    :return: Iterator of (k, clustered points, runtimes).
+    """
+    build_time = index.build() if isinstance(index, TreeIndex) else 0
+    with span("shared_k_plus_nn") as shared_span:
+        k_max_plus_nn = index.k_plus_nn_distances(max(k_values), k_plus_nn_tolerance)
+        k_plus_nn_sweep = KPlusNNSweep(k_max_plus_nn, len(points), k_plus_nn_tolerance)
+    count("distance_calculations", points.calc_ctr.sum())
+    shared_runtimes = {
+        "2_sort_by_ref_point_distances": build_time,
+        "shared_neighbourhood_calculation": shared_span.duration,
+    }
+
+    for k in sorted(k_values):
+        with span("derive_rk_plus_nn") as rknn_span:
+            k_points = _derived_point_set(points)
+            k_plus_nn_sweep.set_rknn(k_points, k)
+
+        with span("clustering") as clustering_span:
+            assign_clusters_dbscan(
+                points=k_points,
+                core_mask=k_points.r_k_plus_nn.lengths() >= k,
+                neighbours_cp=k_points.r_k_plus_nn,
+                neighbours_ncp=k_points.k_plus_nn,
+            )
+        runtimes = {
+            **shared_runtimes,
+            "3_eps_neighborhood/rnn_calculation": rknn_span.duration,
+            "4_clustering": clustering_span.duration,
+        }
+        yield k, k_points, runtimes
+
+
+def sweep_dbscan(
+    points: PointSet,
+    min_pts_values: Sequence[int],
+    eps_values: Sequence[float],
+    m: float,
+    index: NeighbourIndex,
+) -> Iterator[Tuple[int, float, PointSet, Dict[str, float]]]:
+    """
+    Runs DBSCAN for every combination of `min_pts_values` and `eps_values`,
+    computing eps neighbourhoods only once for the largest eps. Distance
+    calculations are those of the shared computation.
+
+    :return: Iterator of (min_pts, eps, clustered points, runtimes).
+    """
+    build_time = index.build() if isinstance(index, TreeIndex) else 0
+    with span("shared_eps_neighbourhoods") as shared_span:
+        eps_sweep = EpsNeighbourhoodSweep(
+            points, m, index.eps_neighbour_indices(max(eps_values))
+        )
+    count("distance_calculations", points.calc_ctr.sum())
+    shared_runtimes = {
+        "2_sort_by_ref_point_distances": build_time,
+        "shared_neighbourhood_calculation": shared_span.duration,
+    }
+
+    for eps in sorted(eps_values):
+        with span("derive_eps_neighbourhoods") as eps_neighbourhood_span:
+            eps_neighbours = eps_sweep.eps_neighbours(eps)
+
+        for min_pts in sorted(min_pts_values):
+            with span("clustering") as clustering_span:
+                eps_points = _derived_point_set(points)
+                eps_points.eps_neighbours = eps_neighbours
+                assign_clusters_dbscan(
+                    points=eps_points,
+                    core_mask=eps_neighbours.lengths() >= min_pts,
+                    neighbours_cp=eps_neighbours,
+                    neighbours_ncp=eps_neighbours,
+                )
+            runtimes = {
+                **shared_runtimes,
+                "3_eps_neighborhood/rnn_calculation": eps_neighbourhood_span.duration,
+                "4_clustering": clustering_span.duration,
+            }
+            yield min_pts, eps, eps_points, runtimes
+
+
+@click.command("Run clustering for a grid of parameters, sharing neighbourhoods.")
+@click.option(
+    "-d",
+    "--dataset_path",
+    type=str,
+    required=True,
+    help="Path to dataset to use.",
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    type=Path,
+    required=True,
+    help="Directory where output files will be saved.",
+)
+@click.option(
+    "-a",
+    "--algorithm",
+    type=click.Choice(["dbscan", "dbscanrn"]),
+    required=True,
+    help="Type of algorithm to use.",
+)
+@click.option(
+    "-k",
+    "k_values",
+    type=int,
+    multiple=True,
+    help="'k' parameter values in DBSCANRN algorithm.",
+)
+@click.option(
+    "-p",
+    "--min_pts",
+    "min_pts_values",
+    type=int,
+    multiple=True,
+    help="'min_samples' DBSCAN parameter values.",
+)
+@click.option(
+    "-e",
+    "--eps",
+    "eps_values",
+    type=float,
+    multiple=True,
+    help="'eps' DBSCAN parameter values.",
+)
+@click.option(
+    "--index",
+    type=click.Choice(SWEEP_INDEXES),
+    default="brute",
+    help="Neighbour index used for the shared neighbourhood computation.",
+)
+@click.option(
+    "--m_power",
+    type=float,
+    default=2.0,
+    help="Power used in Minkowsky distance function.",
+)
+@click.option(
+    "--memory_budget_mb",
+    type=float,
+    default=256,
+    help="Memory bound (in MB) for distance matrix tiles of brute-force DBSCANRN "
+    "and silhouette coefficient.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes computing neighbourhoods with the brute force index.",
+)
+@click.option(
+    "--cache/--no_cache",
+    default=True,
+    help="Whether to cache parsed dataset as .npy files next to it and load it "
+    "from them when the dataset files are unchanged.",
+)
+@click.option(
+    "--debug_format",
+    type=click.Choice(DEBUG_FORMATS),
+    default="none",
+    help="Format of the file with neighbourhoods of points of every configuration.",
+)
+@click.option(
+    "--plot",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, will plot results and save them in 'output_dir'.",
+)
+@click.option(
+    "--skip_silhouette",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, will skip calculating silhouette coefficient.",
+)
+@click.option(
+    "--silhouette_sample_size",
+    type=int,
+    default=None,
+    help="If set, silhouette coefficient is estimated from a sample of about this "
+    "many points, stratified by cluster, and reported with a 95% confidence "
+    "interval.",
+)
+@click.option(
+    "--quiet",
+    type=bool,
+    default=False,
+    is_flag=True,
+    help="If set, nothing is printed. Progress is otherwise reported only when "
+    "stderr is a terminal.",
+)
+def sweep(
+    dataset_path: str,
+    output_dir: Path,
+    algorithm: str,
+    k_values: Tuple[int, ...],
+    min_pts_values: Tuple[int, ...],
+    eps_values: Tuple[float, ...],
+    index: str,
+    m_power: float,
+    memory_budget_mb: float,
+    workers: int,
+    cache: bool,
+    debug_format: str,
+    plot: bool,
+    skip_silhouette: bool,
+    silhouette_sample_size: Optional[int],
+    quiet: bool,
+):
+    configure(quiet=quiet)
+    resolve_index(algorithm, index, ti=False)
+    with span("read_input_file") as read_span:
+        points: PointSet = load_points(dataset_path, cache=cache)
+    read_time = read_span.duration
+
+    dataset_name = Path(dataset_path).stem
+    index_suffix = "" if index == "brute" else f"_index_{index}"
+    main_info = {
+        "#_dimensions": points.dims,
+        "#_points": len(points),
+        "input_file": str(dataset_path),
+    }
+    neighbour_index = make_neighbour_index(
+        index, points, m_power, memory_budget_mb=memory_budget_mb, workers=workers
+    )
+
+    if algorithm == "dbscan":
+        if not min_pts_values or not eps_values:
+            raise click.UsageError("DBSCAN sweep requires '-p' and '-e' values.")
+        log(
+            f"Sweeping DBSCAN on {dataset_name}, eps={list(eps_values)}, "
+            f"minPts={list(min_pts_values)}"
+        )
+        main_info["algorithm"] = "DBSCAN"
+        configurations = (
+            (
+                output_dir
+                / "dbscan"
+                / dataset_name
+                / f"min_samples_{min_pts}_eps_{eps}_m_{m_power}{index_suffix}",
+                {
+                    "min_samples": min_pts,
+                    "eps": eps,
+                    "minkowski_power": m_power,
+                    "neighbour_index": index,
+                },
+                eps_points,
+                runtimes,
+            )
+            for min_pts, eps, eps_points, runtimes in sweep_dbscan(
+                points, min_pts_values, eps_values, m_power, neighbour_index
+            )
+        )
+    elif algorithm == "dbscanrn":
+        if not k_values:
+            raise click.UsageError("DBSCANRN sweep requires '-k' values.")
+        log(f"Sweeping DBSCANRN on {dataset_name}, k={list(k_values)}")
+        main_info["algorithm"] = "DBSCANRN"
+        configurations = (
+            (
+                output_dir
+                / "dbscanrn"
+                / dataset_name
+                / f"k_{k}_m_{m_power}{index_suffix}",
+                {
+                    "TI_optimized": False,
+                    "k": k,
+                    "minkowski_power": m_power,
+                    "neighbour_index": index,
+                },
+                k_points,
+                runtimes,
+            )
+            for k, k_points, runtimes in sweep_dbscanrn(
+                points, k_values, neighbour_index
+            )
+        )
+    else:
+        raise ValueError(f"Unknown algorithm: {algorithm}.")
+
+    for run_output_dir, parameters, run_points, runtimes in configurations:
+        runtimes = {"1_read_input_file": read_time, **runtimes}
+        save_results(
+            run_points,
+            run_output_dir,
+            main_info,
+            parameters,
+            runtimes,
+            # Total runtime of a configuration includes the shared stages
+            time.perf_counter() - sum(runtimes.values()),
+            m_power,
+            memory_budget_mb=memory_budget_mb,
+            debug_format=debug_format,
+            skip_silhouette=skip_silhouette,
+            silhouette_sample_size=silhouette_sample_size,
+            plot=plot,
+        )
+
+
+if __name__ == "__main__":
+    sweep()
@@ -0,0 +1,67 @@
+import json
+import threading
+import urllib.request
+
+import numpy as np
+from api import ClusteringSession, fit
+from dbscan import dbscan
+from dbscanrn import dbscanrn
+from server import ClusteringHTTPServer, SessionRegistry
+from utils import PointSet
+
+
+def test_session_reuses_neighbourhoods():
+    coords = np.random.default_rng(11).integers(0, 20, size=(300, 2)).astype(float)
+    session = ClusteringSession(coords)
+
+    for k, cached in ((8, False), (4, True), (8, True), (12, False)):
+        result = session.fit("dbscanrn", k=k)
+        expected = PointSet(coords)
+        dbscanrn(expected, k=k, m=2, ti=False)
+        assert result.neighbourhoods_cached == cached
+        assert (result.distance_calculations == 0) == cached
+        assert result.cluster_id.tolist() == expected.cluster_id.tolist()
+        assert result.point_type.tolist() == expected.point_type.tolist()
+
+    for min_pts, eps in ((5, 3.0), (3, 1.5)):
+        result = session.fit("dbscan", min_pts=min_pts, eps=eps)
+        expected = PointSet(coords)
+        dbscan(expected, min_pts=min_pts, eps=eps, m=2)
+        assert result.cluster_id.tolist() == expected.cluster_id.tolist()
+    assert result.neighbourhoods_cached
+
+    one_shot = fit(coords, "dbscanrn", k=5, index="kdtree")
+    expected = PointSet(coords)
+    dbscanrn(expected, k=5, m=2, ti=False)
+    assert one_shot.cluster_id.tolist() == expected.cluster_id.tolist()
+
+
+def test_server_fit():
+    coords = np.random.default_rng(12).normal(size=(100, 2))
+    server = ClusteringHTTPServer(("127.0.0.1", 0), SessionRegistry())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    def post(path, body):
+        request = urllib.request.Request(
+            url + path, data=json.dumps(body).encode(), method="POST"
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        post("/datasets", {"name": "normal", "points": coords.tolist()})
+        first = post("/fit", {"dataset": "normal", "algorithm": "dbscanrn", "k": 6})
+        second = post("/fit", {"dataset": "normal", "algorithm": "dbscanrn", "k": 6})
+        with urllib.request.urlopen(url + "/datasets") as response:
+            datasets = json.loads(response.read())["datasets"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    expected = PointSet(coords)
+    dbscanrn(expected, k=6, m=2, ti=False)
+    assert first["cluster_id"] == second["cluster_id"] == expected.cluster_id.tolist()
+    assert not first["neighbourhoods_cached"] and second["neighbourhoods_cached"]
+    assert datasets["normal"]["cached_k"] == {"ti_m_2": 6}
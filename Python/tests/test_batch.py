@@ -0,0 +1,112 @@
+import json
+
+import click
+import numpy as np
+import pytest
+from batch import (
+    SUMMARY_LOG_COLUMNS,
+    batch,
+    expand_grid,
+    load_grid,
+    make_job,
+    run_batch,
+    summary_rows,
+)
+from click.testing import CliRunner
+
+
+def write_dataset(directory, name, coords, labels):
+    (directory / "points").mkdir(exist_ok=True)
+    (directory / "ground_truth").mkdir(exist_ok=True)
+    points_path = directory / "points" / f"{name}.tsv"
+    with points_path.open("w") as points_file:
+        points_file.write(f"{len(coords)}\t{coords.shape[1]}\n")
+        np.savetxt(points_file, coords, delimiter="\t")
+    np.savetxt(directory / "ground_truth" / f"{name}.tsv", labels, fmt="%d")
+    return str(points_path)
+
+
+def test_batch_runs_grid_and_skips_complete_jobs(tmp_path):
+    rng = np.random.default_rng(9)
+    centres = np.repeat([[0.0, 0.0], [3.0, 3.0]], 60, axis=0)
+    datasets = [
+        write_dataset(
+            tmp_path,
+            name,
+            centres + rng.normal(size=centres.shape) * 0.3,
+            np.repeat([0, 1], 60),
+        )
+        for name in ("first", "second")
+    ]
+    grid_path = tmp_path / "grid.json"
+    grid_path.write_text(
+        json.dumps(
+            {
+                "datasets": datasets,
+                "algorithms": ["dbscanrn", "dbscan"],
+                "k": [4, 6],
+                "min_pts": 4,
+                "eps": 0.3,
+                "ti": [False, True],
+                "options": {"skip_silhouette": True},
+            }
+        )
+    )
+    jobs = expand_grid(load_grid(grid_path), tmp_path / "out")
+    assert len(jobs) == 2 * 2 * (2 + 1)
+    assert len({job.output_dir for job in jobs}) == len(jobs)
+
+    statuses = run_batch(jobs[:4], workers=1)
+    assert list(statuses.values()) == ["done"] * 4
+    statuses = run_batch(jobs, workers=2)
+    assert sorted(set(statuses.values())) == ["done", "skipped"]
+    assert list(statuses.values()).count("skipped") == 4
+
+    rows = summary_rows(jobs)
+    assert len(rows) == len(jobs)
+    assert {row["input_file"] for row in rows} == {"first", "second"}
+    assert all(row["#_points"] == 120 for row in rows)
+
+
+def test_single_worker_batch_keeps_logging(tmp_path):
+    centres = np.repeat([[0.0, 0.0], [3.0, 3.0]], 20, axis=0)
+    coords = centres + np.random.default_rng(10).normal(size=centres.shape) * 0.3
+    dataset_path = write_dataset(tmp_path, "blobs", coords, np.repeat([0, 1], 20))
+    grid_path = tmp_path / "grid.json"
+    grid_path.write_text(
+        json.dumps(
+            {
+                "datasets": [dataset_path],
+                "k": [4, 6],
+                "options": {"skip_silhouette": True},
+            }
+        )
+    )
+
+    result = CliRunner().invoke(
+        batch, ["-g", str(grid_path), "-o", str(tmp_path / "out"), "-w", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0].startswith("2 jobs to run")
+    assert sum(line.startswith("done [") for line in lines) == 2
+    assert any(line.startswith("2 complete jobs (0 failed)") for line in lines)
+    assert "\t".join(SUMMARY_LOG_COLUMNS) in lines
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"algorithm": "dbscanrn", "k": 4, "ti": True, "index": "kdtree"},
+        {"algorithm": "dbscan", "min_pts": 3, "eps": 1.0, "index": "rpforest"},
+        {"algorithm": "dbscanrn", "k": 4, "ti": True, "out_of_core": True},
+        {"algorithm": "dbscanrn", "k": 4, "engine": "cpp", "index": "kdtree"},
+        {"algorithm": "dbscanrn", "k": 4, "engine": "cpp", "knn_cache_dir": "cache"},
+    ],
+)
+def test_make_job_rejects_unsupported_index(tmp_path, options):
+    dataset_path = write_dataset(
+        tmp_path, "points", np.zeros((4, 2)), np.zeros(4, dtype=int)
+    )
+    with pytest.raises(click.UsageError):
+        make_job({"dataset_path": dataset_path, "output_dir": tmp_path, **options})
@@ -0,0 +1,24 @@
+from benchmarks.bench import find_regressions
+
+
+def test_find_regressions_flags_increases_beyond_threshold():
+    def result(runtime, rss):
+        return {
+            "runtimes": {
+                "3_eps_neighborhood/rnn_calculation": runtime,
+                "4_clustering": 0.01,
+            },
+            "peak_rss_mb": rss,
+            "distance_calculations": 100,
+        }
+
+    baseline = {"results": {"a": result(1.0, 100.0), "b": result(1.0, 100.0)}}
+    current = {"results": {"a": result(1.05, 150.0), "b": result(1.5, 100.0)}}
+
+    rows = find_regressions(baseline, current, threshold=0.1, min_runtime=0.05)
+    regressions = {(row["case"], row["metric"]) for row in rows if row["regression"]}
+    assert regressions == {
+        ("a", "peak_rss_mb"),
+        ("b", "3_eps_neighborhood/rnn_calculation"),
+    }
+    assert all(row["metric"] != "4_clustering" for row in rows)
@@ -0,0 +1,95 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+from clustering_metrics import (
+    adjusted_mutual_info,
+    adjusted_rand,
+    f_measure,
+    normalized_mutual_info,
+    purity,
+    rand,
+    sampled_silhouette_coefficient,
+    silhouette_coefficient,
+)
+from utils import PointSet
+
+
+def labelled_points(ground_truth, cluster_ids) -> PointSet:
+    points = PointSet(np.zeros((len(ground_truth), 1)), ground_truth=ground_truth)
+    points.cluster_id[:] = cluster_ids
+    return points
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_pair_counts_match_naive(seed: int):
+    rng = np.random.default_rng(seed)
+    ground_truth = rng.integers(0, 4, size=120)
+    cluster_ids = rng.choice([-1, 1, 2, 3, 4, 5], size=120)
+    points = labelled_points(ground_truth, cluster_ids)
+
+    tp = tn = 0
+    for i, j in combinations(range(len(points)), 2):
+        same_cluster = cluster_ids[i] == cluster_ids[j]
+        same_gt = ground_truth[i] == ground_truth[j]
+        tp += same_cluster and same_gt
+        tn += not same_cluster and not same_gt
+    n_pairs = len(points) * (len(points) - 1) / 2
+    assert rand(points) == ((tp + tn) / n_pairs, tp, tn, n_pairs)
+
+    expected_purity = sum(
+        max(np.sum((ground_truth == gt) & (cluster_ids == c)) for c in cluster_ids)
+        for gt in np.unique(ground_truth)
+    ) / len(points)
+    assert purity(points) == expected_purity
+
+
+def test_adjusted_indices():
+    ground_truth = np.array([0, 0, 0, 1, 1, 1])
+    points = labelled_points(ground_truth, ground_truth + 1)
+    for metric in (adjusted_rand, normalized_mutual_info, adjusted_mutual_info):
+        assert metric(points) == pytest.approx(1.0)
+    assert f_measure(points) == pytest.approx(1.0)
+
+    # Reference values from the definitions (Hubert & Arabie, Vinh et al.)
+    points = labelled_points(ground_truth, [1, 1, 2, 2, 3, 3])
+    assert adjusted_rand(points) == pytest.approx(0.24242424)
+    assert normalized_mutual_info(points) == pytest.approx(0.51580374)
+    assert adjusted_mutual_info(points) == pytest.approx(0.29879245)
+    assert f_measure(points) == pytest.approx(0.8)
+
+
+def naive_silhouette(coords: np.ndarray, labels: np.ndarray) -> float:
+    coefficients = []
+    for i, x in enumerate(coords):
+        distances = np.sqrt(((coords - x) ** 2).sum(axis=1))
+        same = (labels == labels[i]) & (np.arange(len(coords)) != i)
+        a = distances[same].mean() if same.any() else 0
+        b = min(distances[labels == c].mean() for c in set(labels) - {labels[i]})
+        coefficients.append((b - a) / max(a, b))
+    return float(np.mean(coefficients))
+
+
+def test_silhouette_treats_noise_as_singletons():
+    rng = np.random.default_rng(0)
+    coords = rng.normal(size=(200, 2))
+    cluster_ids = rng.choice([-1, 1, 2, 3], size=200)
+    points = labelled_points(np.zeros(200, dtype=int), cluster_ids)
+    points.coords = coords
+
+    singleton_labels = np.where(cluster_ids == -1, 100 + np.arange(200), cluster_ids)
+    expected = naive_silhouette(coords, singleton_labels)
+    assert silhouette_coefficient(points, 2, memory_budget_mb=0.01) == pytest.approx(
+        expected
+    )
+    assert points.cluster_id.tolist() == cluster_ids.tolist()
+
+    estimate, ci_low, ci_high = sampled_silhouette_coefficient(
+        points, 2, sample_size=80
+    )
+    assert ci_low <= estimate <= ci_high
+    assert sampled_silhouette_coefficient(points, 2, sample_size=80) == (
+        estimate,
+        ci_low,
+        ci_high,
+    )
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from cpp_engine import dbscan_cpp, dbscanrn_cpp, load_library
+from dbscan import dbscan
+from dbscanrn import dbscanrn
+from utils import PointSet
+
+
+@pytest.fixture(autouse=True)
+def cpp_library():
+    try:
+        load_library()
+    except OSError as e:
+        pytest.skip(str(e))
+
+
+def test_cpp_engine_matches_python_engine():
+    coords = np.random.default_rng(8).normal(size=(300, 2))
+    cpp, python = PointSet(coords), PointSet(coords)
+    dbscanrn_cpp(cpp, k=6, m=2, ti=True)
+    dbscanrn(python, k=6, m=2, ti=True)
+
+    assert cpp.cluster_id.tolist() == python.cluster_id.tolist()
+    assert cpp.point_type.tolist() == python.point_type.tolist()
+    assert cpp.calc_ctr.tolist() == python.calc_ctr.tolist()
+    for i in range(len(coords)):
+        assert set(cpp.r_k_plus_nn[i].tolist()) == set(python.r_k_plus_nn[i].tolist())
+
+    cpp, python = PointSet(coords), PointSet(coords)
+    dbscan_cpp(cpp, min_pts=4, eps=0.2, m=2)
+    dbscan(python, min_pts=4, eps=0.2, m=2)
+    # The engine assigns border points to the first cluster expanded to them
+    assert cpp.point_type.tolist() == python.point_type.tolist()
+    core = python.point_type == 1
+    assert cpp.cluster_id[core].tolist() == python.cluster_id[core].tolist()
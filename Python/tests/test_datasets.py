@@ -30,3 +30,28 @@ def test_datasets(dataset_name: str):
 
     examples = load_points(str(dataset_path))
     assert len(examples) > 0
+
+
+def test_cached_dataset_loading(tmp_path: Path):
+    (tmp_path / "points").mkdir()
+    (tmp_path / "ground_truth").mkdir()
+    dataset_path = tmp_path / "points" / "tiny.tsv"
+    dataset_path.write_text("3\t2\n0.5\t1\n2\t-1.25\n3\t4\n")
+    (tmp_path / "ground_truth" / "tiny.tsv").write_text("1\n1\n2\n")
+
+    parsed = load_points(str(dataset_path))
+    cached = load_points(str(dataset_path))
+    assert (tmp_path / "points" / ".tiny.tsv.coords.npy").exists()
+    assert (
+        cached.coords.tolist()
+        == parsed.coords.tolist()
+        == [
+            [0.5, 1.0],
+            [2.0, -1.25],
+            [3.0, 4.0],
+        ]
+    )
+    assert cached.ground_truth.tolist() == [1, 1, 2]
+
+    dataset_path.write_text("3\t2\n0.5\t1\n2\t-1.25\n3\t5.5\n")
+    assert load_points(str(dataset_path)).coords[2].tolist() == [3.0, 5.5]
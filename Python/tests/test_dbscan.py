@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from dbscan import assign_clusters_dbscan, dbscan
+from dbscanrn import select_reference_points
+from utils import NeighbourLists, PointSet
+
+
+def naive_assign_clusters(core_mask, neighbours_cp, neighbours_ncp):
+    n = len(core_mask)
+    cluster_id, point_type = [0] * n, [1 if c else None for c in core_mask]
+    current_cluster_id = 1
+    for core_idx in range(n):
+        if not core_mask[core_idx] or cluster_id[core_idx] != 0:
+            continue
+        cluster_id[core_idx] = current_cluster_id
+        queue = [
+            p for p in neighbours_cp[core_idx] if core_mask[p] and not cluster_id[p]
+        ]
+        while queue:
+            point_to_expand = queue.pop()
+            cluster_id[point_to_expand] = current_cluster_id
+            queue.extend(
+                p
+                for p in neighbours_cp[point_to_expand]
+                if core_mask[p] and not cluster_id[p]
+            )
+        current_cluster_id += 1
+    for idx in range(n):
+        if core_mask[idx]:
+            continue
+        core_neighbours = [p for p in neighbours_ncp[idx] if core_mask[p]]
+        if core_neighbours:
+            cluster_id[idx], point_type[idx] = cluster_id[core_neighbours[0]], 0
+        else:
+            cluster_id[idx], point_type[idx] = -1, -1
+    return cluster_id, point_type
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_assign_clusters_matches_naive_on_asymmetric_neighbours(seed: int):
+    rng = np.random.default_rng(seed)
+    n = 200
+    neighbours_cp = [
+        rng.choice(n, size=rng.integers(0, 4), replace=False).tolist() for _ in range(n)
+    ]
+    neighbours_ncp = [
+        [i] + rng.choice(n, size=rng.integers(0, 4), replace=False).tolist()
+        for i in range(n)
+    ]
+    core_mask = rng.random(n) < 0.6
+    points = PointSet(np.zeros((n, 1)))
+
+    assign_clusters_dbscan(
+        points,
+        core_mask,
+        NeighbourLists.from_lists(neighbours_cp),
+        NeighbourLists.from_lists(neighbours_ncp),
+    )
+
+    cluster_id, point_type = naive_assign_clusters(
+        core_mask, neighbours_cp, neighbours_ncp
+    )
+    assert points.cluster_id.tolist() == cluster_id
+    assert points.point_type.tolist() == point_type
+
+
+def test_dbscan_workers_match_single_process():
+    coords = np.random.default_rng(0).normal(size=(300, 2))
+    single, parallel = PointSet(coords), PointSet(coords)
+    dbscan(single, min_pts=4, eps=0.2, m=2)
+    dbscan(parallel, min_pts=4, eps=0.2, m=2, workers=3)
+
+    assert parallel.cluster_id.tolist() == single.cluster_id.tolist()
+    assert parallel.calc_ctr.tolist() == single.calc_ctr.tolist()
+
+
+@pytest.mark.parametrize("ref_points", [1, 3])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ti_dbscan_matches_brute_force(ref_points: int, workers: int):
+    coords = np.random.default_rng(1).integers(0, 30, size=(400, 2)).astype(float)
+    brute_force, ti = PointSet(coords), PointSet(coords)
+    dbscan(brute_force, min_pts=4, eps=2.0, m=2)
+    ref_point = select_reference_points(ti.distance_kernel(2), ref_points)
+    dbscan(ti, min_pts=4, eps=2.0, m=2, workers=workers, ti=True, ref_point=ref_point)
+
+    assert (
+        ti.eps_neighbours.indices.tolist()
+        == brute_force.eps_neighbours.indices.tolist()
+    )
+    assert ti.cluster_id.tolist() == brute_force.cluster_id.tolist()
+    assert ti.point_type.tolist() == brute_force.point_type.tolist()
+    assert ti.calc_ctr.sum() < brute_force.calc_ctr.sum() / 2
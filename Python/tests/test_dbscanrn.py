@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from dbscanrn import (
+    REFERENCE_POINT_STRATEGIES,
+    select_reference_points,
+    set_rknn,
+    set_rknn_ti,
+)
+from utils import PointSet
+
+
+def naive_k_plus_nn(coords: np.ndarray, k: int, tolerance: float = 10e-9):
+    k_plus_nn = []
+    for i, x in enumerate(coords):
+        distances = np.sqrt(((coords - x) ** 2).sum(axis=1))
+        candidates = sorted((d, j) for j, d in enumerate(distances) if j != i)
+        neighbours = candidates[: k - 1]
+        for candidate in candidates[k - 1 :]:
+            if abs(candidate[0] - neighbours[-1][0]) >= tolerance:
+                break
+            neighbours.append(candidate)
+        k_plus_nn.append([i] + [j for _, j in neighbours])
+    return k_plus_nn
+
+
+@pytest.mark.parametrize("k", [2, 5, 12])
+def test_brute_force_k_plus_nn_with_ties(k: int):
+    coords = np.random.default_rng(k).integers(0, 6, size=(150, 2)).astype(float)
+    points = PointSet(coords)
+    set_rknn(points, k=k, m=2, memory_budget_mb=0.01)
+
+    expected = naive_k_plus_nn(coords, k)
+    assert [points.k_plus_nn[i].tolist() for i in range(len(points))] == expected
+    assert points.calc_ctr.tolist() == [len(points) - 1] * len(points)
+    for i, neighbours in enumerate(expected):
+        for j in neighbours[1:]:
+            assert i in points.r_k_plus_nn[j]
+
+
+def test_ti_matches_brute_force():
+    coords = np.random.default_rng(0).normal(size=(300, 4))
+    brute_force, ti = PointSet(coords), PointSet(coords)
+    set_rknn(brute_force, k=6, m=2)
+    set_rknn_ti(ti, ref_point=coords.min(axis=0), k=6, m=2)
+
+    for i in range(len(coords)):
+        assert set(brute_force.k_plus_nn[i]) == set(ti.k_plus_nn[i])
+    assert ti.calc_ctr.sum() < brute_force.calc_ctr.sum()
+
+
+@pytest.mark.parametrize("strategy", REFERENCE_POINT_STRATEGIES)
+def test_multi_reference_ti_matches_brute_force(strategy: str):
+    coords = np.random.default_rng(1).normal(size=(300, 8))
+    brute_force, ti = PointSet(coords), PointSet(coords)
+    set_rknn(brute_force, k=6, m=2)
+    ref_points = select_reference_points(ti.distance_kernel(2), 4, strategy)
+    ti_stats = {}
+    set_rknn_ti(ti, ref_point=ref_points, k=6, m=2, ti_stats=ti_stats)
+
+    for i in range(len(coords)):
+        assert set(brute_force.k_plus_nn[i]) == set(ti.k_plus_nn[i])
+    assert ti_stats["#_TI_reference_points"] == 4
+    assert ti_stats["#_TI_pruned_candidates"] > 0
+
+
+@pytest.mark.parametrize("ti", [False, True])
+def test_workers_match_single_process(ti: bool):
+    coords = np.random.default_rng(2).integers(0, 10, size=(250, 3)).astype(float)
+    single, parallel = PointSet(coords), PointSet(coords)
+    for points, workers in ((single, 1), (parallel, 2)):
+        if ti:
+            set_rknn_ti(points, ref_point=coords.min(axis=0), k=5, workers=workers)
+        else:
+            set_rknn(points, k=5, m=2, workers=workers)
+
+    assert parallel.k_plus_nn.indices.tolist() == single.k_plus_nn.indices.tolist()
+    assert parallel.r_k_plus_nn.indices.tolist() == single.r_k_plus_nn.indices.tolist()
+    assert parallel.calc_ctr.tolist() == single.calc_ctr.tolist()
+    np.testing.assert_array_equal(parallel.min_eps, single.min_eps)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from distances import DistanceKernel, minkowski_from_diff, scalar_minkowski_fn
+from utils import Point, distance_fn_generator
+
+
+@pytest.mark.parametrize("m", [1.0, 2.0, 3.0])
+def test_kernel_matches_distance_fn(m: float):
+    rng = np.random.default_rng(0)
+    coords = rng.normal(size=(20, 7))
+    points = [Point(id=i, vals=vals) for i, vals in enumerate(coords.tolist())]
+    dist_fn = distance_fn_generator(m)
+    expected = np.array([[dist_fn(p1, p2) for p2 in points] for p1 in points])
+
+    kernel = DistanceKernel(coords, m)
+    assert np.allclose(kernel.block(None), expected)
+    assert np.allclose(kernel.one_to_many(3), expected[3])
+    assert kernel.pair(1, 2) == pytest.approx(expected[1, 2])
+
+
+def test_kernel_chebyshev():
+    coords = np.array([[0.0, 0.0], [3.0, -4.0], [1.0, 2.0]])
+    kernel = DistanceKernel(coords, float("inf"))
+    assert kernel.one_to_many(0).tolist() == [0.0, 4.0, 2.0]
+
+
+def test_kernel_counts_calculations():
+    coords = np.arange(12, dtype=np.float64).reshape(6, 2)
+    calc_ctr = np.zeros(6, dtype=np.int64)
+    kernel = DistanceKernel(coords, 2, calc_ctr=calc_ctr)
+
+    kernel.one_to_many(0, [1, 2, 3])
+    kernel.pair(1, 0)
+    kernel.block([4, 5], [0, 1])
+    kernel.point_to_many(np.zeros(2), count=True)
+    assert calc_ctr.tolist() == [4, 2, 1, 1, 3, 3]
+
+
+@pytest.mark.parametrize("m", [1.0, 2.0, 3.0, float("inf")])
+def test_scalar_distance_matches_kernel(m: float):
+    coords = np.random.default_rng(1).normal(size=(2, 5))
+    distance = scalar_minkowski_fn(m, 5)
+    assert distance(*coords.tolist()) == pytest.approx(
+        float(minkowski_from_diff(coords[1] - coords[0], m))
+    )
+    assert scalar_minkowski_fn(m, 512) is None
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from dbscanrn import dbscanrn
+from incremental import IncrementalDBSCANRN
+from utils import PointSet
+
+
+def assert_matches_from_scratch(incremental: IncrementalDBSCANRN):
+    points = incremental.point_set()
+    expected = PointSet(points.coords)
+    dbscanrn(expected, k=incremental.k, m=incremental.m, ti=False)
+
+    for i in range(len(points)):
+        assert points.k_plus_nn[i].tolist() == expected.k_plus_nn[i].tolist()
+        assert points.r_k_plus_nn[i].tolist() == expected.r_k_plus_nn[i].tolist()
+    assert points.cluster_id.tolist() == expected.cluster_id.tolist()
+    assert points.point_type.tolist() == expected.point_type.tolist()
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("m", [1, 2, np.inf])
+def test_incremental_matches_from_scratch(seed: int, m: float):
+    rng = np.random.default_rng(seed)
+    k = int(rng.integers(1, 7))
+    if seed % 2:
+        sample = lambda size: rng.integers(0, 6, size=(size, 2)).astype(float)
+    else:
+        sample = lambda size: rng.normal(size=(size, 2))
+    incremental = IncrementalDBSCANRN.from_points(PointSet(sample(30)), k=k, m=m)
+    assert_matches_from_scratch(incremental)
+
+    for _ in range(15):
+        present = np.flatnonzero(incremental.active)
+        if rng.random() < 0.6 or len(present) < 5:
+            incremental.insert(sample(int(rng.integers(1, 4))))
+        else:
+            incremental.delete(rng.choice(present, size=2, replace=False).tolist())
+        assert_matches_from_scratch(incremental)
@@ -0,0 +1,53 @@
+import kernels
+import numpy as np
+import pytest
+from dbscan import dbscan
+from dbscanrn import dbscanrn, select_reference_points
+from utils import PointSet
+
+
+@pytest.fixture(params=["interpreted", "compiled"])
+def kernel_backend(request, monkeypatch):
+    """
+    Selects the "numba" backend; its kernels run interpreted without Numba,
+    which checks the same source.
+    """
+    if request.param == "compiled" and not kernels.numba_available():
+        pytest.skip("Numba is not installed.")
+    if request.param == "interpreted":
+        monkeypatch.setattr(kernels, "compiled", lambda name: getattr(kernels, name))
+    monkeypatch.setattr(kernels, "_backend", "numba")
+    return monkeypatch
+
+
+@pytest.mark.parametrize("n_ref_points", [1, 3])
+@pytest.mark.parametrize("m", [2, np.inf])
+def test_kernels_match_reference(kernel_backend, n_ref_points: int, m: float):
+    coords = np.random.default_rng(6).integers(0, 10, size=(250, 3)).astype(float)
+    ref_points = select_reference_points(
+        PointSet(coords).distance_kernel(m), n_ref_points
+    )
+    reference, compiled = PointSet(coords), PointSet(coords)
+    dbscanrn(compiled, k=6, m=m, ref_point=ref_points)
+    kernel_backend.setattr(kernels, "_backend", "python")
+    dbscanrn(reference, k=6, m=m, ref_point=ref_points)
+
+    for i in range(len(coords)):
+        assert compiled.k_plus_nn[i].tolist() == reference.k_plus_nn[i].tolist()
+        assert compiled.r_k_plus_nn[i].tolist() == reference.r_k_plus_nn[i].tolist()
+    assert compiled.calc_ctr.tolist() == reference.calc_ctr.tolist()
+    assert np.array_equal(compiled.max_eps, reference.max_eps, equal_nan=True)
+    assert compiled.cluster_id.tolist() == reference.cluster_id.tolist()
+    assert compiled.point_type.tolist() == reference.point_type.tolist()
+
+
+def test_backend_falls_back_to_python(monkeypatch):
+    monkeypatch.setattr(kernels, "numba_available", lambda: False)
+    try:
+        assert kernels.set_backend("numba") == "python"
+        coords = np.random.default_rng(7).normal(size=(200, 2))
+        points = PointSet(coords)
+        dbscan(points, min_pts=4, eps=0.2, m=2)
+        assert (points.cluster_id != 0).all()
+    finally:
+        kernels.set_backend("python")
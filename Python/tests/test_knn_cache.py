@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+from knn_cache import CachedNeighbourIndex, KNNGraphCache
+from neighbour_index import make_neighbour_index
+from utils import PointSet
+
+
+def cached_index(coords, cache, name="ti"):
+    points = PointSet(coords)
+    return CachedNeighbourIndex(make_neighbour_index(name, points, 2), name, cache)
+
+
+def assert_same_graph(points, expected):
+    for i in range(len(points)):
+        assert points.k_plus_nn[i].tolist() == expected.k_plus_nn[i].tolist()
+        assert sorted(points.r_k_plus_nn[i].tolist()) == sorted(
+            expected.r_k_plus_nn[i].tolist()
+        )
+
+
+@pytest.mark.parametrize("name", ["brute", "ti"])
+def test_knn_cache_reuses_graph(tmp_path, name: str):
+    # Integer grid coordinates, with many distance ties
+    coords = np.random.default_rng(16).integers(0, 10, size=(300, 2)).astype(float)
+    cache = KNNGraphCache(tmp_path)
+    computed = cached_index(coords, cache, name)
+    computed.set_rknn(k=9)
+    assert not computed.cache_hit
+
+    loaded = cached_index(coords, cache, name)
+    loaded.set_rknn(k=9)
+    assert loaded.cache_hit
+    for attr in ("k_plus_nn", "r_k_plus_nn"):
+        for array in ("indptr", "indices"):
+            assert np.array_equal(
+                getattr(getattr(loaded.points, attr), array),
+                getattr(getattr(computed.points, attr), array),
+            )
+    assert loaded.points.calc_ctr.tolist() == computed.points.calc_ctr.tolist()
+    assert np.array_equal(
+        loaded.points.max_eps, computed.points.max_eps, equal_nan=True
+    )
+
+    for k in (3, 5, 7):
+        derived = cached_index(coords, cache, name)
+        derived.set_rknn(k=k)
+        # TI k+NN of a smaller k are not prefixes of the cached ones with ties
+        assert derived.cache_hit == (name == "brute")
+        expected = PointSet(coords)
+        make_neighbour_index(name, expected, 2).set_rknn(k=k)
+        assert_same_graph(derived.points, expected)
+
+
+def test_knn_cache_evicts_least_recently_used(tmp_path):
+    rng = np.random.default_rng(8)
+    cache = KNNGraphCache(tmp_path)
+    for coords in (rng.normal(size=(100, 2)), rng.normal(size=(100, 2))):
+        cached_index(coords, cache).set_rknn(k=3)
+    files = sorted(tmp_path.glob("*.npz"))
+    assert len(files) == 2
+    os.utime(files[0], (0, 0))
+
+    cache.max_size_mb = files[1].stat().st_size / 2**20
+    assert cache.evict() == [files[0]]
+    assert list(tmp_path.glob("*.npz")) == [files[1]]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from dbscanrn import set_rknn
+from neighbour_index import BruteForceIndex, k_plus_nn_recall, make_neighbour_index
+from utils import PointSet
+
+
+@pytest.mark.parametrize("name", ["kdtree", "balltree"])
+@pytest.mark.parametrize("m", [1, 2, np.inf])
+def test_tree_k_plus_nn_matches_brute_force(name: str, m: float):
+    coords = np.random.default_rng(3).integers(0, 8, size=(200, 3)).astype(float)
+    brute_force, tree = PointSet(coords), PointSet(coords)
+    set_rknn(brute_force, k=5, m=m)
+    make_neighbour_index(name, tree, m, leaf_size=8).set_rknn(k=5)
+
+    for i in range(len(coords)):
+        assert brute_force.k_plus_nn[i].tolist() == tree.k_plus_nn[i].tolist()
+        assert brute_force.r_k_plus_nn[i].tolist() == tree.r_k_plus_nn[i].tolist()
+
+
+@pytest.mark.parametrize("name", ["kdtree", "balltree"])
+def test_tree_eps_neighbourhoods_match_brute_force(name: str):
+    coords = np.random.default_rng(4).normal(size=(300, 2))
+    expected = BruteForceIndex(PointSet(coords), m=2).eps_neighbour_indices(0.3)
+    tree = make_neighbour_index(name, PointSet(coords), m=2, leaf_size=8)
+    assert tree.eps_neighbour_indices(0.3) == expected
+
+
+def test_default_k_plus_nn_distances_match_brute_force():
+    coords = np.random.default_rng(6).integers(0, 8, size=(200, 2)).astype(float)
+    expected = BruteForceIndex(PointSet(coords), m=2).k_plus_nn_distances(k=5)
+    ti = make_neighbour_index("ti", PointSet(coords), m=2).k_plus_nn_distances(k=5)
+
+    for (i, indices, distances), (j, ti_indices, ti_distances) in zip(expected, ti):
+        assert i == j
+        assert indices.tolist() == ti_indices.tolist()
+        assert np.allclose(distances, ti_distances)
+
+
+def test_random_projection_forest_recall():
+    coords = np.random.default_rng(5).normal(size=(400, 16))
+    exact, approximate = PointSet(coords), PointSet(coords)
+    set_rknn(exact, k=6, m=2)
+    index = make_neighbour_index("rpforest", approximate, m=2, recall_target=0.95)
+    index.set_rknn(k=6)
+
+    assert index.estimated_recall >= 0.95 or len(index.trees) == index.max_trees
+    assert k_plus_nn_recall(approximate.k_plus_nn, exact.k_plus_nn) >= 0.9
+    assert approximate.calc_ctr.sum() < exact.calc_ctr.sum()
+    assert (approximate.k_plus_nn.lengths() >= 6).all()
+
+    # Points fitting in a single leaf are all candidates of each other
+    small = PointSet(coords[:50])
+    make_neighbour_index("rpforest", small, m=2, leaf_size=64).set_rknn(k=6)
+    assert k_plus_nn_recall(small.k_plus_nn, exact_k_plus_nn(coords[:50], 6)) == 1.0
+
+
+def exact_k_plus_nn(coords, k):
+    points = PointSet(coords)
+    set_rknn(points, k=k, m=2)
+    return points.k_plus_nn
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import run as run_module
+from dbscan import dbscan
+from dbscanrn import dbscanrn
+from out_of_core import dbscan_out_of_core, dbscanrn_out_of_core
+from utils import PointSet
+
+
+def test_dbscan_out_of_core_matches_in_memory(tmp_path):
+    coords = np.random.default_rng(9).normal(size=(400, 2))
+    expected, spilled = PointSet(coords), PointSet(coords)
+    dbscan(expected, min_pts=5, eps=0.2, m=2)
+    dbscan_out_of_core(spilled, 5, 0.2, 2, tmp_path, memory_budget_mb=0.01)
+
+    assert spilled.cluster_id.tolist() == expected.cluster_id.tolist()
+    assert spilled.point_type.tolist() == expected.point_type.tolist()
+    assert spilled.calc_ctr.tolist() == expected.calc_ctr.tolist()
+    assert np.array_equal(
+        spilled.eps_neighbours.indices, expected.eps_neighbours.indices
+    )
+
+
+def test_dbscanrn_out_of_core_matches_in_memory(tmp_path):
+    coords = np.random.default_rng(10).integers(0, 12, size=(400, 2)).astype(float)
+    expected, spilled = PointSet(coords), PointSet(coords)
+    dbscanrn(expected, k=6, m=2, ti=False)
+    dbscanrn_out_of_core(spilled, 6, 2, tmp_path, memory_budget_mb=0.01)
+
+    assert spilled.cluster_id.tolist() == expected.cluster_id.tolist()
+    assert spilled.point_type.tolist() == expected.point_type.tolist()
+    for attr in ("k_plus_nn", "r_k_plus_nn"):
+        assert np.array_equal(
+            getattr(spilled, attr).indptr, getattr(expected, attr).indptr
+        )
+        assert np.array_equal(
+            getattr(spilled, attr).indices, getattr(expected, attr).indices
+        )
+
+
+def test_run_removes_spill_files_on_error(tmp_path, monkeypatch):
+    def failing_dbscanrn(points, k, m, spill_dir, memory_budget_mb):
+        (spill_dir / "run_0.bin").write_bytes(b"0")
+        raise RuntimeError("failed")
+
+    monkeypatch.setattr(run_module, "dbscanrn_out_of_core", failing_dbscanrn)
+    args = ["-d", "unused.tsv", "-o", str(tmp_path / "out"), "-a", "dbscanrn"]
+    args += ["-k", "3", "--out_of_core", "--spill_dir", str(tmp_path / "spill")]
+    args += ["--quiet"]
+    with run_module.run.make_context("run", args) as ctx:
+        params = ctx.params
+    try:
+        run_module.run.callback(**params, points=PointSet(np.zeros((5, 2))))
+    except RuntimeError:
+        # Checked while the failed run's frame (and its temporary directory)
+        # is still referenced by the traceback
+        assert list((tmp_path / "spill").iterdir()) == []
+    else:
+        pytest.fail("run() didn't raise.")
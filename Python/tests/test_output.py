@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import numpy as np
+from output import write_debug_file, write_debug_npz, write_out_file
+from utils import NeighbourLists, PointSet
+
+
+def test_writers_match_point_serialization(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    n = 50
+    points = PointSet(rng.normal(scale=10, size=(n, 3)))
+    points.coords[0] = [2.0005, -0.0004, 1e-7]
+    k_plus_nn = [[i] + rng.choice(n, size=3, replace=False).tolist() for i in range(n)]
+    points.k_plus_nn = NeighbourLists.from_lists(k_plus_nn)
+    points.r_k_plus_nn = NeighbourLists.from_edges(
+        [j for neighbours in k_plus_nn for j in neighbours[1:]],
+        [neighbours[0] for neighbours in k_plus_nn for _ in neighbours[1:]],
+        n,
+    )
+    points.min_eps[::2] = rng.random(n)[::2]
+    points.max_eps[::3] = rng.random(n)[::3]
+    points.calc_ctr[:] = rng.integers(0, 100, size=n)
+    points.point_type[:] = rng.choice([-1, 0, 1], size=n)
+    points.cluster_id[:] = rng.choice([-1, 1, 2], size=n)
+
+    write_out_file(points, tmp_path / "OUT.csv")
+    write_debug_file(points, tmp_path / "DEBUG.tsv")
+
+    out_lines = (tmp_path / "OUT.csv").read_text().splitlines(keepends=True)
+    assert out_lines[1:] == [p.serialize_out() for p in points]
+    debug_lines = (tmp_path / "DEBUG.tsv").read_text().splitlines(keepends=True)
+    assert debug_lines[0] == points[0].get_serialize_debug_header()
+    assert debug_lines[1:] == [p.serialize_debug() for p in points]
+
+    write_debug_npz(points, tmp_path / "DEBUG.npz")
+    with np.load(tmp_path / "DEBUG.npz") as debug:
+        assert debug["k_plus_nn_indices"].tolist() == points.k_plus_nn.indices.tolist()
+        assert (
+            debug["r_k_plus_nn_indptr"].tolist() == points.r_k_plus_nn.indptr.tolist()
+        )
+        assert "eps_neighbours_indptr" not in debug
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from output import write_out_file
+from plot import plot_clusters_2d, plot_out_2d, project_2d
+from utils import PointSet
+
+
+@pytest.mark.parametrize("projection", ["pca", "random"])
+def test_project_2d_keeps_separated_clusters_apart(projection: str):
+    rng = np.random.default_rng(3)
+    centres = rng.normal(scale=20, size=(2, 64))
+    coords = np.repeat(centres, 100, axis=0) + rng.normal(size=(200, 64))
+    xy = project_2d(coords, projection)
+
+    assert xy.shape == (200, 2)
+    gap = np.linalg.norm(xy[:100].mean(axis=0) - xy[100:].mean(axis=0))
+    assert gap > 3 * max(xy[:100].std(axis=0).max(), xy[100:].std(axis=0).max())
+    assert np.array_equal(project_2d(coords[:, :2], projection), coords[:, :2])
+
+
+def test_plots_scatter_and_raster(tmp_path: Path):
+    rng = np.random.default_rng(4)
+    points = PointSet(rng.normal(size=(300, 3)))
+    points.cluster_id[:] = rng.choice([-1, 1, 2], size=300)
+    write_out_file(points, tmp_path / "OUT.csv")
+
+    plot_out_2d(tmp_path / "OUT.csv", tmp_path / "scatter.png")
+    plot_clusters_2d(
+        points.coords,
+        points.cluster_id,
+        tmp_path / "raster.png",
+        raster_threshold=100,
+        bins=32,
+    )
+
+    assert (tmp_path / "scatter.png").stat().st_size > 0
+    assert (tmp_path / "raster.png").stat().st_size > 0
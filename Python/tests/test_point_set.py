@@ -0,0 +1,30 @@
+import numpy as np
+from utils import NeighbourLists, Point, PointSet
+
+
+def test_neighbour_lists_from_edges_keeps_edge_order():
+    neighbour_lists = NeighbourLists.from_edges(
+        sources=np.array([2, 0, 2, 1, 0]), targets=np.array([5, 6, 7, 8, 9]), n=4
+    )
+    assert [neighbour_lists[i].tolist() for i in range(4)] == [[6, 9], [8], [5, 7], []]
+    assert neighbour_lists.lengths().tolist() == [2, 1, 2, 0]
+
+
+def test_point_view_round_trip():
+    points = [
+        Point(id=i, vals=[float(i), float(-i)], ground_truth=i % 2) for i in range(3)
+    ]
+    point_set = PointSet.from_points(points)
+    point_set.k_plus_nn = NeighbourLists.from_lists([[0, 1], [1, 0], [2, 1]])
+    point_set[2].cluster_id = 7
+    point_set[2].point_type = 1
+
+    view = point_set[2]
+    assert view.vals == [2.0, -2.0]
+    assert (view.cluster_id, view.point_type, view.min_eps) == (7, 1, None)
+    assert [p.id for p in view.k_plus_nn] == [2, 1]
+    assert view.serialize_out() == points[2].serialize_out().replace("None,0", "1,7")
+
+    restored = point_set.to_points()
+    assert [p.id for p in restored[0].k_plus_nn] == [0, 1]
+    assert restored[2].cluster_id == 7 and restored[1].point_type is None
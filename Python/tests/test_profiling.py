@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+from dbscanrn import dbscanrn
+from profiling import count, disable_profiling, enable_profiling, span
+from utils import PointSet
+
+
+def test_spans_are_recorded_only_when_profiling():
+    with span("outer") as outer:
+        pass
+    assert outer.duration >= 0
+
+    profiler = enable_profiling()
+    try:
+        with span("outer"):
+            with span("inner"):
+                count("ticks", 2)
+            count("ticks")
+    finally:
+        assert disable_profiling() is profiler
+    count("ticks")
+
+    assert [record["path"] for record in profiler.spans] == ["outer/inner", "outer"]
+    stat = profiler.to_stat()
+    assert stat["counters"] == {"ticks": 3}
+    assert set(stat["spans"]) == {"outer", "outer/inner"}
+    assert stat["peak_rss_mb"] > 0
+
+
+def test_dbscanrn_counters(tmp_path):
+    coords = np.random.default_rng(3).integers(0, 10, size=(150, 2)).astype(float)
+    points = PointSet(coords)
+    profiler = enable_profiling()
+    try:
+        dbscanrn(points, k=5, m=2, ti=True)
+    finally:
+        disable_profiling()
+
+    counters = profiler.counters
+    assert counters["distance_calculations"] == points.calc_ctr.sum()
+    assert counters["k_plus_nn_ties"] == sum(
+        max(0, len(points.k_plus_nn[i]) - 5) for i in range(len(points))
+    )
+    # One reference point distance per point, every visited candidate compared
+    assert counters["ti_pruned_candidates"] == 0
+    assert counters["ti_visited_candidates"] == counters["distance_calculations"] - len(
+        points
+    )
+
+    profiler.write_chrome_trace(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert {"sort_by_ref_point_distances", "rk_plus_nn_ti", "clustering"} <= {
+        event["name"] for event in events
+    }
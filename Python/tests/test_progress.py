@@ -0,0 +1,34 @@
+import io
+
+import progress
+from progress import Progress
+
+
+def test_progress_reports_only_when_enabled():
+    try:
+        progress.configure(enabled=True)
+        stream = io.StringIO()
+        with Progress(10, "Counting...", stream=stream) as progress_bar:
+            for _ in range(10):
+                progress_bar.update()
+        assert stream.getvalue().startswith("Counting... 10/10 [")
+        assert stream.getvalue().endswith("it/s]\n")
+
+        stream = io.StringIO()
+        with Progress(10, None, stream=stream) as progress_bar:
+            progress_bar.update(10)
+        assert stream.getvalue() == ""
+
+        progress.configure(quiet=True, enabled=True)
+        stream = io.StringIO()
+        with Progress(10, "Counting...", stream=stream) as progress_bar:
+            progress_bar.update(10)
+        assert stream.getvalue() == ""
+    finally:
+        progress.configure()
+
+
+def test_progress_yields_all_items():
+    assert list(progress.progress(iter(range(5)), "Counting...")) == list(range(5))
+    # Not a terminal under pytest, so disabled by default
+    assert not progress.progress_enabled(io.StringIO())
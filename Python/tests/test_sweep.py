@@ -0,0 +1,33 @@
+import numpy as np
+from dbscan import dbscan
+from dbscanrn import set_rknn
+from neighbour_index import make_neighbour_index
+from sweep import sweep_dbscan, sweep_dbscanrn
+from utils import PointSet
+
+
+def test_sweep_dbscanrn_matches_single_runs():
+    coords = np.random.default_rng(5).integers(0, 10, size=(200, 2)).astype(float)
+    points = PointSet(coords)
+    index = make_neighbour_index("brute", points, m=2)
+
+    for k, swept, _ in sweep_dbscanrn(points, [3, 6, 10], index):
+        expected = PointSet(coords)
+        set_rknn(expected, k=k, m=2)
+        for i in range(len(coords)):
+            assert swept.k_plus_nn[i].tolist() == expected.k_plus_nn[i].tolist()
+            assert sorted(swept.r_k_plus_nn[i].tolist()) == sorted(
+                expected.r_k_plus_nn[i].tolist()
+            )
+
+
+def test_sweep_dbscan_matches_single_runs():
+    coords = np.random.default_rng(6).normal(size=(300, 2))
+    points = PointSet(coords)
+    index = make_neighbour_index("kdtree", points, m=2)
+
+    for min_pts, eps, swept, _ in sweep_dbscan(points, [3, 6], [0.1, 0.2], 2, index):
+        expected = PointSet(coords)
+        dbscan(expected, min_pts=min_pts, eps=eps, m=2)
+        assert swept.cluster_id.tolist() == expected.cluster_id.tolist()
+        assert swept.point_type.tolist() == expected.point_type.tolist()
@@ -1,9 +1,12 @@
+import json
+import os
 from dataclasses import dataclass
-from typing import Callable, List, Optional, Union
+from itertools import chain
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Union
 
-import seaborn as sns
-
-sns.set_style("darkgrid")
+import numpy as np
+from distances import DistanceKernel
 
 
 @dataclass
@@ -71,21 +74,336 @@ class Point:
         return f"{values}\n"
 
 
-def load_points(dataset_path: str) -> List[Point]:
+class NeighbourLists:
+    """
+    Neighbour index lists of all points in CSR layout: neighbours of point `i`
+    are `indices[indptr[i]:indptr[i + 1]]`.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_lists(cls, lists: Sequence[Sequence[int]]) -> "NeighbourLists":
+        lengths = np.fromiter((len(l) for l in lists), dtype=np.int64, count=len(lists))
+        indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter(
+            chain.from_iterable(lists), dtype=np.int64, count=int(indptr[-1])
+        )
+        return cls(indptr, indices)
+
+    @classmethod
+    def from_edges(
+        cls, sources: np.ndarray, targets: np.ndarray, n: int
+    ) -> "NeighbourLists":
+        """
+        :return: Lists of `targets` grouped by `sources`, keeping the edge order.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return cls(indptr, np.asarray(targets, dtype=np.int64)[order])
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.indices[self.indptr[idx] : self.indptr[idx + 1]]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes
+
+
+_UNSET_POINT_TYPE = -2
+
+
+class PointSet:
+    """
+    Columnar storage of points: coordinates as one (n, d) matrix and per point
+    attributes as typed arrays. Indexing returns `PointView` objects exposing
+    the `Point` interface.
+    """
+
+    def __init__(
+        self,
+        coords: np.ndarray,
+        ids: Optional[np.ndarray] = None,
+        ground_truth: Optional[np.ndarray] = None,
+    ):
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        n = len(self.coords)
+        self.ids = np.arange(n) if ids is None else np.asarray(ids)
+        self.ground_truth = (
+            np.full(n, -1, dtype=np.int64)
+            if ground_truth is None
+            else np.asarray(ground_truth, dtype=np.int64)
+        )
+        self.cluster_id = np.zeros(n, dtype=np.int64)
+        self.point_type = np.full(n, _UNSET_POINT_TYPE, dtype=np.int8)
+        self.calc_ctr = np.zeros(n, dtype=np.int64)
+        self.min_eps = np.full(n, np.nan)
+        self.max_eps = np.full(n, np.nan)
+        self.k_plus_nn: Optional[NeighbourLists] = None
+        self.r_k_plus_nn: Optional[NeighbourLists] = None
+        self.eps_neighbours: Optional[NeighbourLists] = None
+
+    @classmethod
+    def from_points(cls, points: Sequence[Point]) -> "PointSet":
+        point_set = cls(
+            np.array([p.vals for p in points], dtype=np.float64),
+            ids=np.array([p.id for p in points]),
+            ground_truth=np.array([p.ground_truth for p in points]),
+        )
+        point_set.cluster_id[:] = [p.cluster_id for p in points]
+        point_set.calc_ctr[:] = [p.calc_ctr for p in points]
+        return point_set
+
+    def to_points(self) -> List[Point]:
+        points = [
+            Point(
+                id=p.id,
+                vals=p.vals,
+                ground_truth=p.ground_truth,
+                cluster_id=p.cluster_id,
+                point_type=p.point_type,
+                min_eps=p.min_eps,
+                max_eps=p.max_eps,
+                calc_ctr=p.calc_ctr,
+            )
+            for p in self
+        ]
+        for attr in ("k_plus_nn", "r_k_plus_nn", "eps_neighbours"):
+            neighbour_lists = getattr(self, attr)
+            if neighbour_lists is not None:
+                for idx, point in enumerate(points):
+                    neighbours = [points[j] for j in neighbour_lists[idx].tolist()]
+                    setattr(point, attr, neighbours)
+        return points
+
+    @property
+    def dims(self) -> int:
+        return self.coords.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def __getitem__(self, idx: int) -> "PointView":
+        if not -len(self) <= idx < len(self):
+            raise IndexError(f"Point index {idx} out of range.")
+        return PointView(self, idx % len(self))
+
+    def __iter__(self) -> Iterator["PointView"]:
+        return (PointView(self, idx) for idx in range(len(self)))
+
+    def distance_kernel(self, m: float) -> DistanceKernel:
+        """
+        :return: Distance kernel over the coordinates, counting distance
+            calculations in `calc_ctr`.
+        """
+        return DistanceKernel(self.coords, m, calc_ctr=self.calc_ctr)
+
+    def nbytes(self) -> int:
+        arrays = (
+            self.coords,
+            self.ids,
+            self.ground_truth,
+            self.cluster_id,
+            self.point_type,
+            self.calc_ctr,
+            self.min_eps,
+            self.max_eps,
+        )
+        neighbour_lists = (self.k_plus_nn, self.r_k_plus_nn, self.eps_neighbours)
+        return sum(a.nbytes for a in arrays) + sum(
+            nl.nbytes() for nl in neighbour_lists if nl is not None
+        )
+
+
+class PointView:
+    """
+    Read/write view of a single point of a `PointSet` with the `Point` interface.
+    Scalars are returned as Python objects, neighbours as lists of views.
+    """
+
+    __slots__ = ("_points", "_idx")
+
+    def __init__(self, points: PointSet, idx: int):
+        self._points = points
+        self._idx = idx
+
+    @property
+    def index(self) -> int:
+        return self._idx
+
+    @property
+    def id(self) -> Union[str, int]:
+        return self._points.ids[self._idx].item()
+
+    @property
+    def vals(self) -> List[float]:
+        return self._points.coords[self._idx].tolist()
+
+    @property
+    def ground_truth(self) -> int:
+        return int(self._points.ground_truth[self._idx])
+
+    @ground_truth.setter
+    def ground_truth(self, value: int) -> None:
+        self._points.ground_truth[self._idx] = value
+
+    @property
+    def cluster_id(self) -> int:
+        return int(self._points.cluster_id[self._idx])
+
+    @cluster_id.setter
+    def cluster_id(self, value: int) -> None:
+        self._points.cluster_id[self._idx] = value
+
+    @property
+    def point_type(self) -> Optional[int]:
+        point_type = int(self._points.point_type[self._idx])
+        return None if point_type == _UNSET_POINT_TYPE else point_type
+
+    @point_type.setter
+    def point_type(self, value: Optional[int]) -> None:
+        self._points.point_type[self._idx] = (
+            _UNSET_POINT_TYPE if value is None else value
+        )
+
+    @property
+    def calc_ctr(self) -> int:
+        return int(self._points.calc_ctr[self._idx])
+
+    @calc_ctr.setter
+    def calc_ctr(self, value: int) -> None:
+        self._points.calc_ctr[self._idx] = value
+
+    @property
+    def min_eps(self) -> Optional[float]:
+        return self._optional_float(self._points.min_eps[self._idx])
+
+    @property
+    def max_eps(self) -> Optional[float]:
+        return self._optional_float(self._points.max_eps[self._idx])
+
+    @property
+    def k_plus_nn(self) -> Optional[List["PointView"]]:
+        return self._neighbours(self._points.k_plus_nn)
+
+    @property
+    def r_k_plus_nn(self) -> Optional[List["PointView"]]:
+        return self._neighbours(self._points.r_k_plus_nn)
+
+    @property
+    def eps_neighbours(self) -> Optional[List["PointView"]]:
+        return self._neighbours(self._points.eps_neighbours)
+
+    @staticmethod
+    def _optional_float(value: float) -> Optional[float]:
+        return None if np.isnan(value) else float(value)
+
+    def _neighbours(
+        self, neighbour_lists: Optional[NeighbourLists]
+    ) -> Optional[List["PointView"]]:
+        if neighbour_lists is None:
+            return None
+        return [
+            PointView(self._points, idx) for idx in neighbour_lists[self._idx].tolist()
+        ]
+
+    __str__ = Point.__str__
+    __repr__ = Point.__repr__
+    serialize_out = Point.serialize_out
+    serialize_debug = Point.serialize_debug
+    get_serialize_debug_header = Point.get_serialize_debug_header
+
+
+def load_points(dataset_path: str, cache: bool = True) -> PointSet:
+    """
+    Loads points (TSV with a header line) and their ground truth (path with
+    "points" replaced by "ground_truth", one label per line).
+
+    :param cache: If True, parsed arrays are saved next to the dataset as .npy
+        files, keyed by size and modification time of both input files, and
+        coordinates are memory-mapped from them on subsequent loads.
+    """
     gt_path = dataset_path.replace("points", "ground_truth")
-    with open(dataset_path, "r") as f:
-        points_lines = f.readlines()[1:]
-    with open(gt_path, "r") as f:
-        gt_lines = f.readlines()
-
-    assert len(points_lines) == len(gt_lines)
-
-    points = []
-    for idx, (point_line, gt_line) in enumerate(zip(points_lines, gt_lines)):
-        gt = int(gt_line.strip())
-        point_coords = [float(val) for val in point_line.strip().split("\t")]
-        points.append(Point(id=idx, vals=point_coords, ground_truth=gt))
-    return points
+    cache_paths = _points_cache_paths(dataset_path)
+    cache_key = _points_cache_key(dataset_path, gt_path)
+
+    if cache and _is_points_cache_valid(cache_paths, cache_key):
+        coords = np.load(cache_paths["coords"], mmap_mode="c")
+        ground_truth = np.load(cache_paths["ground_truth"])
+        return PointSet(coords, ground_truth=ground_truth)
+
+    coords = np.loadtxt(
+        dataset_path, dtype=np.float64, delimiter="\t", skiprows=1, ndmin=2
+    )
+    ground_truth = np.loadtxt(gt_path, dtype=np.int64, ndmin=1)
+
+    assert len(coords) == len(ground_truth)
+
+    if cache:
+        _save_points_cache(cache_paths, cache_key, coords, ground_truth)
+    return PointSet(coords, ground_truth=ground_truth)
+
+
+def _points_cache_paths(dataset_path: str) -> Dict[str, Path]:
+    path = Path(dataset_path)
+    return {
+        name: path.with_name(f".{path.name}.{name}{suffix}")
+        for name, suffix in (
+            ("key", ".json"),
+            ("coords", ".npy"),
+            ("ground_truth", ".npy"),
+        )
+    }
+
+
+def _points_cache_key(dataset_path: str, gt_path: str) -> Dict[str, List[int]]:
+    key = {}
+    for name, path in (("points", dataset_path), ("ground_truth", gt_path)):
+        stat = os.stat(path)
+        key[name] = [stat.st_size, stat.st_mtime_ns]
+    return key
+
+
+def _is_points_cache_valid(
+    cache_paths: Dict[str, Path], cache_key: Dict[str, List[int]]
+) -> bool:
+    try:
+        with cache_paths["key"].open("r") as f:
+            return json.load(f) == cache_key and all(
+                path.exists() for path in cache_paths.values()
+            )
+    except (OSError, ValueError):
+        return False
+
+
+def _save_points_cache(
+    cache_paths: Dict[str, Path],
+    cache_key: Dict[str, List[int]],
+    coords: np.ndarray,
+    ground_truth: np.ndarray,
+) -> None:
+    # Key is written last, so that interrupted writes leave an invalid cache
+    try:
+        cache_paths["key"].unlink(missing_ok=True)
+        for name, array in (("coords", coords), ("ground_truth", ground_truth)):
+            tmp_path = cache_paths[name].with_suffix(".tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, cache_paths[name])
+        with cache_paths["key"].open("w") as f:
+            json.dump(cache_key, f)
+    except OSError:
+        # Caching is optional, e.g. datasets may be on read-only storage
+        pass
 
 
 def distance_fn_generator(m: float) -> Callable[[Point, Point], float]:
@@ -11,7 +11,7 @@ from tqdm import tqdm
 @click.option("-o", "--output_csv", type=Path, required=True)
 def parse_stat_to_df(input_glob: str, output_csv: Path):
     df_rows = []
-    redundant_keys = ("TI_reference_point", "minkowski_power")
+    redundant_keys = ("TI_reference_point", "TI_reference_points", "minkowski_power")
 
     stat_files = list(Path(".").glob(input_glob))
     if len(stat_files) == 0: